@@ -0,0 +1,37 @@
+"""
+Benchmark scanning a local directory tree with different numbers of scan workers.
+Usage: python benchmarks/local_scan.py PATH [--workers 1 4 16]
+Point PATH at a large tree on the filesystem you upload from (the benefit of more workers depends on its latency).
+"""
+from __future__ import print_function
+import argparse
+import time
+from ddsc.core.localstore import LocalProject
+
+
+def count_items(item):
+    count = 0
+    pending = [item]
+    while pending:
+        item = pending.pop()
+        count += 1
+        pending.extend(getattr(item, 'children', []))
+    return count
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('path')
+    parser.add_argument('--workers', type=int, nargs='+', default=[1, 4, 16])
+    args = parser.parse_args()
+    for scan_workers in args.workers:
+        local_project = LocalProject(followsymlinks=False, file_exclude_regex='', scan_workers=scan_workers)
+        start = time.time()
+        local_project.add_path(args.path)
+        elapsed = time.time() - start
+        print("{} workers: scanned {} items in {:.2f} seconds".format(scan_workers, count_items(local_project),
+                                                                      elapsed))
+
+
+if __name__ == '__main__':
+    main()
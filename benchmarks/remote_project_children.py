@@ -0,0 +1,81 @@
+"""
+Benchmark building the remote project tree from a synthetic DukeDS project children listing.
+Usage: python benchmarks/remote_project_children.py [--items 1000000] [--folders 50000] [--max-seconds 60]
+Exits with a non-zero status if building the tree takes longer than --max-seconds.
+"""
+from __future__ import print_function
+import argparse
+import random
+import sys
+import time
+from ddsc.core.remotestore import RemoteProjectChildren
+
+PROJECT_ID = 'project'
+
+
+def make_listing(num_items, num_folders, seed=0):
+    """
+    Create a DukeDS style list of folder and file dictionaries with folders nested at random depths.
+    Items are shuffled since DukeDS does not return children in tree order.
+    :param num_items: int: total number of folders and files
+    :param num_folders: int: how many of the items are folders
+    :param seed: int: random seed so runs are comparable
+    :return: [dict]: project children data
+    """
+    rand = random.Random(seed)
+    data = []
+    folder_ids = []
+    for folder_num in range(num_folders):
+        folder_id = 'folder{}'.format(folder_num)
+        if folder_ids:
+            parent = {'kind': 'dds-folder', 'id': rand.choice(folder_ids)}
+        else:
+            parent = {'kind': 'dds-project', 'id': PROJECT_ID}
+        data.append({'kind': 'dds-folder', 'parent': parent, 'is_deleted': False, 'name': folder_id,
+                     'id': folder_id})
+        folder_ids.append(folder_id)
+    for file_num in range(num_items - num_folders):
+        file_id = 'file{}'.format(file_num)
+        parent_id = rand.choice(folder_ids) if folder_ids else PROJECT_ID
+        data.append({'kind': 'dds-file', 'parent': {'kind': 'dds-folder', 'id': parent_id}, 'is_deleted': False,
+                     'name': file_id, 'id': file_id,
+                     'current_version': {'id': 'v' + file_id,
+                                         'upload': {'size': 1, 'hash': {'algorithm': 'md5', 'value': 'abc'}}}})
+    rand.shuffle(data)
+    return data
+
+
+def count_items(children):
+    count = 0
+    pending = list(children)
+    while pending:
+        item = pending.pop()
+        count += 1
+        pending.extend(getattr(item, 'children', []))
+    return count
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--items', type=int, default=1000000)
+    parser.add_argument('--folders', type=int, default=50000)
+    parser.add_argument('--max-seconds', type=float, default=60.0)
+    args = parser.parse_args()
+
+    data = make_listing(args.items, args.folders)
+    start = time.time()
+    tree = RemoteProjectChildren(PROJECT_ID, data).get_tree()
+    elapsed = time.time() - start
+    num_items = count_items(tree)
+    print("Built tree of {} items ({} folders) in {:.2f} seconds".format(num_items, args.folders, elapsed))
+    if num_items != args.items:
+        print("Expected {} items in the tree".format(args.items))
+        return 1
+    if elapsed > args.max_seconds:
+        print("Slower than the allowed {} seconds".format(args.max_seconds))
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,86 @@
+"""
+Benchmark running many tiny network-bound tasks (like uploading small files) with the process and thread executors.
+Each task carries a context like the one passed to upload small files and sleeps to simulate waiting on DukeDS.
+Usage: python benchmarks/task_executor.py [--files 50000] [--workers 8] [--latency 0.002]
+"""
+from __future__ import print_function
+import argparse
+import time
+from ddsc.config import create_config
+from ddsc.core.parallel import TaskRunner, create_task_executor, PROCESS_EXECUTOR, THREAD_EXECUTOR
+
+
+class SimulatedUploadContext(object):
+    def __init__(self, config, params, message_queue, task_id):
+        self.config = config
+        self.params = params
+        self.message_queue = message_queue
+        self.task_id = task_id
+
+
+class SimulatedUploadCommand(object):
+    """
+    Command that mimics CreateSmallFileCommand without talking to DukeDS.
+    """
+    def __init__(self, config, path, latency):
+        self.config = config
+        self.path = path
+        self.latency = latency
+        self.func = simulated_upload_run
+        self.result = None
+
+    def before_run(self, parent_task_result):
+        pass
+
+    def create_context(self, message_queue, task_id):
+        return SimulatedUploadContext(self.config, (self.path, self.latency), message_queue, task_id)
+
+    def after_run(self, result):
+        self.result = result
+
+    def on_message(self, data):
+        pass
+
+
+def simulated_upload_run(context):
+    path, latency = context.params
+    time.sleep(latency)
+    return path
+
+
+def run_executor(executor_type, num_files, workers, latency):
+    """
+    Upload num_files simulated files using the specified executor type.
+    :return: float: seconds taken
+    """
+    config = create_config()
+    executor = create_task_executor(executor_type, workers)
+    runner = TaskRunner(executor)
+    commands = [SimulatedUploadCommand(config, '/data/sample{}.txt'.format(file_num), latency)
+                for file_num in range(num_files)]
+    for command in commands:
+        runner.add(None, command)
+    start = time.time()
+    runner.run()
+    elapsed = time.time() - start
+    executor.pool.close()
+    executor.pool.join()
+    if any(command.result is None for command in commands):
+        raise ValueError("Not all tasks finished.")
+    return elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--files', type=int, default=50000)
+    parser.add_argument('--workers', type=int, default=8)
+    parser.add_argument('--latency', type=float, default=0.002)
+    args = parser.parse_args()
+    for executor_type in [PROCESS_EXECUTOR, THREAD_EXECUTOR]:
+        elapsed = run_executor(executor_type, args.files, args.workers, args.latency)
+        print("{} executor: {} files in {:.2f} seconds ({:.0f} files/second)".format(
+            executor_type, args.files, elapsed, args.files / elapsed))
+
+
+if __name__ == '__main__':
+    main()
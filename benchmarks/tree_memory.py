@@ -0,0 +1,71 @@
+"""
+Benchmark the memory used per node by remote and local project trees.
+Usage: python benchmarks/tree_memory.py [--items 200000] [--folders 10000]
+Requires python 3 (uses tracemalloc).
+"""
+from __future__ import print_function
+import argparse
+import gc
+import os
+import sys
+import tracemalloc
+from ddsc.core.remotestore import RemoteProjectChildren
+from ddsc.core.localstore import LocalFolder, LocalFile
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from remote_project_children import make_listing, PROJECT_ID  # noqa: E402
+
+
+def measure(build):
+    """
+    Return the result of build() and the number of bytes it allocated that are still in use.
+    :param build: func(): creates the object to measure
+    :return: (object, int): result of build and bytes allocated
+    """
+    gc.collect()
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    result = build()
+    gc.collect()
+    after = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return result, after - before
+
+
+def build_remote_tree(num_items, num_folders):
+    data = make_listing(num_items, num_folders)
+    return measure(lambda: RemoteProjectChildren(PROJECT_ID, iter(data)).get_tree())[1]
+
+
+def build_local_tree(num_items, num_folders):
+    """
+    Build a local tree the way the filesystem walk does without touching the disk.
+    Files are given a size so they don't need to be stat-ed.
+    """
+    def build():
+        top = LocalFolder('/data/project')
+        folders = [top]
+        for folder_num in range(1, num_folders):
+            folder = LocalFolder(os.path.join(folders[folder_num // 10].path, 'results{}'.format(folder_num % 10)))
+            folders[folder_num // 10].add_child(folder)
+            folders.append(folder)
+        for file_num in range(num_items - num_folders):
+            parent = folders[file_num % num_folders]
+            parent.add_child(LocalFile(os.path.join(parent.path, 'sample{}.fastq.gz'.format(file_num)), size=100))
+        return top
+    return measure(build)[1]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--items', type=int, default=200000)
+    parser.add_argument('--folders', type=int, default=10000)
+    args = parser.parse_args()
+    remote_bytes = build_remote_tree(args.items, args.folders)
+    print("Remote tree: {} bytes per node".format(remote_bytes // args.items))
+    local_bytes = build_local_tree(args.items, args.folders)
+    print("Local tree: {} bytes per node".format(local_bytes // args.items))
+
+
+if __name__ == '__main__':
+    main()
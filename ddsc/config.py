@@ -19,10 +19,31 @@ D4S2_SERVICE_URL = 'https://d4s2.gcb.duke.edu/api/v1'
 MB_TO_BYTES = 1024 * 1024
 DDS_DEFAULT_UPLOAD_CHUNKS = 100 * MB_TO_BYTES
 AUTH_ENV_KEY_NAME = 'DUKE_DATA_SERVICE_AUTH'
-# when uploading skip .DS_Store, our key file, and ._ (resource fork metadata)
-FILE_EXCLUDE_REGEX_DEFAULT = '^\.DS_Store$|^\.ddsclient$|^\.\_'
+# when uploading skip .DS_Store, our key file, ._ (resource fork metadata) and manifests of unpacked bundles
+FILE_EXCLUDE_REGEX_DEFAULT = '^\.DS_Store$|^\.ddsclient$|^\.\_|^\.ddsclient-bundle\.json$'
 MAX_DEFAULT_WORKERS = 8
+UPLOAD_EXECUTOR_DEFAULT = 'process'  # upload projects, folders and small files in worker processes
+PROCESS_TRANSFER_ENGINE = 'process'  # send and receive file contents using a process per connection
+THREAD_TRANSFER_ENGINE = 'thread'  # send and receive file contents from many threads in this process
+TRANSFER_ENGINE_DEFAULT = PROCESS_TRANSFER_ENGINE
+TRANSFER_CONCURRENCY_DEFAULT = 64  # object store requests the thread engine makes at once
+TASK_SMALL_FILE_ENGINE = 'task'  # upload each small file as a single task run by upload_executor
+PIPELINE_SMALL_FILE_ENGINE = 'pipeline'  # upload small files through a pipeline of stages on threads in this process
+SMALL_FILE_ENGINE_DEFAULT = TASK_SMALL_FILE_ENGINE
+SMALL_FILE_PIPELINE_DEPTH_DEFAULT = 32  # small files the pipeline engine uploads at once
+UPLOAD_BUNDLE_MIN_FILES_DEFAULT = 100  # bundle a directory's tiny files once it has at least 100 of them
+OFF_DUPLICATE_FILES = 'off'  # do not hash local files to look for ones with the same contents
+UPLOAD_DUPLICATE_FILES = 'upload'  # upload every local file even when other files have the same contents
+SKIP_DUPLICATE_FILES = 'skip'  # upload a single copy of local files that have the same contents
+UPLOAD_DUPLICATE_FILES_DEFAULT = OFF_DUPLICATE_FILES
 GET_PAGE_SIZE_DEFAULT = 100  # fetch 100 items per page
+PAGE_FETCH_WORKERS_DEFAULT = 4  # fetch 4 pages at once
+SCAN_WORKERS_DEFAULT = 1  # read local directories on the current thread
+HASH_CACHE_FILENAME_DEFAULT = '~/.ddsclient.d/hash_cache.sqlite'
+HASH_CACHE_MAX_ITEMS_DEFAULT = 2000000
+UPLOAD_JOURNAL_FILENAME_DEFAULT = '~/.ddsclient.d/upload_journal.sqlite'
+HTTP_POOL_CONNECTIONS_DEFAULT = 10  # keep connections to 10 hosts
+HTTP_POOL_MAXSIZE_DEFAULT = 10  # keep up to 10 connections to each host
 
 
 def get_user_config_filename():
@@ -66,11 +87,32 @@ class Config(object):
     AUTH = 'auth'                                      # Holds actual auth token for connecting to the dataservice
     UPLOAD_BYTES_PER_CHUNK = 'upload_bytes_per_chunk'  # bytes per chunk we will upload
     UPLOAD_WORKERS = 'upload_workers'                  # how many worker processes used for uploading
+    UPLOAD_BYTES_IN_FLIGHT = 'upload_bytes_in_flight'  # max bytes of file chunks queued while uploading
+    UPLOAD_STREAM_CHUNKS_OVER = 'upload_stream_chunks_over'  # chunks larger than this are streamed from disk
+    UPLOAD_EXECUTOR = 'upload_executor'                # run project/folder/small file uploads in processes or threads
+    TRANSFER_ENGINE = 'transfer_engine'                # send/receive large file contents with processes or threads
+    TRANSFER_CONCURRENCY = 'transfer_concurrency'      # max object store requests at once with the thread engine
+    SMALL_FILE_ENGINE = 'small_file_engine'            # upload small files as separate tasks or through a pipeline
+    SMALL_FILE_PIPELINE_DEPTH = 'small_file_pipeline_depth'  # max small files in the upload pipeline at once
+    UPLOAD_BUNDLE_MAX_FILE_SIZE = 'upload_bundle_max_file_size'  # files this size or smaller are uploaded in bundles
+    UPLOAD_BUNDLE_MIN_FILES = 'upload_bundle_min_files'  # tiny files a directory needs before they are bundled
+    UPLOAD_DUPLICATE_FILES = 'upload_duplicate_files'  # look for, upload or skip copies of files with the same contents
     DOWNLOAD_WORKERS = 'download_workers'              # how many worker processes used for downloading
+    DOWNLOAD_BYTES_IN_FLIGHT = 'download_bytes_in_flight'  # max bytes of file ranges queued while downloading
     DEBUG_MODE = 'debug'                               # show stack traces
     D4S2_URL = 'd4s2_url'                              # url for use with the D4S2 (share/deliver service)
     FILE_EXCLUDE_REGEX = 'file_exclude_regex'          # allows customization of which filenames will be uploaded
     GET_PAGE_SIZE = 'get_page_size'                    # page size used for GET pagination requests
+    PAGE_FETCH_WORKERS = 'page_fetch_workers'          # max number of pages fetched at once for GET pagination
+    SCAN_WORKERS = 'scan_workers'                      # number of threads reading local directories before upload
+    HASH_WORKERS = 'hash_workers'                      # number of threads hashing local files to find changes
+    HASH_CACHE_FILENAME = 'hash_cache_filename'        # sqlite file used to cache file hashes (empty to disable)
+    HASH_CACHE_MAX_ITEMS = 'hash_cache_max_items'      # max number of file hashes to keep in the cache
+    HASH_CACHE_TRUST_MTIME = 'hash_cache_trust_mtime'  # use cached hashes when only size and mtime match
+    UPLOAD_JOURNAL_FILENAME = 'upload_journal_filename'  # sqlite file used to resume uploads (empty to disable)
+    HTTP_POOL_CONNECTIONS = 'http_pool_connections'    # number of hosts each process keeps connections open to
+    HTTP_POOL_MAXSIZE = 'http_pool_maxsize'            # max connections each process keeps open to a host
+    HTTP_TCP_KEEP_ALIVE = 'http_tcp_keep_alive'        # send TCP keep-alive probes on open connections
 
     def __init__(self):
         self.values = {}
@@ -151,6 +193,96 @@ class Config(object):
         """
         return self.values.get(Config.UPLOAD_WORKERS, default_num_workers())
 
+    @property
+    def upload_executor(self):
+        """
+        Return how project, folder and small file upload tasks are run.
+        'process' runs them in worker processes, 'thread' runs them in threads within this process.
+        :return: str: 'process' or 'thread'
+        """
+        return self.values.get(Config.UPLOAD_EXECUTOR, UPLOAD_EXECUTOR_DEFAULT)
+
+    @property
+    def transfer_engine(self):
+        """
+        Return how the contents of large uploaded files and downloaded files are transferred.
+        'process' uses a worker process per connection, 'thread' uses many connections from threads in this process.
+        :return: str: 'process' or 'thread'
+        """
+        return self.values.get(Config.TRANSFER_ENGINE, TRANSFER_ENGINE_DEFAULT)
+
+    @property
+    def transfer_concurrency(self):
+        """
+        Return the max number of chunks or file ranges the thread transfer engine sends or receives at once.
+        :return: int: number of concurrent object store requests
+        """
+        return int(self.values.get(Config.TRANSFER_CONCURRENCY, TRANSFER_CONCURRENCY_DEFAULT))
+
+    @property
+    def small_file_engine(self):
+        """
+        Return how files small enough to be sent in a single chunk are uploaded.
+        'task' runs each file as a task of upload_executor, 'pipeline' overlaps the stages of many files on threads.
+        :return: str: 'task' or 'pipeline'
+        """
+        return self.values.get(Config.SMALL_FILE_ENGINE, SMALL_FILE_ENGINE_DEFAULT)
+
+    @property
+    def small_file_pipeline_depth(self):
+        """
+        Return the max number of small files the pipeline engine uploads at once.
+        :return: int: number of files in the pipeline
+        """
+        return int(self.values.get(Config.SMALL_FILE_PIPELINE_DEPTH, SMALL_FILE_PIPELINE_DEPTH_DEFAULT))
+
+    @property
+    def upload_bundle_max_file_size(self):
+        """
+        Return the size of files small enough to be uploaded within a bundle (a tar file per directory).
+        :return: int bytes or None when files are not bundled
+        """
+        value = self.values.get(Config.UPLOAD_BUNDLE_MAX_FILE_SIZE, None)
+        if value is None:
+            return None
+        return Config.parse_bytes_str(value)
+
+    @property
+    def upload_bundle_min_files(self):
+        """
+        Return how many files of upload_bundle_max_file_size or smaller a directory must have to be bundled.
+        :return: int: number of files
+        """
+        return int(self.values.get(Config.UPLOAD_BUNDLE_MIN_FILES, UPLOAD_BUNDLE_MIN_FILES_DEFAULT))
+
+    @property
+    def upload_duplicate_files(self):
+        """
+        Return what to do with local files whose contents are the same as another file being uploaded.
+        'off' does not look for such files, 'upload' sends every copy (warning about them),
+        'skip' sends only the first copy. Looking for copies hashes local files that have the same size.
+        :return: str: 'off', 'upload' or 'skip'
+        """
+        return self.values.get(Config.UPLOAD_DUPLICATE_FILES, UPLOAD_DUPLICATE_FILES_DEFAULT)
+
+    @property
+    def upload_bytes_in_flight(self):
+        """
+        Return the max bytes of chunks queued to be sent across all files while uploading.
+        :return: int bytes or None to allow a couple chunks per upload worker
+        """
+        value = self.values.get(Config.UPLOAD_BYTES_IN_FLIGHT, None)
+        return Config.parse_bytes_str(value)
+
+    @property
+    def upload_stream_chunks_over(self):
+        """
+        Return the size above which chunks are streamed from disk (reading them twice) instead of being held in memory.
+        :return: int bytes or None to hold every chunk in memory while it is sent
+        """
+        value = self.values.get(Config.UPLOAD_STREAM_CHUNKS_OVER, None)
+        return Config.parse_bytes_str(value)
+
     @property
     def download_workers(self):
         """
@@ -161,6 +293,15 @@ class Config(object):
         default_workers = int(math.ceil(default_num_workers() / 2))
         return self.values.get(Config.DOWNLOAD_WORKERS, default_workers)
 
+    @property
+    def download_bytes_in_flight(self):
+        """
+        Return the max bytes of file ranges to have queued for download workers at once.
+        :return: int bytes or None to only limit the number of ranges queued per download worker
+        """
+        value = self.values.get(Config.DOWNLOAD_BYTES_IN_FLIGHT, None)
+        return Config.parse_bytes_str(value)
+
     @property
     def debug_mode(self):
         """
@@ -209,3 +350,90 @@ class Config(object):
         :return:
         """
         return self.values.get(Config.GET_PAGE_SIZE, GET_PAGE_SIZE_DEFAULT)
+
+    @property
+    def page_fetch_workers(self):
+        """
+        Returns the max number of pages of a paginated list fetched from DukeDS at once.
+        Fewer pages are fetched at once when DukeDS is overloaded. Setting this to 1 fetches pages one at a time.
+        :return: int: max number of concurrent page requests
+        """
+        return max(int(self.values.get(Config.PAGE_FETCH_WORKERS, PAGE_FETCH_WORKERS_DEFAULT)), 1)
+
+    @property
+    def scan_workers(self):
+        """
+        Returns the number of threads used to read local directories when finding files to upload.
+        Values above 1 help on network filesystems where reading a directory is slow.
+        :return: int: number of directory reading threads
+        """
+        return max(int(self.values.get(Config.SCAN_WORKERS, SCAN_WORKERS_DEFAULT)), 1)
+
+    @property
+    def hash_workers(self):
+        """
+        Returns the number of threads used to hash local files when checking which files have changed.
+        Defaults to the number of CPUs (max 8). Setting this to 1 hashes one file at a time.
+        :return: int: number of hashing threads
+        """
+        return max(int(self.values.get(Config.HASH_WORKERS, default_num_workers())), 1)
+
+    @property
+    def hash_cache_filename(self):
+        """
+        Returns the path to the file used to cache hashes of local files.
+        When empty no hashes will be cached.
+        :return: str: path to sqlite hash cache file
+        """
+        return self.values.get(Config.HASH_CACHE_FILENAME, HASH_CACHE_FILENAME_DEFAULT)
+
+    @property
+    def hash_cache_max_items(self):
+        """
+        Returns the number of file hashes to keep in the cache before removing the least recently used.
+        :return: int: max number of cached hashes
+        """
+        return int(self.values.get(Config.HASH_CACHE_MAX_ITEMS, HASH_CACHE_MAX_ITEMS_DEFAULT))
+
+    @property
+    def hash_cache_trust_mtime(self):
+        """
+        Returns True if cached hashes should be used when a file's size and modification time match
+        even though its inode or device changed (such as trees copied with rsync -a or on network filesystems).
+        :return: bool: trust size and modification time
+        """
+        return bool(self.values.get(Config.HASH_CACHE_TRUST_MTIME, False))
+
+    @property
+    def upload_journal_filename(self):
+        """
+        Returns the path to the file used to record progress of large file uploads so they can be resumed.
+        When empty interrupted uploads will start over.
+        :return: str: path to sqlite upload journal file
+        """
+        return self.values.get(Config.UPLOAD_JOURNAL_FILENAME, UPLOAD_JOURNAL_FILENAME_DEFAULT)
+
+    @property
+    def http_pool_connections(self):
+        """
+        Returns the number of hosts each process keeps open connections to (DukeDS and external stores).
+        :return: int: number of connection pools
+        """
+        return int(self.values.get(Config.HTTP_POOL_CONNECTIONS, HTTP_POOL_CONNECTIONS_DEFAULT))
+
+    @property
+    def http_pool_maxsize(self):
+        """
+        Returns the max number of connections each process keeps open to a single host.
+        :return: int: connections per host
+        """
+        return int(self.values.get(Config.HTTP_POOL_MAXSIZE, HTTP_POOL_MAXSIZE_DEFAULT))
+
+    @property
+    def http_tcp_keep_alive(self):
+        """
+        Returns True if TCP keep-alive probes should be sent on open connections so idle connections
+        are not dropped by firewalls between requests.
+        :return: bool: use TCP keep-alive
+        """
+        return bool(self.values.get(Config.HTTP_TCP_KEEP_ALIVE, True))
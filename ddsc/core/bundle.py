@@ -0,0 +1,361 @@
+"""
+Bundles directories holding many tiny files into a single tar file so they are uploaded (and later downloaded)
+as one DukeDS file instead of paying the per file API overhead for each of them.
+Each bundle holds the tiny files directly within one directory followed by a json manifest listing their names,
+sizes and hashes. Bundles are built the same way every time so an unchanged directory produces an identical
+bundle which will not be sent again.
+Bundles are planned (hashed without being written) when comparing with the remote project, the tar files are only
+written to a temporary directory when they are uploaded.
+When a bundle is unpacked its manifest (along with the bundle's hash) is kept in the directory so later downloads
+can skip bundles whose files are already there.
+"""
+import atexit
+import io
+import json
+import os
+import shutil
+import tarfile
+import tempfile
+from ddsc.core.localstore import LocalFile, PathData, HashData, HashUtil, HASH_FILE_BLOCK_SIZE
+
+BUNDLE_FILENAME = '.ddsclient-bundle.tar'
+BUNDLE_MANIFEST_NAME = '.ddsclient-bundle.json'
+BUNDLE_MANIFEST_VERSION = 1
+BUNDLE_STAGING_PREFIX = '.ddsclient-bundle-'
+
+
+class LocalBundleFile(LocalFile):
+    """
+    A tar file built from the tiny files within a LocalFolder that is uploaded in their place.
+    Its path is where it appears within the folder (as it is named in reports and DukeDS) while the tar file itself
+    is written to bundle_path in a temporary directory by write_bundles.
+    """
+    __slots__ = ['bundle_path', 'bundled_files', 'hash_data']
+
+    def __init__(self, bundled_files, hash_data, size):
+        """
+        :param bundled_files: [LocalFile]: files contained in the tar file sorted by name
+        :param hash_data: HashData: hash of the tar file
+        :param size: int: size of the tar file
+        """
+        super(LocalBundleFile, self).__init__(BUNDLE_FILENAME, size)
+        self.bundle_path = None
+        self.bundled_files = bundled_files
+        self.hash_data = hash_data
+
+    def get_path_data(self):
+        """
+        Return PathData for the tar file, until it has been written only its name and hash are available.
+        """
+        if self._path_data is None:
+            self._path_data = PathData(self.bundle_path if self.bundle_path else self.path)
+            self._path_data.hash_data = self.hash_data
+        return self._path_data
+
+    def set_bundle_path(self, bundle_path):
+        """
+        Record where the tar file has been written.
+        :param bundle_path: str: path to the tar file
+        """
+        self.bundle_path = bundle_path
+        self._path_data = None
+
+
+class _HashingReader(object):
+    """
+    Hashes the data read from a file.
+    """
+    def __init__(self, infile):
+        self.infile = infile
+        self.hash_util = HashUtil()
+
+    def read(self, size=-1):
+        data = self.infile.read(size)
+        self.hash_util.add_chunk(data)
+        return data
+
+
+class _HashingWriter(object):
+    """
+    Hashes and counts the data written to a file, when outfile is None the data is only hashed.
+    """
+    def __init__(self, outfile=None):
+        self.outfile = outfile
+        self.hash_util = HashUtil()
+        self.size = 0
+
+    def write(self, data):
+        self.hash_util.add_chunk(data)
+        self.size += len(data)
+        if self.outfile:
+            self.outfile.write(data)
+        return len(data)
+
+
+def bundle_small_files(local_project, max_file_size, min_files):
+    """
+    Replace the tiny files within each folder of local_project that has at least min_files of them with a
+    LocalBundleFile containing them. The tiny files are read to hash the bundles but no tar files are written.
+    :param local_project: LocalProject: project whose folders we will bundle
+    :param max_file_size: int: files this size or smaller are bundled
+    :param min_files: int: number of tiny files a folder must contain for them to be bundled
+    :return: [LocalBundleFile]: bundles that were planned
+    """
+    bundles = []
+    folders = [child for child in local_project.children if not child.is_file]
+    while folders:
+        folder = folders.pop()
+        folders.extend([child for child in folder.children if not child.is_file])
+        tiny_files = [child for child in folder.children if child.is_file and child.size <= max_file_size]
+        has_bundle = any(child.name == BUNDLE_FILENAME for child in folder.children)
+        if len(tiny_files) >= max(min_files, 1) and not has_bundle:
+            bundle = create_bundle(tiny_files)
+            tiny_file_set = set(tiny_files)
+            folder.children = [child for child in folder.children if child not in tiny_file_set]
+            folder.add_child(bundle)
+            bundles.append(bundle)
+    return bundles
+
+
+def write_bundles(bundles):
+    """
+    Write the tar files for bundles that need to be sent into a temporary directory removed when we exit.
+    Raises ValueError if the files in a bundle changed since it was planned.
+    :param bundles: [LocalBundleFile]: bundles created by bundle_small_files
+    """
+    bundles = [bundle for bundle in bundles if bundle.need_to_send]
+    if bundles:
+        bundle_directory = _create_bundle_directory()
+        for bundle_num, bundle in enumerate(bundles):
+            write_bundle(bundle, os.path.join(bundle_directory, str(bundle_num), BUNDLE_FILENAME))
+
+
+def _create_bundle_directory():
+    """
+    Create a temporary directory to hold bundles that is removed when we exit.
+    :return: str: path to the directory
+    """
+    bundle_directory = tempfile.mkdtemp(prefix='ddsclient-bundles-')
+    atexit.register(shutil.rmtree, bundle_directory, True)
+    return bundle_directory
+
+
+def create_bundle(local_files):
+    """
+    Create a bundle of local_files by hashing the tar file they make without writing it.
+    :param local_files: [LocalFile]: files to add to the tar file
+    :return: LocalBundleFile: the bundle
+    """
+    local_files = sorted(local_files, key=lambda local_file: local_file.name)
+    writer = _HashingWriter()
+    _write_tar(writer, local_files)
+    return LocalBundleFile(local_files, HashData.create_from_hash_util(writer.hash_util), writer.size)
+
+
+def write_bundle(bundle, bundle_path):
+    """
+    Write the tar file for bundle to bundle_path.
+    Raises ValueError if the files in the bundle changed since it was created.
+    :param bundle: LocalBundleFile: bundle to write
+    :param bundle_path: str: path to the tar file to create (its directory is created if necessary)
+    """
+    bundle_directory = os.path.dirname(bundle_path)
+    if not os.path.exists(bundle_directory):
+        os.makedirs(bundle_directory)
+    with io.open(bundle_path, 'wb') as outfile:
+        writer = _HashingWriter(outfile)
+        _write_tar(writer, bundle.bundled_files)
+    hash_data = HashData.create_from_hash_util(writer.hash_util)
+    if writer.size != bundle.size or not hash_data.matches(bundle.hash_data.alg, bundle.hash_data.value):
+        raise ValueError("Files bundled into {} changed while they were being uploaded.".format(bundle.path))
+    bundle.set_bundle_path(bundle_path)
+
+
+def _write_tar(writer, local_files):
+    """
+    Stream local_files into a tar file followed by a manifest of their hashes.
+    Members are in the order given and only keep their permissions so the same files always create the same tar file.
+    :param writer: _HashingWriter: where to write the tar file
+    :param local_files: [LocalFile]: files to add to the tar file sorted by name
+    """
+    with tarfile.open(fileobj=writer, mode='w|', format=tarfile.PAX_FORMAT) as tar:
+        manifest_files = [_add_file(tar, local_file) for local_file in local_files]
+        manifest = json.dumps({
+            'version': BUNDLE_MANIFEST_VERSION,
+            'files': manifest_files,
+        }, sort_keys=True).encode('utf-8')
+        tar.addfile(_create_tar_info(BUNDLE_MANIFEST_NAME, len(manifest), 0o644), io.BytesIO(manifest))
+
+
+def _add_file(tar, local_file):
+    """
+    Stream the contents of local_file into tar hashing them along the way.
+    :param tar: tarfile.TarFile: tar file we are writing
+    :param local_file: LocalFile: file to add
+    :return: dict: manifest entry for the file
+    """
+    with io.open(local_file.path, 'rb') as infile:
+        stat_info = os.fstat(infile.fileno())
+        reader = _HashingReader(infile)
+        tar.addfile(_create_tar_info(local_file.name, stat_info.st_size, stat_info.st_mode & 0o777), reader)
+    hash_alg, hash_value = reader.hash_util.hexdigest()
+    return {'name': local_file.name, 'size': stat_info.st_size, 'hash_alg': hash_alg, 'hash_value': hash_value}
+
+
+def _create_tar_info(name, size, mode):
+    tar_info = tarfile.TarInfo(name)
+    tar_info.size = size
+    tar_info.mode = mode
+    tar_info.mtime = 0
+    return tar_info
+
+
+def is_bundle(remote_file):
+    """
+    Is remote_file a bundle of tiny files created by bundle_small_files.
+    :param remote_file: RemoteFile: file to check
+    :return: bool: True if the file should be unpacked after downloading
+    """
+    return remote_file.name == BUNDLE_FILENAME
+
+
+def is_unpacked(remote_file, dest_directory):
+    """
+    Have the files in bundle remote_file already been unpacked into dest_directory and not changed since.
+    Checks the files against the manifest unpack_bundle kept in dest_directory.
+    :param remote_file: RemoteFile: bundle we are about to download
+    :param dest_directory: str: directory the bundle would be unpacked into
+    :return: bool: True if the bundle doesn't need to be downloaded
+    """
+    manifest_path = os.path.join(dest_directory, BUNDLE_MANIFEST_NAME)
+    if not os.path.isfile(manifest_path):
+        return False
+    try:
+        with io.open(manifest_path, 'rb') as infile:
+            manifest = json.loads(infile.read().decode('utf-8'))
+        bundle = manifest['bundle']
+        files = manifest['files']
+    except (ValueError, KeyError, TypeError):
+        return False
+    if bundle.get('size') != remote_file.size or \
+            not HashData(bundle.get('hash_alg'), bundle.get('hash_value')).matches(remote_file.hash_alg,
+                                                                                   remote_file.file_hash):
+        return False
+    for manifest_file in files:
+        path = os.path.join(dest_directory, manifest_file['name'])
+        if not os.path.isfile(path) or os.path.getsize(path) != manifest_file['size']:
+            return False
+        if not _is_unchanged(path, HashData(manifest_file['hash_alg'], manifest_file['hash_value'])):
+            return False
+    return True
+
+
+def unpack_bundle(bundle_path, dest_directory):
+    """
+    Extract the files in a bundle into dest_directory checking them against the bundle's manifest.
+    Files are extracted into a staging directory first and only moved into place once the whole bundle has been
+    checked. Files already in dest_directory with the same contents are left alone.
+    The manifest and the bundle's hash are then saved in dest_directory for is_unpacked.
+    Raises ValueError if the bundle contains anything other than plain files, doesn't match its manifest or
+    dest_directory already has a different file with the same name as one in the bundle.
+    :param bundle_path: str: path to the downloaded tar file
+    :param dest_directory: str: directory to write the files into
+    :return: [str]: names of the files in the bundle
+    """
+    staging_directory = tempfile.mkdtemp(prefix=BUNDLE_STAGING_PREFIX, dir=dest_directory)
+    try:
+        extracted, manifest, bundle_hash_data = _extract_bundle(bundle_path, staging_directory)
+        names = sorted(extracted.keys())
+        unchanged_names = set(name for name in names
+                              if _is_unchanged(os.path.join(dest_directory, name), extracted[name]))
+        for name in names:
+            if name not in unchanged_names and os.path.lexists(os.path.join(dest_directory, name)):
+                raise ValueError("Unable to unpack {} from bundle {}, a different {} already exists.".format(
+                    name, bundle_path, os.path.join(dest_directory, name)))
+        for name in names:
+            if name not in unchanged_names:
+                os.rename(os.path.join(staging_directory, name), os.path.join(dest_directory, name))
+        _save_manifest(dest_directory, manifest, bundle_hash_data, os.path.getsize(bundle_path))
+        return names
+    finally:
+        shutil.rmtree(staging_directory, True)
+
+
+def _extract_bundle(bundle_path, dest_directory):
+    """
+    Extract the files in a bundle into dest_directory checking them against the bundle's manifest.
+    :return: (dict, dict, HashData): name to HashData of the files extracted, the manifest and hash of the bundle
+    """
+    extracted = {}
+    manifest = None
+    with io.open(bundle_path, 'rb') as infile:
+        reader = _HashingReader(infile)
+        with tarfile.open(fileobj=reader, mode='r|') as tar:
+            for member in tar:
+                if member.name == BUNDLE_MANIFEST_NAME:
+                    manifest = json.loads(tar.extractfile(member).read().decode('utf-8'))
+                else:
+                    _check_member(bundle_path, member)
+                    extracted[member.name] = _extract_member(tar, member, dest_directory)
+        # hash the end of the tar file the tarfile module doesn't need to read
+        while reader.read(HASH_FILE_BLOCK_SIZE):
+            pass
+    if manifest is None:
+        raise ValueError("Bundle {} is missing its manifest.".format(bundle_path))
+    for manifest_file in manifest['files']:
+        hash_data = extracted.get(manifest_file['name'])
+        if not hash_data or not hash_data.matches(manifest_file['hash_alg'], manifest_file['hash_value']):
+            raise ValueError("File {} in bundle {} does not match the bundle's manifest.".format(
+                manifest_file['name'], bundle_path))
+    return extracted, manifest, HashData.create_from_hash_util(reader.hash_util)
+
+
+def _save_manifest(dest_directory, manifest, bundle_hash_data, bundle_size):
+    """
+    Save the manifest of a bundle that has been unpacked into dest_directory along with the bundle's hash and size.
+    """
+    saved_manifest = dict(manifest)
+    saved_manifest['bundle'] = {
+        'size': bundle_size,
+        'hash_alg': bundle_hash_data.alg,
+        'hash_value': bundle_hash_data.value,
+    }
+    with io.open(os.path.join(dest_directory, BUNDLE_MANIFEST_NAME), 'wb') as outfile:
+        outfile.write(json.dumps(saved_manifest, sort_keys=True).encode('utf-8'))
+
+
+def _is_unchanged(path, hash_data):
+    """
+    Is there already a regular file at path with contents matching hash_data.
+    """
+    if not os.path.isfile(path) or os.path.islink(path):
+        return False
+    return HashData.create_from_path(path).matches(hash_data.alg, hash_data.value)
+
+
+def _check_member(bundle_path, member):
+    """
+    Raise ValueError unless member is a plain file that will be written directly within the destination directory.
+    """
+    name = member.name
+    if not member.isfile() or '/' in name or os.sep in name or name in ('', '.', '..'):
+        raise ValueError("Bundle {} contains invalid item {}.".format(bundle_path, name))
+
+
+def _extract_member(tar, member, dest_directory):
+    """
+    Write the contents of member into dest_directory.
+    :return: HashData: hash of the contents written
+    """
+    path = os.path.join(dest_directory, member.name)
+    hash_util = HashUtil()
+    infile = tar.extractfile(member)
+    with io.open(path, 'wb') as outfile:
+        while True:
+            data = infile.read(HASH_FILE_BLOCK_SIZE)
+            if not data:
+                break
+            hash_util.add_chunk(data)
+            outfile.write(data)
+    os.chmod(path, member.mode & 0o777)
+    return HashData.create_from_hash_util(hash_util)
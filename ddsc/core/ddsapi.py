@@ -4,7 +4,10 @@ import json
 import requests
 import time
 import datetime
+import threading
+from six.moves import queue
 from ddsc.config import get_user_config_filename
+from ddsc.core.httpsession import get_requests_session, reset_requests_session
 from ddsc.versioncheck import APP_NAME, get_internal_version_str
 
 AUTH_TOKEN_CLOCK_SKEW_MAX = 5 * 60  # 5 minutes
@@ -16,6 +19,10 @@ The operation will be retried automatically, so no action is required. It will c
 
 To cancel this operation, press Ctrl+C.
 """
+PAGE_FETCH_OVERLOAD_STATUS_CODES = (429, 503)
+PAGE_FETCH_RETRY_SECONDS = 2  # wait before retrying a page after the service was overloaded
+PAGE_FETCH_MAX_RETRIES = 3  # after this many failures a page is fetched waiting for the service to come back
+PAGES_AHEAD_PER_WORKER = 2  # max pages fetched or being fetched ahead of the page we are waiting on
 
 
 def get_user_agent_str():
@@ -201,21 +208,21 @@ class DataServiceApi(object):
         Setup for REST api.
         :param auth: str auth token to be send via Authorization header
         :param url: str root url of the data service
-        :param http: object requests style http object to do get/post/put (defaults to new requests Session)
+        :param http: object requests style http object to do get/post/put (defaults to this process's shared session)
         """
         self.auth = auth
         self.set_status_msg = auth.set_status_msg
         self.base_url = url
         self.http = http
         if not self.http:
-            self.recreate_requests_session()
+            self.http = get_requests_session()
         self.user_agent_str = get_user_agent_str()
 
     def recreate_requests_session(self):
         """
         Recreate our requests session ( for example in response to connection failures)
         """
-        self.http = requests.Session()
+        self.http = reset_requests_session()
 
     def _url_parts(self, url_suffix, data, content_type):
         """
@@ -289,6 +296,16 @@ class DataServiceApi(object):
         :param page_num: int: page number to fetch
         :return: requests.Response containing the result
         """
+        return self._fetch_page(url_suffix, data, page_num)
+
+    def _fetch_page(self, url_suffix, data, page_num):
+        """
+        Send GET request for a single page without retrying when the service is down.
+        :param url_suffix: str URL path we are sending a GET to
+        :param data: object data we are sending
+        :param page_num: int: page number to fetch
+        :return: requests.Response containing the result
+        """
         data_with_per_page = dict(data)
         data_with_per_page['page'] = page_num
         data_with_per_page['per_page'] = self._get_page_size()
@@ -302,6 +319,7 @@ class DataServiceApi(object):
         Performs GET for all pages based on x-total-pages in first response headers.
         Merges the json() 'results' arrays.
         If x-total-pages is missing or 1 just returns the response without fetching multiple pages.
+        The remaining pages are fetched concurrently based on config.page_fetch_workers.
         :param url_suffix: str URL path we are sending a GET to
         :param data: object data we are sending
         :return: requests.Response containing the result
@@ -312,12 +330,44 @@ class DataServiceApi(object):
             total_pages = int(total_pages_str)
             if total_pages > 1:
                 multi_response = MultiJSONResponse(base_response=response, merge_array_field_name="results")
-                for page in range(2, total_pages + 1):
-                    additional_response = self._get_single_page(url_suffix, data, page_num=page)
+                page_nums = range(2, total_pages + 1)
+                page_fetch_workers = self._get_page_fetch_workers()
+                if page_fetch_workers > 1 and total_pages > 2:
+                    page_fetcher = ConcurrentPageFetcher(self, url_suffix, data, page_fetch_workers)
+                    additional_responses = page_fetcher.run(page_nums)
+                else:
+                    additional_responses = [self._get_single_page(url_suffix, data, page_num=page)
+                                            for page in page_nums]
+                for additional_response in additional_responses:
                     multi_response.add_response(additional_response)
                 return multi_response
         return response
 
+    def _iterate_collection(self, url_suffix, data):
+        """
+        Performs GET for all pages based on x-total-pages in first response headers yielding the items in
+        each page's json() 'results' array. Only a few pages are held in memory at once.
+        The remaining pages are fetched concurrently based on config.page_fetch_workers.
+        :param url_suffix: str URL path we are sending a GET to
+        :param data: object data we are sending
+        :return: generator of dict: items from all pages in order
+        """
+        response = self._get_single_page(url_suffix, data, page_num=1)
+        total_pages = int(response.headers.get('x-total-pages') or 1)
+        for item in response.json()['results']:
+            yield item
+        del response
+        page_nums = list(range(2, total_pages + 1))
+        page_fetch_workers = self._get_page_fetch_workers()
+        if page_fetch_workers > 1 and len(page_nums) > 1:
+            page_fetcher = ConcurrentPageFetcher(self, url_suffix, data, page_fetch_workers)
+            responses = page_fetcher.iterate(page_nums)
+        else:
+            responses = (self._get_single_page(url_suffix, data, page_num=page) for page in page_nums)
+        for response in responses:
+            for item in response.json()['results']:
+                yield item
+
     @retry_when_service_down
     def _delete(self, url_suffix, data, content_type=ContentType.json):
         """
@@ -418,6 +468,17 @@ class DataServiceApi(object):
         """
         return self._get_children('projects', project_id, name_contains, exclude_response_fields)
 
+    def iterate_project_children(self, project_id, name_contains, exclude_response_fields=None):
+        """
+        Send GET to /projects/{project_id}/children yielding each item as the pages are received.
+        :param project_id: str uuid of the project
+        :param name_contains: str name to filter folders by (if not None this method works recursively)
+        :param exclude_response_fields: [str]: list of fields to exclude in the response items
+        :return: generator of dict: file and folder items
+        """
+        url_prefix, data = self._children_url_and_data('projects', project_id, name_contains, exclude_response_fields)
+        return self._iterate_collection(url_prefix, data)
+
     def get_folder_children(self, folder_id, name_contains):
         """
         Send GET to /folders/{folder_id} filtering by a name.
@@ -436,36 +497,51 @@ class DataServiceApi(object):
         :param exclude_response_fields: [str]: list of fields to exclude in the response items
         :return: requests.Response containing the successful result
         """
+        url_prefix, data = self._children_url_and_data(parent_name, parent_id, name_contains, exclude_response_fields)
+        return self._get_collection(url_prefix, data)
+
+    @staticmethod
+    def _children_url_and_data(parent_name, parent_id, name_contains, exclude_response_fields):
+        """
+        Create the url and data to GET /<parent_name>/<parent_id>/children.
+        :param parent_name: str 'projects' or 'folders'
+        :param parent_id: str uuid of project or folder
+        :param name_contains: name filtering (if not None this method works recursively)
+        :param exclude_response_fields: [str]: list of fields to exclude in the response items
+        :return: str, dict: url suffix and data to send
+        """
         data = {}
         if name_contains is not None:
             data['name_contains'] = name_contains
         if exclude_response_fields:
             data['exclude_response_fields'] = ' '.join(exclude_response_fields)
         url_prefix = "/{}/{}/children".format(parent_name, parent_id)
-        return self._get_collection(url_prefix, data)
+        return url_prefix, data
 
     def create_upload(self, project_id, filename, content_type, size,
-                      hash_value, hash_alg):
+                      hash_value=None, hash_alg=None):
         """
         Post to /projects/{project_id}/uploads to create a uuid for uploading chunks.
         NOTE: The optional hash_value and hash_alg parameters are being removed from the DukeDS API.
+        The file hash is always sent when completing the upload so these may be omitted.
         :param project_id: str uuid of the project we are uploading data for.
         :param filename: str name of the file we want to upload
         :param content_type: str mime type of the file
         :param size: int size of the file in bytes
-        :param hash_value: str hash value of the entire file
-        :param hash_alg: str algorithm used to create hash_value
+        :param hash_value: str hash value of the entire file (optional)
+        :param hash_alg: str algorithm used to create hash_value (optional)
         :return: requests.Response containing the successful result
         """
         data = {
             "name": filename,
             "content_type": content_type,
             "size": size,
-            "hash": {
+        }
+        if hash_value:
+            data["hash"] = {
                 "value": hash_value,
                 "algorithm": hash_alg
             }
-        }
         return self._post("/projects/" + project_id + "/uploads", data)
 
     def create_upload_url(self, upload_id, number, size, hash_value, hash_alg):
@@ -488,6 +564,14 @@ class DataServiceApi(object):
         }
         return self._put("/uploads/" + upload_id + "/chunks", data)
 
+    def get_upload(self, upload_id):
+        """
+        Send GET request to /uploads/{upload_id} to retrieve the status and chunks of an upload.
+        :param upload_id: str uuid of the upload
+        :return: requests.Response containing the successful result
+        """
+        return self._get_single_item("/uploads/" + upload_id, {})
+
     def complete_upload(self, upload_id, hash_value, hash_alg):
         """
         Mark the upload we created in create_upload complete.
@@ -541,7 +625,7 @@ class DataServiceApi(object):
         :param host: str host we are sending the chunk to
         :param url: str url to use when sending
         :param http_headers: object headers to send with the request
-        :param chunk: content to send
+        :param chunk: bytes or file like object with a length: content to send, file like objects are streamed
         :return: requests.Response containing the successful result
         """
         if http_verb == 'PUT':
@@ -921,6 +1005,14 @@ class DataServiceApi(object):
         config = self.auth.config
         return config.page_size
 
+    def _get_page_fetch_workers(self):
+        """
+        Return how many pages of multi-page DukeDS results we should fetch at once
+        :return: int
+        """
+        config = self.auth.config
+        return config.page_fetch_workers
+
     def set_status_message(self, msg):
         print(msg)
 
@@ -937,7 +1029,8 @@ class MultiJSONResponse(object):
         """
         self.base_response = base_response
         self.merge_array_field_name = merge_array_field_name
-        self.combined_json = self.base_response.json()
+        self.combined_json = dict(self.base_response.json())
+        self.combined_json[merge_array_field_name] = list(self.combined_json[merge_array_field_name])
 
     def __getattr__(self, attr):
         """
@@ -959,8 +1052,116 @@ class MultiJSONResponse(object):
         """
         key = self.merge_array_field_name
         response_json = response.json()
-        value = self.combined_json[key]
-        self.combined_json[self.merge_array_field_name] = value + response_json[key]
+        self.combined_json[key].extend(response_json[key])
+
+
+class ConcurrentPageFetcher(object):
+    """
+    Fetches pages of a DukeDS collection using a bounded number of threads that share the api's http session.
+    The number of requests in flight adapts to the service: it is halved when the service is overloaded
+    (503/429 responses, timeouts or connection errors) and grows by one for each successful page.
+    A page that keeps failing is fetched using the normal retry_when_service_down waiting.
+    """
+    def __init__(self, data_service, url_suffix, data, max_workers):
+        """
+        :param data_service: DataServiceApi: api used to fetch each page
+        :param url_suffix: str URL path we are sending a GET to
+        :param data: object data we are sending
+        :param max_workers: int: max number of pages to fetch at once
+        """
+        self.data_service = data_service
+        self.url_suffix = url_suffix
+        self.data = data
+        self.max_workers = max_workers
+        self.concurrency = max_workers
+        self.work_queue = queue.Queue()
+        self.result_queue = queue.Queue()
+
+    def run(self, page_nums):
+        """
+        Fetch page_nums returning the responses in the same order.
+        Raises the first error that isn't due to the service being overloaded.
+        :param page_nums: [int]: page numbers to fetch
+        :return: [requests.Response]: response for each page number
+        """
+        return list(self.iterate(page_nums))
+
+    def iterate(self, page_nums):
+        """
+        Fetch page_nums yielding the responses in the same order as soon as they are available.
+        Only a few pages per worker are fetched ahead of the page the caller is waiting on.
+        Raises the first error that isn't due to the service being overloaded.
+        :param page_nums: [int]: page numbers to fetch
+        :return: generator of requests.Response: response for each page number
+        """
+        pending = list(reversed(page_nums))
+        failures = {}
+        responses = {}
+        in_flight = 0
+        max_pages_ahead = self.max_workers * PAGES_AHEAD_PER_WORKER
+        next_page_idx = 0
+        threads = self._start_threads(min(self.max_workers, len(pending)))
+        try:
+            while pending or in_flight:
+                while pending and in_flight < self.concurrency and in_flight + len(responses) < max_pages_ahead:
+                    self.work_queue.put(pending.pop())
+                    in_flight += 1
+                page_num, response, error = self.result_queue.get()
+                in_flight -= 1
+                if error is None:
+                    responses[page_num] = response
+                    self.concurrency = min(self.concurrency + 1, self.max_workers)
+                elif self.is_overload_error(error):
+                    self.concurrency = max(self.concurrency // 2, 1)
+                    failures[page_num] = failures.get(page_num, 0) + 1
+                    if failures[page_num] >= PAGE_FETCH_MAX_RETRIES:
+                        responses[page_num] = self.data_service._get_single_page(self.url_suffix, self.data,
+                                                                                 page_num)
+                    else:
+                        time.sleep(PAGE_FETCH_RETRY_SECONDS)
+                        pending.append(page_num)
+                else:
+                    raise error
+                while next_page_idx < len(page_nums) and page_nums[next_page_idx] in responses:
+                    yield responses.pop(page_nums[next_page_idx])
+                    next_page_idx += 1
+        finally:
+            for _ in threads:
+                self.work_queue.put(None)
+
+    def _start_threads(self, num_threads):
+        threads = []
+        for _ in range(num_threads):
+            thread = threading.Thread(target=self._fetch_pages)
+            thread.daemon = True
+            thread.start()
+            threads.append(thread)
+        return threads
+
+    def _fetch_pages(self):
+        """
+        Called in a thread to fetch page numbers from work_queue until it receives None.
+        """
+        while True:
+            page_num = self.work_queue.get()
+            if page_num is None:
+                break
+            try:
+                response = self.data_service._fetch_page(self.url_suffix, self.data, page_num)
+                self.result_queue.put((page_num, response, None))
+            except Exception as err:
+                self.result_queue.put((page_num, None, err))
+
+    @staticmethod
+    def is_overload_error(error):
+        """
+        Is error a sign that we are sending the service too many requests.
+        :param error: Exception: error raised fetching a page
+        :return: bool: True if we should retry the page with fewer requests in flight
+        """
+        if isinstance(error, DataServiceError):
+            return error.status_code in PAGE_FETCH_OVERLOAD_STATUS_CODES
+        return isinstance(error, (requests.exceptions.Timeout, requests.exceptions.ConnectionError))
 
 
 class ActivityRelationTypes(object):
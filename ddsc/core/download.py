@@ -1,8 +1,9 @@
 import os
 from ddsc.core.util import ProgressPrinter
-from ddsc.core.filedownloader import FileDownloader
+from ddsc.core.filedownloader import FileDownloader, FileDownloadPlanner, PartialDownloadState, create_download_pool
 from ddsc.core.pathfilter import PathFilteredProject
 from ddsc.core.localstore import PathData
+from ddsc.core.bundle import is_bundle, is_unpacked, unpack_bundle
 
 
 class ProjectDownload(object):
@@ -24,12 +25,21 @@ class ProjectDownload(object):
         self.path_filter = path_filter
         self.file_download_pre_processor = file_download_pre_processor
         self.watcher = None
+        self.download_pool = None
+        self.file_downloaders = []
+        self.bundle_paths = []
 
     def run(self):
         """
         Download the contents of the specified project name or id to dest_directory.
+        Files are downloaded using a single pool of workers that is shared by all files.
         """
-        self.walk_project(self.project)
+        self.download_pool = create_download_pool(self.remote_store.config)
+        try:
+            self.walk_project(self.project)
+        finally:
+            self.download_pool.shutdown()
+            self.download_pool = None
 
     def walk_project(self, project):
         """
@@ -41,8 +51,12 @@ class ProjectDownload(object):
         path_filtered_project.run(project)  # calls visit_project, visit_folder, visit_file in RemoteContentCounter
 
         self.watcher = ProgressPrinter(counter.count, msg_verb='downloading')
+        self.file_downloaders = []
+        self.bundle_paths = []
         path_filtered_project = PathFilteredProject(self.path_filter, self)
         path_filtered_project.run(project)  # calls visit_project, visit_folder, visit_file below
+        self.download_files()
+        self.unpack_bundles()
         self.watcher.finished()
         warnings = self.check_warnings()
         if warnings:
@@ -77,24 +91,53 @@ class ProjectDownload(object):
 
     def visit_file(self, item, parent):
         """
-        Download the file associated with item and make sure we received all of it.
+        Add the file associated with item to the list of files to download if we don't already have it.
+        Bundles whose files were already unpacked by an earlier download are skipped.
         :param item: RemoteFile file we will download
         :param parent: RemoteProject/RemoteFolder parent of item
         """
         if self.file_download_pre_processor:
             self.file_download_pre_processor.run(self.remote_store.data_service, item)
         path = os.path.join(self.dest_directory, item.remote_path)
-        if self.file_exists_with_same_hash(item, path):
+        if is_bundle(item):
+            if is_unpacked(item, os.path.dirname(path)):
+                self.watcher.transferring_item(item, increment_amt=item.size)
+                return
+            self.bundle_paths.append(path)
+        # Partially downloaded files are resumed without hashing them first
+        if not PartialDownloadState.exists(path) and self.file_exists_with_same_hash(item, path):
             # Update progress bar skipping this file
             self.watcher.transferring_item(item, increment_amt=item.size)
         else:
-            downloader = FileDownloader(self.remote_store.config, item, path, self.watcher)
-            downloader.run()
-            ProjectDownload.check_file_size(item, path)
+            downloader = FileDownloader(self.remote_store.config, item, path, self.watcher, self.download_pool)
+            self.file_downloaders.append(downloader)
+
+    def download_files(self):
+        """
+        Download all files found by visit_file at once and make sure we received all of each file.
+        """
+        if self.file_downloaders:
+            planner = FileDownloadPlanner(self.remote_store.config, self.download_pool, self.watcher)
+            for file_downloader in self.file_downloaders:
+                planner.add_file(file_downloader)
+            planner.run()
+            for file_downloader in self.file_downloaders:
+                ProjectDownload.check_file_size(file_downloader.remote_file, file_downloader.path)
+
+    def unpack_bundles(self):
+        """
+        Replace each downloaded bundle with the tiny files it contains (and its manifest for is_unpacked).
+        """
+        for bundle_path in self.bundle_paths:
+            unpack_bundle(bundle_path, os.path.dirname(bundle_path))
+            os.remove(bundle_path)
 
     @staticmethod
     def file_exists_with_same_hash(item, path):
         if os.path.exists(path):
+            # A file with a different size has different contents so we can skip reading it
+            if os.path.getsize(path) != item.size:
+                return False
             hash_data = PathData(path).get_hash()
             return hash_data.matches(item.hash_alg, item.file_hash)
         return False
@@ -1,19 +1,286 @@
 """
 Downloads a file based on ranges.
 """
+import os
+import json
 import math
 import time
+import threading
+import queue
 import requests
 from multiprocessing import Process, Queue
-from ddsc.core.util import ProgressQueue, wait_for_processes
+from ddsc.core.util import ProgressQueue
+from ddsc.core.localstore import HashData
 from ddsc.core.remotestore import RemoteStore
 from ddsc.core.ddsapi import retry_until_resource_is_consistent
+from ddsc.core.httpsession import get_requests_session
+from ddsc.config import PROCESS_TRANSFER_ENGINE, THREAD_TRANSFER_ENGINE
 
 DOWNLOAD_FILE_CHUNK_SIZE = 20 * 1024 * 1024
 MIN_DOWNLOAD_CHUNK_SIZE = DOWNLOAD_FILE_CHUNK_SIZE
 
 PARTIAL_DOWNLOAD_RETRY_TIMES = 5
 PARTIAL_DOWNLOAD_RETRY_SECONDS = 20
+RANGES_IN_FLIGHT_PER_WORKER = 2  # ranges queued per download worker so workers don't wait for their next range
+
+PARTIAL_DOWNLOAD_SUFFIX = '.ddsc-partial'
+PARTIAL_DOWNLOAD_MIN_FILE_SIZE = MIN_DOWNLOAD_CHUNK_SIZE  # smaller files are just downloaded again
+PARTIAL_DOWNLOAD_SAVE_SECONDS = 5
+
+
+class DownloadWorkerPool(object):
+    """
+    Long lived pool of worker processes that download ranges of files.
+    Each worker keeps a single DukeDS connection and http session for all of the ranges it downloads
+    so we don't pay for starting a process or a new TLS connection for every file.
+    Progress is reported on progress_queue as (range_id, num_bytes) processed values.
+    """
+    def __init__(self, config, num_workers=None):
+        """
+        Setup pool, processes are started when the first range is added.
+        :param config: Config: configuration settings for download (number workers)
+        :param num_workers: int: number of processes to create (defaults to config.download_workers)
+        """
+        self.config = config
+        self.num_workers = num_workers if num_workers else self.determine_num_workers(config.download_workers)
+        self.work_queue = self.make_queue()
+        self.progress_queue = ProgressQueue(self.make_queue())
+        self.processes = []
+
+    @staticmethod
+    def make_queue():
+        """
+        :return: Queue: queue that can be shared with worker processes
+        """
+        return Queue()
+
+    @staticmethod
+    def determine_num_workers(download_workers):
+        """
+        Determine how many processes to use for downloading.
+        :param download_workers: int target number of workers (None or 'None' means a single worker)
+        :return: int: number of worker processes to create
+        """
+        if not download_workers or download_workers == 'None':
+            return 1
+        return max(int(download_workers), 1)
+
+    def add_range(self, range_id, remote_file_id, path, range_start, range_end):
+        """
+        Add a range of a file to be downloaded by the next available worker.
+        :param range_id: int: id used to report progress for this range
+        :param remote_file_id: str: uuid of the file we will download
+        :param path: str: path to the pre-sized file we should write the range into
+        :param range_start: int: file offset to download
+        :param range_end: int: file ending offset to download
+        """
+        if not self.processes:
+            self.start()
+        bytes_to_read = range_end - range_start + 1
+        range_headers = make_range_headers(range_start, bytes_to_read)
+        self.work_queue.put((range_id, remote_file_id, range_headers, path, range_start, bytes_to_read))
+
+    def start(self):
+        """
+        Start the worker processes.
+        """
+        for _ in range(self.num_workers):
+            process = Process(target=download_worker, args=(self.config, self.work_queue, self.progress_queue))
+            process.start()
+            self.processes.append(process)
+
+    def terminate(self):
+        """
+        Stop the worker processes immediately.
+        """
+        for process in self.processes:
+            process.terminate()
+
+    def shutdown(self):
+        """
+        Tell workers to stop once they finish their work and wait for them to exit.
+        """
+        for _ in self.processes:
+            self.work_queue.put(None)
+        for process in self.processes:
+            process.join()
+        self.processes = []
+
+
+class ThreadDownloadPool(DownloadWorkerPool):
+    """
+    Downloads ranges of files like DownloadWorkerPool but from up to transfer_concurrency threads within this
+    process instead of worker processes. The threads share this process's requests session so many ranges can be
+    downloaded at once over pooled connections without a process for each connection.
+    Used when transfer_engine is thread. The threads are kept in self.processes.
+    """
+    def __init__(self, config, num_workers=None):
+        """
+        Setup pool, threads are started when the first range is added.
+        :param config: Config: configuration settings for download
+        :param num_workers: int: number of threads to create (defaults to config.transfer_concurrency)
+        """
+        super(ThreadDownloadPool, self).__init__(config, num_workers if num_workers else config.transfer_concurrency)
+
+    @staticmethod
+    def make_queue():
+        return queue.Queue()
+
+    def start(self):
+        """
+        Start the worker threads.
+        """
+        for _ in range(self.num_workers):
+            thread = threading.Thread(target=download_worker, args=(self.config, self.work_queue, self.progress_queue))
+            thread.daemon = True
+            thread.start()
+            self.processes.append(thread)
+
+    def terminate(self):
+        """
+        Threads can't be killed so drop the ranges that haven't been started and tell each thread to stop once it
+        finishes its current range.
+        """
+        try:
+            while True:
+                self.work_queue.get_nowait()
+        except queue.Empty:
+            pass
+        for _ in self.processes:
+            self.work_queue.put(None)
+        self.processes = []
+
+
+def create_download_pool(config, num_workers=None):
+    """
+    Create the pool that downloads ranges of files based on config.transfer_engine.
+    :param config: Config: configuration settings for download
+    :param num_workers: int: number of ranges to download at once (defaults based on config)
+    :return: DownloadWorkerPool or ThreadDownloadPool
+    """
+    transfer_engine = config.transfer_engine
+    if transfer_engine == PROCESS_TRANSFER_ENGINE:
+        return DownloadWorkerPool(config, num_workers)
+    if transfer_engine == THREAD_TRANSFER_ENGINE:
+        return ThreadDownloadPool(config, num_workers)
+    raise ValueError("Invalid transfer engine {}, should be {} or {}.".format(
+        transfer_engine, PROCESS_TRANSFER_ENGINE, THREAD_TRANSFER_ENGINE))
+
+
+class FileDownloadPlanner(object):
+    """
+    Downloads many files at once using a DownloadWorkerPool.
+    Each file is split into ranges and the ranges of all files are queued in order so small files are
+    downloaded concurrently and large files are downloaded in parallel parts.
+    The number and total size of ranges queued at once are limited so the pool always has work without
+    creating every file up front.
+    Files that were partially downloaded by a previous run only have their missing ranges downloaded.
+    """
+    def __init__(self, config, download_pool, watcher):
+        """
+        :param config: Config: configuration settings for download (download_bytes_in_flight)
+        :param download_pool: DownloadWorkerPool: workers that will download the ranges
+        :param watcher: ProgressPrinter: we notify of our progress
+        """
+        self.config = config
+        self.download_pool = download_pool
+        self.watcher = watcher
+        self.file_downloaders = []
+        self.max_ranges_in_flight = download_pool.num_workers * RANGES_IN_FLIGHT_PER_WORKER
+        self.max_bytes_in_flight = config.download_bytes_in_flight
+        self.ranges_in_flight = {}
+        self.bytes_in_flight = 0
+
+    def add_file(self, file_downloader):
+        """
+        Add a file to be downloaded when run is called.
+        :param file_downloader: FileDownloader: details about the file and where to save it
+        """
+        self.file_downloaders.append(file_downloader)
+
+    def run(self):
+        """
+        Download all added files, raises ValueError if a worker reports an error.
+        """
+        pending_ranges = self._generate_ranges()
+        next_range = next(pending_ranges, None)
+        while next_range or self.ranges_in_flight:
+            while next_range and self._can_add_range(next_range):
+                self._add_range(next_range)
+                next_range = next(pending_ranges, None)
+            if self.ranges_in_flight:
+                self._process_next_message()
+
+    def _generate_ranges(self):
+        """
+        Create or reopen each file as we reach it, returning the ranges that still need to be downloaded.
+        :return: generator of (range_id, FileDownloader, range_start, range_end)
+        """
+        range_id = 0
+        for file_downloader in self.file_downloaders:
+            ranges = file_downloader.prepare_ranges()
+            bytes_already_downloaded = file_downloader.bytes_already_downloaded()
+            if bytes_already_downloaded:
+                self.watcher.transferring_item(file_downloader.remote_file, increment_amt=bytes_already_downloaded)
+            if not ranges:
+                file_downloader.finish()
+            for range_start, range_end in ranges:
+                yield range_id, file_downloader, range_start, range_end
+                range_id += 1
+
+    def _can_add_range(self, next_range):
+        """
+        Determine if we can queue next_range without going over our limits. Always allows a range when idle.
+        :param next_range: (range_id, FileDownloader, range_start, range_end): range we want to queue
+        :return: bool: True if the range can be queued
+        """
+        if not self.ranges_in_flight:
+            return True
+        if len(self.ranges_in_flight) >= self.max_ranges_in_flight:
+            return False
+        if self.max_bytes_in_flight:
+            range_id, file_downloader, range_start, range_end = next_range
+            range_size = range_end - range_start + 1
+            return self.bytes_in_flight + range_size <= self.max_bytes_in_flight
+        return True
+
+    def _add_range(self, next_range):
+        """
+        Queue a range to be downloaded by the worker pool.
+        :param next_range: (range_id, FileDownloader, range_start, range_end): range to download
+        """
+        range_id, file_downloader, range_start, range_end = next_range
+        range_size = range_end - range_start + 1
+        self.ranges_in_flight[range_id] = [file_downloader, range_start, range_size, range_size]
+        self.bytes_in_flight += range_size
+        self.download_pool.add_range(range_id, file_downloader.remote_file.id, file_downloader.path,
+                                     range_start, range_end)
+
+    def _process_next_message(self):
+        """
+        Wait for a message from the worker pool updating our progress.
+        Terminates the workers and raises ValueError on error.
+        """
+        progress_type, value = self.download_pool.progress_queue.get()
+        if progress_type == ProgressQueue.PROCESSED:
+            range_id, num_bytes = value
+            range_info = self.ranges_in_flight[range_id]
+            file_downloader, range_start, range_size, bytes_left = range_info
+            self.watcher.transferring_item(file_downloader.remote_file, increment_amt=num_bytes)
+            file_downloader.range_progress(range_start, num_bytes)
+            range_info[3] = bytes_left - num_bytes
+            if range_info[3] == 0:
+                del self.ranges_in_flight[range_id]
+                self.bytes_in_flight -= range_size
+                file_downloader.range_finished()
+        elif progress_type == ProgressQueue.START_WAITING:
+            self.watcher.start_waiting()
+        elif progress_type == ProgressQueue.DONE_WAITING:
+            self.watcher.done_waiting()
+        else:
+            error_message = value
+            self.download_pool.terminate()
+            raise ValueError(error_message)
 
 
 class FileDownloader(object):
@@ -21,20 +288,108 @@ class FileDownloader(object):
     Downloads a file using a number of worker processes who download different ranges.
     Creates an empty file.
     Each worker seeks to their spot and streams the data from their url data into the file.
+    Progress of large files is saved in a PartialDownloadState so an interrupted download can be resumed.
     """
-    def __init__(self, config, remote_file, path, watcher):
+    def __init__(self, config, remote_file, path, watcher, download_pool=None):
         """
         Setup details on what to download and watcher to notify of progress.
         :param config: Config: configuration settings for download (number workers)
         :param remote_file: RemoteFile: details about DukeDS file we will download
         :param path: str: path to where we will save the file
         :param watcher: ProgressPrinter: we notify of our progress
+        :param download_pool: DownloadWorkerPool: workers to download with (defaults to a pool just for this file)
         """
         self.config = config
         self.remote_file = remote_file
         self.file_size = remote_file.size
         self.path = path
         self.watcher = watcher
+        self.download_pool = download_pool
+        self.partial_state = None
+        self.ranges_left = 0
+
+    def prepare_ranges(self):
+        """
+        Create the file to download into or reopen a partially downloaded one.
+        :return: [(int,int)]: array of (start, end) tuples that still need to be downloaded
+        """
+        self.partial_state = self.load_partial_state()
+        if self.partial_state:
+            ranges = self.partial_state.remaining_ranges()
+        else:
+            self.make_big_empty_file()
+            ranges = self.make_ranges()
+            self.partial_state = self.create_partial_state(ranges)
+        self.ranges_left = len(ranges)
+        return ranges
+
+    def load_partial_state(self):
+        """
+        Load the state of a previous download of this file that was interrupted.
+        :return: PartialDownloadState: state of the download or None if there is nothing to resume
+        """
+        return PartialDownloadState.load(self.path, self.remote_file)
+
+    def create_partial_state(self, ranges):
+        """
+        Start saving the state of this download if the file is large enough to be worth resuming.
+        :param ranges: [(int,int)]: array of (start, end) tuples we will download
+        :return: PartialDownloadState: state of the download or None for small files
+        """
+        if int(self.file_size) <= PARTIAL_DOWNLOAD_MIN_FILE_SIZE:
+            return None
+        partial_state = PartialDownloadState(self.path, self.remote_file, [[start, end, 0] for start, end in ranges])
+        partial_state.save()
+        return partial_state
+
+    def bytes_already_downloaded(self):
+        """
+        Return the number of bytes downloaded by a previous run that was interrupted.
+        :return: int: number of bytes
+        """
+        if self.partial_state and self.partial_state.resumed:
+            return int(self.file_size) - self.partial_state.bytes_remaining()
+        return 0
+
+    def range_progress(self, range_start, num_bytes):
+        """
+        Record that num_bytes of the range starting at range_start have been written to the file.
+        :param range_start: int: file offset the range started at
+        :param num_bytes: int: number of bytes written
+        """
+        if self.partial_state:
+            self.partial_state.add_progress(range_start, num_bytes)
+
+    def range_finished(self):
+        """
+        Record that a range has been downloaded, finishing the file once all ranges are done.
+        """
+        self.ranges_left -= 1
+        if self.ranges_left == 0:
+            self.finish()
+
+    def finish(self):
+        """
+        Called when all ranges have been downloaded. Resumed downloads have their hash checked since they
+        were written by more than one run. Removes the partial download state.
+        """
+        if self.partial_state:
+            if self.partial_state.resumed:
+                self.verify_hash()
+            self.partial_state.remove()
+            self.partial_state = None
+
+    def verify_hash(self):
+        """
+        Raise ValueError and remove the file if it's contents do not match the hash stored in DukeDS.
+        """
+        if self.remote_file.file_hash:
+            hash_data = HashData.create_from_path(self.path)
+            if not hash_data.matches(self.remote_file.hash_alg, self.remote_file.file_hash):
+                os.remove(self.path)
+                self.partial_state.remove()
+                raise ValueError("Error resuming download of {}. The {} hash does not match. "
+                                 "Please try again.".format(self.path, self.remote_file.hash_alg))
 
     def make_ranges(self):
         """
@@ -71,15 +426,18 @@ class FileDownloader(object):
 
     def run(self):
         """
-        Download a file using separate processes.
+        Download a file using the worker processes in download_pool.
         """
-        ranges = self.make_ranges()
-        processes = []
-        progress_queue = ProgressQueue(Queue())
-        self.make_big_empty_file()
-        for range_start, range_end in ranges:
-            processes.append(self.make_and_start_process(range_start, range_end, progress_queue))
-        wait_for_processes(processes, int(self.file_size), progress_queue, self.watcher, self.remote_file)
+        download_pool = self.download_pool
+        if not download_pool:
+            download_pool = create_download_pool(self.config, num_workers=len(self.make_ranges()))
+        try:
+            planner = FileDownloadPlanner(self.config, download_pool, self.watcher)
+            planner.add_file(self)
+            planner.run()
+        finally:
+            if not self.download_pool:
+                download_pool.shutdown()
 
     def make_big_empty_file(self):
         """
@@ -90,59 +448,87 @@ class FileDownloader(object):
                 outfile.seek(int(self.file_size) - 1)
                 outfile.write(b'\0')
 
-    def make_and_start_process(self, range_start, range_end, progress_queue):
+
+class RangeProgressQueue(object):
+    """
+    Wraps a ProgressQueue so processed amounts are sent as (range_id, amount) tuples.
+    """
+    def __init__(self, progress_queue, range_id):
         """
-        Create a process that will download the specified range and notify progress_queue of progress or errors.
-        :param range_start: int: file offset to download
-        :param range_end: int: file ending offset to download
-        :param progress_queue: ProgressQueue: queue to notify as we make progress
-        :return: Process: the process we created
+        :param progress_queue: ProgressQueue: queue to send messages to
+        :param range_id: int: id of the range we are reporting progress for
         """
-        range_headers = {'Range': 'bytes={}-{}'.format(range_start, range_end)}
-        bytes_to_read = range_end - range_start + 1
-        seek_amt = range_start
-        process = Process(target=download_async,
-                          args=(self.config, self.remote_file.id, range_headers,
-                                self.path, seek_amt, bytes_to_read, progress_queue))
-        process.start()
-        return process
+        self.progress_queue = progress_queue
+        self.range_id = range_id
 
+    def error(self, error_msg):
+        self.progress_queue.error(error_msg)
 
-def download_async(config, remote_file_id, range_headers, path, seek_amt, bytes_to_read, progress_queue):
+    def processed(self, amt):
+        self.progress_queue.processed((self.range_id, amt))
+
+    def start_waiting(self):
+        self.progress_queue.start_waiting()
+
+    def done_waiting(self):
+        self.progress_queue.done_waiting()
+
+
+def download_worker(config, work_queue, progress_queue):
     """
-    Called in separate process to download a chunk of a file.
+    Called in separate process to download ranges of files received from work_queue until it receives None.
     :param config: Config: configuration settings for download
-    :param remote_file_id: str: uuid of the file we will download
-    :param range_headers: dict: range request header to filter amount downloaded
-    :param path: str: path to where we should save our chunk we download
-    :param seek_amt: offset to seek before writing our chunk out to path
-    :param bytes_to_read: int: how many bytes of data we will receive from the url
+    :param work_queue: Queue: queue of (range_id, remote_file_id, range_headers, path, seek_amt, bytes_to_read) tuples
     :param progress_queue: ProgressQueue: queue of tuples we will add progress/errors to
     """
+    try:
+        remote_store = RemoteStore(config)
+        requests_session = get_requests_session()
+    except Exception as err:
+        progress_queue.error(str(err))
+        return
+    while True:
+        work = work_queue.get()
+        if work is None:
+            break
+        range_id, remote_file_id, range_headers, path, seek_amt, bytes_to_read = work
+        download_range(remote_store, requests_session, remote_file_id, range_headers, path, seek_amt,
+                       bytes_to_read, RangeProgressQueue(progress_queue, range_id))
+
+
+def download_range(remote_store, requests_session, remote_file_id, range_headers, path, seek_amt, bytes_to_read,
+                   progress_queue):
     """
-    Called in separate process to download a chunk of a file.
-    :param url: str: url to file we should download
-    :param headers: dict: header to use with url, should contain Range to limit what we download
+    Called in a worker process to download a chunk of a file.
+    :param remote_store: RemoteStore: used to fetch the url for the file
+    :param requests_session: requests.Session: session used to download the chunk
+    :param remote_file_id: str: uuid of the file we will download
+    :param range_headers: dict: range request header to filter amount downloaded
     :param path: str: path to where we should save our chunk we download
-    :param seek_amt: int: offset to seek before writing our chunk out to path
+    :param seek_amt: offset to seek before writing our chunk out to path
     :param bytes_to_read: int: how many bytes of data we will receive from the url
     :param progress_queue: ProgressQueue: queue of tuples we will add progress/errors to
     """
     partial_download_failures = 0
-    downloader = None
-    remote_store = RemoteStore(config)
     while True:
+        downloader = None
         try:
             url, headers = get_file_chunk_url_and_headers(remote_store, remote_file_id, range_headers, progress_queue)
-            downloader = ChunkDownloader(url, headers, path, seek_amt, bytes_to_read, progress_queue)
+            downloader = ChunkDownloader(url, headers, path, seek_amt, bytes_to_read, progress_queue,
+                                         requests_session)
             downloader.run()
             break
         except (PartialChunkDownloadError, requests.exceptions.ConnectionError) as err:
             # partial downloads can be due to flaky connections so we should retry a few times
             partial_download_failures += 1
             if partial_download_failures <= PARTIAL_DOWNLOAD_RETRY_TIMES:
-                if downloader:
-                    downloader.revert_progress()  # Notify progress monitor to undo our current progress
+                if downloader and downloader.actual_bytes_read:
+                    # Only request the part of the range we haven't received yet
+                    seek_amt += downloader.actual_bytes_read
+                    bytes_to_read -= downloader.actual_bytes_read
+                    if bytes_to_read == 0:
+                        break
+                    range_headers = make_range_headers(seek_amt, bytes_to_read)
                 time.sleep(PARTIAL_DOWNLOAD_RETRY_SECONDS)
                 # loop will call ChunkDownloader run again
             else:
@@ -153,6 +539,16 @@ def download_async(config, remote_file_id, range_headers, path, seek_amt, bytes_
             break
 
 
+def make_range_headers(range_start, bytes_to_read):
+    """
+    Create http headers to request part of a file.
+    :param range_start: int: file offset to start downloading at
+    :param bytes_to_read: int: number of bytes to download
+    :return: dict: headers containing the byte Range
+    """
+    return {'Range': 'bytes={}-{}'.format(range_start, range_start + bytes_to_read - 1)}
+
+
 def get_file_chunk_url_and_headers(remote_store, remote_file_id, range_headers, progress_queue):
     """
     Return url and headers to use for downloading part of a file.
@@ -166,7 +562,7 @@ def get_file_chunk_url_and_headers(remote_store, remote_file_id, range_headers,
     url_json = retry_until_resource_is_consistent(get_file_url.run, progress_queue)
     url = url_json['host'] + url_json['url']
     additional_headers = url_json['http_headers']
-    headers = range_headers
+    headers = dict(range_headers)
     if additional_headers:
         headers.update(additional_headers)
     return url, headers
@@ -186,7 +582,7 @@ class ChunkDownloader(object):
     Downloads part of a file and writes it to a location in a local pre-existing file.
     This runs in a separate process from the main application.
     """
-    def __init__(self, url, http_headers, path, seek_amt, bytes_to_read, progress_queue):
+    def __init__(self, url, http_headers, path, seek_amt, bytes_to_read, progress_queue, requests_session=None):
         """
         Setup for downloading part of a file.
         :param url: str: url to the file
@@ -195,6 +591,7 @@ class ChunkDownloader(object):
         :param seek_amt: int: offset amount to seek into the file
         :param bytes_to_read: int: how many bytes of data we will receive from the url
         :param progress_queue: ProgressQueue: queue we notify of progress or errors
+        :param requests_session: requests.Session: session to reuse connections from (defaults to a new connection)
         """
         self.url = url
         self.http_headers = http_headers
@@ -203,12 +600,14 @@ class ChunkDownloader(object):
         self.bytes_to_read = bytes_to_read
         self.actual_bytes_read = 0
         self.progress_queue = progress_queue
+        self.requests_session = requests_session
 
     def run(self):
         """
         Download part of a file at self.url and write it to the appropriate section of self.path.
         """
-        response = requests.get(self.url, headers=self.http_headers, stream=True)
+        http = self.requests_session if self.requests_session else requests
+        response = http.get(self.url, headers=self.http_headers, stream=True)
         response.raise_for_status()
         self._write_response_to_file(response)
         self._verify_download_complete()
@@ -216,6 +615,8 @@ class ChunkDownloader(object):
     def _write_response_to_file(self, response):
         """
         Write response to the appropriate section of the file at self.path.
+        Each chunk is flushed before it is reported so bytes recorded in the partial download state are never lost
+        in our write buffer when a worker is terminated.
         :param response: requests.Response: response containing stream-able data
         """
         with open(self.path, 'r+b') as outfile:  # open file for read/write (no truncate)
@@ -223,6 +624,7 @@ class ChunkDownloader(object):
             for chunk in response.iter_content(chunk_size=DOWNLOAD_FILE_CHUNK_SIZE):
                 if chunk:  # filter out keep-alive chunks
                     outfile.write(chunk)
+                    outfile.flush()
                     self._on_bytes_read(len(chunk))
 
     def _on_bytes_read(self, num_bytes_read):
@@ -244,12 +646,127 @@ class ChunkDownloader(object):
         elif self.actual_bytes_read < self.bytes_to_read:
             raise PartialChunkDownloadError(self.actual_bytes_read, self.bytes_to_read, self.path)
 
-    def revert_progress(self):
+
+class PartialDownloadState(object):
+    """
+    Records how much of each range of a file has been downloaded in a sidecar file next to the file
+    (path + PARTIAL_DOWNLOAD_SUFFIX). Only used in the main process.
+    A later download of the same remote file version can then resume by only requesting the missing bytes.
+    """
+    def __init__(self, path, remote_file, ranges, resumed=False):
+        """
+        :param path: str: path to the file being downloaded
+        :param remote_file: RemoteFile: details about DukeDS file we are downloading
+        :param ranges: [[int,int,int]]: list of [start, end, bytes_downloaded] for ranges not yet finished
+        :param resumed: bool: True if this state was loaded from a previous download
+        """
+        self.path = path
+        self.remote_file = remote_file
+        # ranges are keyed on the first byte that hasn't been downloaded to match remaining_ranges
+        self.ranges = dict((start + bytes_downloaded, [end, 0]) for start, end, bytes_downloaded in ranges)
+        self.resumed = resumed
+        self.last_save_time = time.time()
+
+    @staticmethod
+    def state_path(path):
+        return path + PARTIAL_DOWNLOAD_SUFFIX
+
+    @staticmethod
+    def exists(path):
+        """
+        Is there a partial download of the file at path.
+        :param path: str: path to the file being downloaded
+        :return: bool: True if a partial download state file exists
+        """
+        return os.path.exists(PartialDownloadState.state_path(path))
+
+    @staticmethod
+    def load(path, remote_file):
+        """
+        Load the state of an interrupted download of remote_file into path.
+        State for a different file version or a file that has been changed since is removed.
+        :param path: str: path to the file being downloaded
+        :param remote_file: RemoteFile: details about DukeDS file we are downloading
+        :return: PartialDownloadState: the saved state or None if there is nothing to resume
+        """
+        state_path = PartialDownloadState.state_path(path)
+        if not os.path.exists(state_path):
+            return None
+        try:
+            with open(state_path) as infile:
+                data = json.load(infile)
+            if PartialDownloadState._file_info(remote_file) == data['file'] and \
+                    os.path.getsize(path) == remote_file.size:
+                return PartialDownloadState(path, remote_file, data['ranges'], resumed=True)
+        except (ValueError, KeyError, TypeError, OSError, IOError):
+            pass
+        os.remove(state_path)
+        return None
+
+    @staticmethod
+    def _file_info(remote_file):
+        return {
+            'id': remote_file.id,
+            'size': remote_file.size,
+            'hash_alg': remote_file.hash_alg,
+            'file_hash': remote_file.file_hash,
+        }
+
+    def remaining_ranges(self):
+        """
+        Return the parts of each range that have not been downloaded.
+        :return: [(int,int)]: array of (start, end) tuples sorted by start
+        """
+        return [(start + bytes_downloaded, end)
+                for start, (end, bytes_downloaded) in sorted(self.ranges.items())]
+
+    def bytes_remaining(self):
+        """
+        :return: int: number of bytes that still need to be downloaded
+        """
+        return sum(end - start - bytes_downloaded + 1 for start, (end, bytes_downloaded) in self.ranges.items())
+
+    def add_progress(self, range_start, num_bytes):
+        """
+        Record bytes written to the range at range_start.
+        Saved when a range is finished or periodically so we don't rewrite the state for every chunk.
+        :param range_start: int: start of the range as returned by remaining_ranges
+        :param num_bytes: int: number of bytes written
+        """
+        range_info = self.ranges[range_start]
+        end, bytes_downloaded = range_info
+        range_info[1] = bytes_downloaded + num_bytes
+        if range_info[1] == end - range_start + 1:
+            del self.ranges[range_start]
+            self.save()
+        elif time.time() - self.last_save_time >= PARTIAL_DOWNLOAD_SAVE_SECONDS:
+            self.save()
+
+    def save(self):
+        """
+        Write the state to the sidecar file, replacing it so an interruption never leaves a truncated file.
+        """
+        data = {
+            'file': self._file_info(self.remote_file),
+            'ranges': [[start, end, bytes_downloaded]
+                       for start, (end, bytes_downloaded) in sorted(self.ranges.items())],
+        }
+        state_path = self.state_path(self.path)
+        temp_path = state_path + '.tmp'
+        with open(temp_path, 'w') as outfile:
+            json.dump(data, outfile)
+        if os.path.exists(state_path):
+            os.remove(state_path)
+        os.rename(temp_path, state_path)
+        self.last_save_time = time.time()
+
+    def remove(self):
         """
-        Update progress monitor with negative number so it is accurate since this download failed.
+        Remove the sidecar file once the download has finished.
         """
-        undo_size = self.actual_bytes_read * -1
-        self.progress_queue.processed(undo_size)
+        state_path = self.state_path(self.path)
+        if os.path.exists(state_path):
+            os.remove(state_path)
 
 
 class PartialChunkDownloadError(Exception):
@@ -2,19 +2,39 @@
 Objects to upload a number of chunks from a file to a remote store as part of an upload.
 """
 from __future__ import print_function
+import io
 import math
+import os
 import time
+import threading
+import queue
 import requests
-from multiprocessing import Process, Queue
-from ddsc.core.ddsapi import DataServiceAuth, DataServiceApi, retry_until_resource_is_consistent
-from ddsc.core.util import ProgressQueue, wait_for_processes
-from ddsc.core.localstore import HashData
+from collections import namedtuple
+from multiprocessing import Process, Queue, Semaphore, RawArray
+from multiprocessing.pool import ThreadPool
+from ddsc.core.ddsapi import DataServiceAuth, DataServiceApi, DataServiceError, retry_until_resource_is_consistent
+from ddsc.core.util import ProgressQueue
+from ddsc.core.localstore import HashData, HashUtil, HASH_FILE_BLOCK_SIZE
+from ddsc.core.uploadjournal import get_upload_journal
+from ddsc.core.hashcache import get_mtime_ns
+from ddsc.config import PROCESS_TRANSFER_ENGINE, THREAD_TRANSFER_ENGINE
 import traceback
 import sys
 
 SEND_EXTERNAL_PUT_RETRY_TIMES = 5
 SEND_EXTERNAL_RETRY_SECONDS = 20
 RESOURCE_NOT_CONSISTENT_RETRY_SECONDS = 2
+CHUNK_SLOTS_PER_WORKER = 2  # chunks per upload worker queued at once when upload_bytes_in_flight is unset
+CHUNK_URL_PREFETCH_THREADS = 4  # threads requesting upload urls for chunks before the workers send them
+
+# Where a chunk is within a local file. Workers are sent these for chunks too large for a ChunkBuffers buffer so
+# each worker can stream the chunk from the file.
+# file_size and mtime_ns are from when the file was hashed, when None the file isn't checked for changes before sending
+FileChunk = namedtuple('FileChunk', ['path', 'offset', 'size', 'file_size', 'mtime_ns'])
+FileChunk.__new__.__defaults__ = (None, None)
+
+# Which ChunkBuffers buffer holds a chunk read by the ChunkReader and how many bytes of it make up the chunk.
+BufferedChunk = namedtuple('BufferedChunk', ['buffer_num', 'size'])
 
 
 class FileUploader(object):
@@ -22,7 +42,7 @@ class FileUploader(object):
     Handles sending the contents of a file to a a remote data_service.
     Process:
     1) It creates an 'upload' with the remote service
-    2) Uses a chunk_processor to send the parts
+    2) Uses a chunk_processor to send the parts (hashing the file as the parts are read)
     3) Sends the complete message to finalize the 'upload'
     4) Sends create_file message to remote store with the 'upload' id
     """
@@ -37,10 +57,8 @@ class FileUploader(object):
         """
         self.config = config
         self.data_service = data_service
-        self.upload_operations = FileUploadOperations(self.data_service, watcher)
         self.file_upload_post_processor = file_upload_post_processor
         self.local_file = local_file
-        self.upload_id = None
         self.watcher = watcher
 
     def upload(self, project_id, parent_kind, parent_id):
@@ -51,16 +69,30 @@ class FileUploader(object):
         :param parent_id: str uuid of parent
         :return: str uuid of the newly uploaded file
         """
-        path_data = self.local_file.get_path_data()
-        hash_data = path_data.get_hash()
-        self.upload_id = self.upload_operations.create_upload(project_id, path_data, hash_data)
-        ParallelChunkProcessor(self).run()
-        parent_data = ParentData(parent_kind, parent_id)
-        remote_file_data = self.upload_operations.finish_upload(self.upload_id, hash_data, parent_data,
-                                                                self.local_file.remote_id)
-        if self.file_upload_post_processor:
-            self.file_upload_post_processor.run(self.data_service, remote_file_data)
-        return remote_file_data['id']
+        large_file = LargeFileUpload(self.local_file, ParentData(parent_kind, parent_id))
+        chunk_processor = create_chunk_processor(self.config, self.data_service, self.watcher,
+                                                 self.file_upload_post_processor)
+        chunk_processor.run(project_id, [large_file])
+        return large_file.remote_file_data['id']
+
+
+class LargeFileUpload(object):
+    """
+    Holds the state of a single file while ParallelChunkProcessor uploads its chunks.
+    """
+    def __init__(self, local_file, parent_data):
+        """
+        :param local_file: LocalFile: file we are sending to remote store
+        :param parent_data: ParentData: info about the parent of this file
+        """
+        self.local_file = local_file
+        self.parent_data = parent_data
+        self.upload_id = None
+        self.num_chunks = None
+        self.chunks_left = None
+        self.hash_data = None
+        self.stat_info = None
+        self.remote_file_data = None
 
 
 class ParentData(object):
@@ -96,61 +128,90 @@ class FileUploadOperations(object):
         self.data_service = data_service
         self.waiting_monitor = waiting_monitor
 
-    def create_upload(self, project_id, path_data, hash_data):
+    def create_upload(self, project_id, path_data, hash_data=None):
         """
         Create upload so we can send call further methods.
         :param project_id: str: uuid of the project
         :param path_data: PathData: holds file system data about the file we are uploading
-        :param hash_data: HashData: contains hash alg and value for the file we are uploading
+        :param hash_data: HashData: contains hash alg and value for the file we are uploading or None if not known yet
         :return: str: uuid for the upload
         """
         name = path_data.name()
         mime_type = path_data.mime_type()
         size = path_data.size()
+        hash_value, hash_alg = None, None
+        if hash_data:
+            hash_value, hash_alg = hash_data.value, hash_data.alg
 
         def func():
-            return self.data_service.create_upload(project_id, name, mime_type, size, hash_data.value, hash_data.alg)
+            return self.data_service.create_upload(project_id, name, mime_type, size, hash_value, hash_alg)
 
         resp = retry_until_resource_is_consistent(func, self.waiting_monitor)
         return resp.json()['id']
 
-    def create_file_chunk_url(self, upload_id, chunk_num, chunk):
+    def can_resume_upload(self, upload_id):
+        """
+        Determine if we can continue sending chunks for an upload created earlier.
+        :param upload_id: str: uuid of the upload
+        :return: bool: True if the upload still exists and has not been completed, purged or failed
+        """
+        try:
+            upload = self.data_service.get_upload(upload_id).json()
+        except DataServiceError:
+            return False
+        status = upload.get('status', {})
+        return not (status.get('completed_on') or status.get('purged_on') or status.get('error_on'))
+
+    def create_file_chunk_url(self, upload_id, chunk_num, chunk, hash_data=None):
         """
         Create a url for uploading a particular chunk to the datastore.
         :param upload_id: str: uuid of the upload this chunk is for
         :param chunk_num: int: where in the file does this chunk go
         :param chunk: bytes: data we are going to upload
+        :param hash_data: HashData: hash of chunk if already computed, otherwise chunk will be hashed
         :return:
         """
-        chunk_len = len(chunk)
-        hash_data = HashData.create_from_chunk(chunk)
-        resp = self.data_service.create_upload_url(upload_id, chunk_num, chunk_len, hash_data.value, hash_data.alg)
+        if not hash_data:
+            hash_data = HashData.create_from_chunk(chunk)
+        return self.create_chunk_url(upload_id, chunk_num, len(chunk), hash_data)
+
+    def create_chunk_url(self, upload_id, chunk_num, chunk_size, hash_data):
+        """
+        Create a url for uploading a chunk whose hash has already been computed.
+        :param upload_id: str: uuid of the upload this chunk is for
+        :param chunk_num: int: where in the file does this chunk go
+        :param chunk_size: int: size of the chunk in bytes
+        :param hash_data: HashData: hash of the chunk
+        :return: dict: contains where/how to upload the chunk
+        """
+        resp = self.data_service.create_upload_url(upload_id, chunk_num, chunk_size, hash_data.value, hash_data.alg)
         return resp.json()
 
-    def send_file_external(self, url_json, chunk):
+    def send_file_external(self, url_json, chunk, allow_retry=True):
         """
         Send chunk to external store specified in url_json.
         Raises ValueError on upload failure.
         :param data_service: data service to use for sending chunk
         :param url_json: dict contains where/how to upload chunk
         :param chunk: data to be uploaded
+        :param allow_retry: bool: when False connection errors are raised immediately so the caller can retry
         """
         http_verb = url_json['http_verb']
         host = url_json['host']
         url = url_json['url']
         http_headers = url_json['http_headers']
-        resp = self._send_file_external_with_retry(http_verb, host, url, http_headers, chunk)
+        resp = self._send_file_external_with_retry(http_verb, host, url, http_headers, chunk, allow_retry)
         if resp.status_code != 200 and resp.status_code != 201:
             raise ValueError("Failed to send file to external store. Error:" + str(resp.status_code) + host + url)
 
-    def _send_file_external_with_retry(self, http_verb, host, url, http_headers, chunk):
+    def _send_file_external_with_retry(self, http_verb, host, url, http_headers, chunk, allow_retry=True):
         """
         Send chunk to host, url using http_verb. If http_verb is PUT and a connection error occurs
         retry a few times. Pauses between retries. Raises if unsuccessful.
         """
         count = 0
         retry_times = 1
-        if http_verb == 'PUT':
+        if http_verb == 'PUT' and allow_retry:
             retry_times = SEND_EXTERNAL_PUT_RETRY_TIMES
         while True:
             try:
@@ -194,31 +255,173 @@ class FileUploadOperations(object):
 
 class ParallelChunkProcessor(object):
     """
-    Uploads grouped chunks in separate processes.
+    Uploads chunks of one or more files using a single pool of worker processes.
+    The files are read one after another a single time by a ChunkReader which creates the upload for each file,
+    hashes the entire file and hands the location of each chunk to the worker processes via a shared queue.
+    Workers pull chunks from the queue as they finish sending, so chunks from the next file are sent while the
+    previous file is being completed and a slow worker doesn't hold up the others.
+    Chunks that fail to send are put back on the queue for any worker to retry.
+    The reader reads each chunk a single time into one of a fixed set of ChunkBuffers shared with the workers,
+    hashing it there, and the worker sends that same buffer. How far the reader runs ahead of the workers (and so the
+    number of buffers) is limited by upload_bytes_in_flight.
+    Chunks larger than upload_stream_chunks_over are instead hashed in small blocks and streamed from the file again by
+    the worker, so memory use does not depend on the chunk size at the cost of reading those chunks twice.
+    Sent chunks are recorded in the upload journal so an interrupted upload can be resumed.
     """
-    def __init__(self, file_uploader):
+    def __init__(self, config, data_service, watcher, file_upload_post_processor=None):
         """
-        Send chunks in the file specified in file_uploader to the remote data service using multiple processes.
-        :param file_uploader: FileUploader contains all data we need to upload chunks of a file.
+        Setup to send files to the remote data service using multiple processes.
+        :param config: ddsc.config.Config user configuration settings from YAML file/environment
+        :param data_service: DataServiceApi data service we are sending the content to.
+        :param watcher: ProgressPrinter we notify of our progress
+        :param file_upload_post_processor: object: has run(data_service, file_response) method to run after upload
         """
-        self.config = file_uploader.config
-        self.data_service = file_uploader.data_service
-        self.upload_id = file_uploader.upload_id
-        self.watcher = file_uploader.watcher
-        self.local_file = file_uploader.local_file
+        self.config = config
+        self.data_service = data_service
+        self.upload_operations = FileUploadOperations(data_service, watcher)
+        self.watcher = watcher
+        self.file_upload_post_processor = file_upload_post_processor
+        self.upload_journal = get_upload_journal()
+        self.uploads = {}
 
-    def run(self):
+    def run(self, project_id, large_files):
         """
-        Sends contents of a local file to a remote data service.
+        Sends contents of local files to a remote data service.
+        Each file is completed and its local_file updated with the remote id as soon as its last chunk is sent.
+        :param project_id: str: uuid of the project we are uploading files into
+        :param large_files: [LargeFileUpload]: files to upload, updated with the upload results
         """
+        chunk_size = self.config.upload_bytes_per_chunk
+        total_chunks = 0
+        for large_file in large_files:
+            large_file.num_chunks = self.determine_num_chunks(chunk_size, large_file.local_file.size)
+            total_chunks += large_file.num_chunks
+        num_workers = self.determine_num_workers(self.get_num_workers_setting(), total_chunks)
         processes = []
-        progress_queue = ProgressQueue(Queue())
-        num_chunks = ParallelChunkProcessor.determine_num_chunks(self.config.upload_bytes_per_chunk,
-                                                                 self.local_file.size)
-        work_parcels = ParallelChunkProcessor.make_work_parcels(self.config.upload_workers, num_chunks)
-        for (index, num_items) in work_parcels:
-            processes.append(self.make_and_start_process(index, num_items, progress_queue))
-        wait_for_processes(processes, num_chunks, progress_queue, self.watcher, self.local_file)
+        progress_queue = ProgressQueue(self.make_queue())
+        work_queue = self.make_queue()
+        # Limit the number of chunks queued so the reader only runs a little ahead of the workers
+        num_chunk_slots = self.determine_num_chunk_slots(self.config.upload_bytes_in_flight, chunk_size, num_workers)
+        chunk_slots = self.make_semaphore(num_chunk_slots)
+        chunk_buffers = self.make_chunk_buffers(large_files, min(num_chunk_slots, total_chunks))
+        for _ in range(num_workers):
+            processes.append(self.make_and_start_process(work_queue, chunk_slots, progress_queue, chunk_buffers))
+        reader_data_service = make_data_service(self.config, self.data_service.auth.get_auth_data())
+        chunk_reader = ChunkReader(FileUploadOperations(reader_data_service, progress_queue), self.upload_journal,
+                                   project_id, large_files, self.uploads, chunk_size, work_queue, chunk_slots,
+                                   progress_queue, chunk_buffers)
+        reader_thread = threading.Thread(target=chunk_reader.run)
+        reader_thread.daemon = True
+        reader_thread.start()
+        try:
+            self.wait_for_chunks(processes, total_chunks, progress_queue)
+            # Workers may put failed chunks back on the queue so only tell them to stop once every chunk has been sent
+            for process in processes:
+                work_queue.put(None)
+            for process in processes:
+                process.join()
+        finally:
+            # When finishing a file fails the workers and reader are still running and would keep us from exiting
+            for process in processes:
+                if process.is_alive():
+                    process.terminate()
+                process.join()
+            chunk_reader.stop()
+            reader_thread.join()
+
+    def get_num_workers_setting(self):
+        """
+        :return: int: number of workers requested by config (limited by the number of chunks to send)
+        """
+        return self.config.upload_workers
+
+    @staticmethod
+    def make_queue():
+        """
+        :return: Queue: queue that can be shared with worker processes
+        """
+        return Queue()
+
+    @staticmethod
+    def make_semaphore(value):
+        """
+        :param value: int: initial value of the semaphore
+        :return: Semaphore: semaphore that can be shared with worker processes
+        """
+        return Semaphore(value)
+
+    @staticmethod
+    def make_buffer(size):
+        """
+        :param size: int: size of the buffer in bytes
+        :return: RawArray: buffer that can be shared with worker processes
+        """
+        return RawArray('B', size)
+
+    def make_chunk_buffers(self, large_files, num_buffers):
+        """
+        Create the buffers chunks are read into. Each buffer holds the largest chunk that will be sent from memory:
+        a full chunk (or the largest file if smaller) unless upload_stream_chunks_over is lower.
+        :param large_files: [LargeFileUpload]: files that will be uploaded
+        :param num_buffers: int: number of chunks that can be waiting to be sent or being sent at once
+        :return: ChunkBuffers: buffers shared with the workers
+        """
+        buffer_size = min(self.config.upload_bytes_per_chunk,
+                          max(large_file.local_file.size for large_file in large_files))
+        stream_chunks_over = self.config.upload_stream_chunks_over
+        if stream_chunks_over is not None:
+            buffer_size = min(buffer_size, stream_chunks_over)
+        if not buffer_size:
+            num_buffers = 0
+        return ChunkBuffers([self.make_buffer(buffer_size) for _ in range(num_buffers)], self.make_queue())
+
+    def wait_for_chunks(self, processes, total_chunks, progress_queue):
+        """
+        Watch progress queue for errors or (upload_id, chunk_num) sent chunks until total_chunks have been sent.
+        Finishes each file once all of its chunks have been sent.
+        Terminates processes and raises ValueError on error.
+        :param processes: [Process]: processes we will terminate on error
+        :param total_chunks: int: how many chunks we expect to be sent by processes
+        :param progress_queue: ProgressQueue: queue which will receive tuples of progress or error
+        """
+        while total_chunks > 0:
+            progress_type, value = progress_queue.get()
+            if progress_type == ProgressQueue.PROCESSED:
+                upload_id, chunk_num = value
+                large_file = self.uploads[upload_id]
+                if self.upload_journal:
+                    self.upload_journal.chunk_sent(upload_id, chunk_num)
+                self.watcher.transferring_item(large_file.local_file, increment_amt=1)
+                large_file.chunks_left -= 1
+                total_chunks -= 1
+                if large_file.chunks_left == 0:
+                    self.finish_file(large_file)
+            elif progress_type == ProgressQueue.START_WAITING:
+                self.watcher.start_waiting()
+            elif progress_type == ProgressQueue.DONE_WAITING:
+                self.watcher.done_waiting()
+            else:
+                error_message = value
+                for process in processes:
+                    process.terminate()
+                raise ValueError(error_message)
+
+    def finish_file(self, large_file):
+        """
+        Complete the upload for a file whose chunks have all been sent and save the results.
+        :param large_file: LargeFileUpload: file that has been completely sent
+        """
+        local_file = large_file.local_file
+        local_file.get_path_data().set_hash(large_file.hash_data, large_file.stat_info)
+        large_file.remote_file_data = self.upload_operations.finish_upload(large_file.upload_id,
+                                                                           large_file.hash_data,
+                                                                           large_file.parent_data,
+                                                                           local_file.remote_id)
+        if self.upload_journal:
+            self.upload_journal.remove_upload(large_file.upload_id)
+        if self.file_upload_post_processor:
+            self.file_upload_post_processor.run(self.data_service, large_file.remote_file_data)
+        local_file.set_remote_id_after_send(large_file.remote_file_data['id'])
 
     @staticmethod
     def determine_num_chunks(chunk_size, file_size):
@@ -231,61 +434,511 @@ class ParallelChunkProcessor(object):
         return int(math.ceil(float(file_size) / float(chunk_size)))
 
     @staticmethod
-    def make_work_parcels(upload_workers, num_chunks):
+    def determine_num_workers(upload_workers, num_chunks):
         """
-        Make groups so we can split up num_chunks into similar sizes.
-        Rounds up trying to keep work evenly split so sometimes it will not use all workers.
-        For very small numbers it can result in (upload_workers-1) total workers.
-        For example if there are two few items to distribute.
-        :param upload_workers: int target number of workers
-        :param num_chunks: int number of total items we need to send
-        :return [(index, num_items)] -  an array of tuples where array element will be in a separate process.
+        Determine how many processes to use to send num_chunks.
+        :param upload_workers: int target number of workers (None or 'None' means a single worker)
+        :param num_chunks: int number of total chunks we need to send
+        :return: int: number of worker processes to create
         """
-        chunks_per_worker = int(math.ceil(float(num_chunks) / float(upload_workers)))
-        return ParallelChunkProcessor.divide_work(range(num_chunks), chunks_per_worker)
+        if not upload_workers or upload_workers == 'None':
+            upload_workers = 1
+        return max(min(int(upload_workers), num_chunks), 1)
 
     @staticmethod
-    def divide_work(list_of_indexes, batch_size):
+    def determine_num_chunk_slots(bytes_in_flight, chunk_size, num_workers):
         """
-        Given a sequential list of indexes split them into num_parts.
-        :param list_of_indexes: [int] list of indexes to be divided up
-        :param batch_size: number of items to put in batch(not exact obviously)
-        :return: [(int,int)] list of (index, num_items) to be processed
+        Determine how many chunks may be read into memory at once.
+        :param bytes_in_flight: int: max bytes of chunks to hold in memory or None to base it on num_workers
+        :param chunk_size: int: size of each chunk we upload
+        :param num_workers: int: number of processes sending chunks
+        :return: int: number of chunks that may be waiting to be sent or being sent
         """
-        grouped_indexes = [list_of_indexes[i:i + batch_size] for i in range(0, len(list_of_indexes), batch_size)]
-        return [(batch[0], len(batch)) for batch in grouped_indexes]
+        if not bytes_in_flight:
+            return num_workers * CHUNK_SLOTS_PER_WORKER
+        return max(int(bytes_in_flight // chunk_size), 1)
 
-    def make_and_start_process(self, index, num_items, progress_queue):
+    def make_and_start_process(self, work_queue, chunk_slots, progress_queue, chunk_buffers):
         """
-        Create and start a process to upload num_items chunks from our file starting at index.
-        :param index: int offset into file(must be multiplied by upload_bytes_per_chunk to get actual location)
-        :param num_items: int number chunks to send
+        Create and start a process to upload chunks it receives from work_queue.
+        :param work_queue: Queue: queue of (upload_id, chunk_num, FileChunk or BufferedChunk, HashData, url_info,
+        failures) tuples ending with None
+        :param chunk_slots: Semaphore: released by the process after each chunk has been sent
         :param progress_queue: ProgressQueue queue to send notifications of progress or errors
+        :param chunk_buffers: ChunkBuffers: buffers holding the chunks read by the ChunkReader
         """
         process = Process(target=upload_async,
-                          args=(self.data_service.auth.get_auth_data(), self.config, self.upload_id,
-                                self.local_file.path, index, num_items, progress_queue))
+                          args=(self.data_service.auth.get_auth_data(), self.config,
+                                work_queue, chunk_slots, progress_queue, chunk_buffers))
         process.start()
         return process
 
 
-def upload_async(data_service_auth_data, config, upload_id,
-                 filename, index, num_chunks_to_send, progress_queue):
+class ThreadChunkProcessor(ParallelChunkProcessor):
+    """
+    Uploads chunks of large files like ParallelChunkProcessor (using the same ChunkReader, upload journal and
+    completion of each file) but sends them from up to transfer_concurrency threads within this process instead of
+    worker processes. Each sending thread has its own DataServiceApi and all of them share this process's requests
+    session, so many chunks can be sent at once over pooled connections without a process for each connection.
+    Used when transfer_engine is thread.
+    """
+    def get_num_workers_setting(self):
+        return self.config.transfer_concurrency
+
+    @staticmethod
+    def make_queue():
+        return queue.Queue()
+
+    @staticmethod
+    def make_semaphore(value):
+        return threading.Semaphore(value)
+
+    @staticmethod
+    def make_buffer(size):
+        return bytearray(size)
+
+    def make_and_start_process(self, work_queue, chunk_slots, progress_queue, chunk_buffers):
+        """
+        Create and start a thread to upload chunks it receives from work_queue.
+        :param work_queue: Queue: queue of (upload_id, chunk_num, FileChunk or BufferedChunk, HashData, url_info,
+        failures) tuples ending with None
+        :param chunk_slots: Semaphore: released by the thread after each chunk has been sent
+        :param progress_queue: ProgressQueue queue to send notifications of progress or errors
+        :param chunk_buffers: ChunkBuffers: buffers holding the chunks read by the ChunkReader
+        :return: ChunkSenderThread: thread that stands in for a worker process
+        """
+        thread = ChunkSenderThread(self.data_service.auth.get_auth_data(), self.config, work_queue, chunk_slots,
+                                   progress_queue, chunk_buffers)
+        thread.start()
+        return thread
+
+
+class ChunkSenderThread(threading.Thread):
+    """
+    Runs upload_async in a thread, supporting the parts of the Process interface ParallelChunkProcessor uses.
+    """
+    def __init__(self, data_service_auth_data, config, work_queue, chunk_slots, progress_queue, chunk_buffers=None):
+        super(ChunkSenderThread, self).__init__(target=upload_async,
+                                                args=(data_service_auth_data, config, work_queue, chunk_slots,
+                                                      progress_queue, chunk_buffers))
+        self.daemon = True
+        self.work_queue = work_queue
+
+    def terminate(self):
+        """
+        Threads can't be killed so tell the thread to stop once it finishes sending its current chunk.
+        """
+        self.work_queue.put(None)
+
+
+def create_chunk_processor(config, data_service, watcher, file_upload_post_processor=None):
+    """
+    Create the object that uploads chunks of large files based on config.transfer_engine.
+    :param config: ddsc.config.Config user configuration settings from YAML file/environment
+    :param data_service: DataServiceApi data service we are sending the content to.
+    :param watcher: ProgressPrinter we notify of our progress
+    :param file_upload_post_processor: object: has run(data_service, file_response) method to run after upload
+    :return: ParallelChunkProcessor or ThreadChunkProcessor
+    """
+    transfer_engine = config.transfer_engine
+    if transfer_engine == PROCESS_TRANSFER_ENGINE:
+        return ParallelChunkProcessor(config, data_service, watcher, file_upload_post_processor)
+    if transfer_engine == THREAD_TRANSFER_ENGINE:
+        return ThreadChunkProcessor(config, data_service, watcher, file_upload_post_processor)
+    raise ValueError("Invalid transfer engine {}, should be {} or {}.".format(
+        transfer_engine, PROCESS_TRANSFER_ENGINE, THREAD_TRANSFER_ENGINE))
+
+
+class ChunkReader(object):
+    """
+    Reads each file sequentially a single time after creating an upload for it.
+    Reads each chunk into a free buffer from chunk_buffers, hashing it along with the whole file, and passes the
+    buffer and hash to a ChunkUrlPrefetcher which creates the chunk's upload url before handing it to the workers via
+    work_queue. Chunks that don't fit in a buffer are hashed in small blocks and passed on as their location in the
+    file instead.
+    When resuming an upload from the upload journal chunks that were already sent are hashed but not queued.
+    """
+    def __init__(self, upload_operations, upload_journal, project_id, large_files, uploads, chunk_size, work_queue,
+                 chunk_slots, progress_queue, chunk_buffers=None):
+        """
+        Setup to read the chunks of large_files.
+        :param upload_operations: FileUploadOperations: used to create an upload for each file
+        :param upload_journal: UploadJournal: records uploads so they can be resumed (None to disable)
+        :param project_id: str: uuid of the project we are uploading files into
+        :param large_files: [LargeFileUpload]: files to read, num_chunks must be set
+        :param uploads: dict: upload_id to LargeFileUpload lookup we add each file to before sending its chunks
+        :param chunk_size: int size of block we will upload
+        :param work_queue: Queue: queue we will add (upload_id, chunk_num, FileChunk or BufferedChunk, HashData,
+        url_info, failures) tuples to
+        :param chunk_slots: Semaphore: acquired before each chunk is read, released by the worker that sends it
+        :param progress_queue: ProgressQueue queue to send errors and already sent chunks to
+        :param chunk_buffers: ChunkBuffers: buffers to read chunks into (None to stream every chunk from the file)
+        """
+        self.upload_operations = upload_operations
+        self.upload_journal = upload_journal
+        self.project_id = project_id
+        self.large_files = large_files
+        self.uploads = uploads
+        self.chunk_size = chunk_size
+        self.work_queue = work_queue
+        self.chunk_slots = chunk_slots
+        self.progress_queue = progress_queue
+        self.chunk_buffers = chunk_buffers
+        self.buffer = None  # reused for hashing chunks that aren't read into chunk_buffers, created when first needed
+        self.url_prefetcher = None
+        self.stopped = False
+
+    def run(self):
+        """
+        Create an upload for each file and add its chunks to work_queue.
+        """
+        self.url_prefetcher = ChunkUrlPrefetcher(self.upload_operations, self.work_queue)
+        try:
+            for large_file in self.large_files:
+                if self.stopped:
+                    break
+                sent_chunks = self.create_upload(large_file)
+                self.read_file(large_file, sent_chunks)
+        except Exception:
+            error_msg = "".join(traceback.format_exception(*sys.exc_info()))
+            self.progress_queue.error(error_msg)
+        finally:
+            self.url_prefetcher.close()
+
+    def stop(self):
+        """
+        Stop reading once the current chunk has been read, waking the reader if it is waiting for a chunk slot.
+        Called when the upload has failed so the workers that would release chunk slots are gone.
+        """
+        self.stopped = True
+        self.chunk_slots.release()
+
+    def create_upload(self, large_file):
+        """
+        Create an upload for large_file, or resume an unfinished one, and add it to the uploads lookup.
+        :param large_file: LargeFileUpload: file we are about to read
+        :return: set: chunk numbers that were already sent for the upload
+        """
+        path_data = large_file.local_file.get_path_data()
+        path = os.path.abspath(path_data.path)
+        stat_info = os.stat(path)
+        sent_chunks = set()
+        resumable_upload = self.find_resumable_upload(path, stat_info)
+        if resumable_upload:
+            large_file.upload_id, sent_chunks = resumable_upload
+        else:
+            large_file.upload_id = self.upload_operations.create_upload(self.project_id, path_data)
+            if self.upload_journal:
+                self.upload_journal.start_upload(self.project_id, path, stat_info, self.chunk_size,
+                                                 large_file.upload_id)
+        large_file.chunks_left = large_file.num_chunks
+        self.uploads[large_file.upload_id] = large_file
+        return sent_chunks
+
+    def find_resumable_upload(self, path, stat_info):
+        """
+        Look for an unfinished upload of path in the upload journal that DukeDS will still accept chunks for.
+        :param path: str: absolute path to the file
+        :param stat_info: os.stat_result: current stat info about the file
+        :return: (str, set): (upload id, set of chunk numbers already sent) or None if there is nothing to resume
+        """
+        if self.upload_journal:
+            journal_upload = self.upload_journal.find_upload(self.project_id, path, stat_info, self.chunk_size)
+            if journal_upload:
+                upload_id, sent_chunks = journal_upload
+                if self.upload_operations.can_resume_upload(upload_id):
+                    return journal_upload
+                self.upload_journal.remove_upload(upload_id)
+        return None
+
+    def read_file(self, large_file, sent_chunks):
+        """
+        Read the chunks of large_file adding them to work_queue and save the hash of the whole file.
+        Chunks in sent_chunks are only hashed and reported as sent.
+        The hash is saved before the last chunk is queued so it is available once all chunks have been sent.
+        Chunks that fit are read into a chunk buffer, the rest are hashed in blocks and read again by the workers
+        (normally from the page cache).
+        :param large_file: LargeFileUpload: file to read
+        :param sent_chunks: set: chunk numbers that were already sent
+        """
+        hash_util = HashUtil()
+        last_chunk_num = large_file.num_chunks - 1
+        path = large_file.local_file.get_path_data().path
+        offset = 0
+        with io.open(path, 'rb', buffering=0) as infile:
+            large_file.stat_info = stat_info = os.fstat(infile.fileno())
+            mtime_ns = get_mtime_ns(stat_info)
+            for chunk_num in range(large_file.num_chunks):
+                already_sent = chunk_num in sent_chunks
+                if not already_sent:
+                    self.chunk_slots.acquire()
+                    if self.stopped:
+                        return
+                expected_chunk_len = min(self.chunk_size, max(stat_info.st_size - offset, 0))
+                if not already_sent and self.chunk_buffers and self.chunk_buffers.fits(expected_chunk_len):
+                    buffer_num = self.chunk_buffers.take()
+                    chunk_len, chunk_hash_data = self.read_chunk(
+                        infile, hash_util, self.chunk_buffers.get_view(buffer_num, expected_chunk_len))
+                    chunk = BufferedChunk(buffer_num, chunk_len)
+                else:
+                    chunk_len, chunk_hash_data = self.hash_chunk(infile, hash_util)
+                    chunk = FileChunk(path, offset, chunk_len, stat_info.st_size, mtime_ns)
+                if chunk_num == last_chunk_num:
+                    large_file.hash_data = HashData.create_from_hash_util(hash_util)
+                if already_sent:
+                    self.progress_queue.processed((large_file.upload_id, chunk_num))
+                else:
+                    self.url_prefetcher.add(large_file.upload_id, chunk_num, chunk, chunk_hash_data)
+                offset += chunk_len
+
+    def hash_chunk(self, infile, hash_util):
+        """
+        Read the next chunk of infile in blocks adding it to hash_util and hashing the chunk.
+        :param infile: file: unbuffered file opened in binary mode
+        :param hash_util: HashUtil: hash of the whole file
+        :return: (int, HashData): size of the chunk (smaller than chunk_size only at the end of the file) and its hash
+        """
+        if self.buffer is None:
+            self.buffer = memoryview(bytearray(min(self.chunk_size, HASH_FILE_BLOCK_SIZE)))
+        chunk_hash_util = HashUtil()
+        chunk_len = 0
+        while chunk_len < self.chunk_size:
+            block = self.buffer[:min(len(self.buffer), self.chunk_size - chunk_len)]
+            num_read = read_into(infile, block)
+            hash_util.add_chunk(block[:num_read])
+            chunk_hash_util.add_chunk(block[:num_read])
+            chunk_len += num_read
+            if num_read < len(block):
+                break
+        return chunk_len, HashData.create_from_hash_util(chunk_hash_util)
+
+    @staticmethod
+    def read_chunk(infile, hash_util, chunk_buffer):
+        """
+        Read the next chunk of infile into chunk_buffer adding it to hash_util and hashing the chunk.
+        :param infile: file: unbuffered file opened in binary mode
+        :param hash_util: HashUtil: hash of the whole file
+        :param chunk_buffer: memoryview: part of a chunk buffer the size of the chunk
+        :return: (int, HashData): size of the chunk (smaller than chunk_buffer only if the file shrank) and its hash
+        """
+        chunk_len = read_into(infile, chunk_buffer)
+        chunk_hash_util = HashUtil()
+        hash_util.add_chunk(chunk_buffer[:chunk_len])
+        chunk_hash_util.add_chunk(chunk_buffer[:chunk_len])
+        return chunk_len, HashData.create_from_hash_util(chunk_hash_util)
+
+
+class ChunkBuffers(object):
+    """
+    Fixed set of equal sized buffers shared by a ChunkReader and the workers so each chunk is read from disk once:
+    the reader reads and hashes a chunk in a free buffer and the worker sends that same buffer.
+    The numbers of the free buffers are kept on a queue, a worker gives a buffer back once its chunk has been sent.
+    There is a buffer for each chunk slot so the reader never waits for a buffer once it has a slot.
+    """
+    def __init__(self, buffers, free_queue):
+        """
+        :param buffers: [bytearray or RawArray]: buffers that can be shared with the workers
+        :param free_queue: Queue: queue that can be shared with the workers, filled with the numbers of the buffers
+        """
+        self.buffers = buffers
+        self.buffer_size = len(buffers[0]) if buffers else 0
+        self.free_queue = free_queue
+        for buffer_num in range(len(buffers)):
+            free_queue.put(buffer_num)
+
+    def fits(self, size):
+        """
+        :param size: int: size of a chunk
+        :return: bool: True if the chunk can be sent from a buffer instead of streamed from its file
+        """
+        return bool(self.buffers) and 0 < size <= self.buffer_size
+
+    def take(self):
+        """
+        Wait for a free buffer.
+        :return: int: number of the buffer
+        """
+        return self.free_queue.get()
+
+    def get_view(self, buffer_num, size):
+        """
+        :param buffer_num: int: number of the buffer
+        :param size: int: number of bytes at the start of the buffer to include
+        :return: memoryview: the start of the buffer
+        """
+        return memoryview(self.buffers[buffer_num])[:size]
+
+    def give_back(self, buffer_num):
+        """
+        Free a buffer whose chunk has been sent.
+        :param buffer_num: int: number of the buffer
+        """
+        self.free_queue.put(buffer_num)
+
+
+class ChunkUrlPrefetcher(object):
+    """
+    Creates the upload url for each chunk found by a ChunkReader on a few threads then adds the chunk to the
+    work queue, so the DukeDS round trip isn't made by the workers between sending chunks.
+    The url is created with the hash of the chunk's buffer, which is what the worker sends.
+    How far ahead of the workers urls are created is limited by the chunk slots acquired by the ChunkReader.
+    Chunks whose url can't be created are queued without one and the worker creates it (reporting any error).
+    """
+    def __init__(self, upload_operations, work_queue, num_threads=CHUNK_URL_PREFETCH_THREADS):
+        """
+        :param upload_operations: FileUploadOperations: used to create upload urls
+        :param work_queue: Queue: queue we will add (upload_id, chunk_num, FileChunk or BufferedChunk, HashData,
+        url_info, failures) tuples to
+        :param num_threads: int: number of urls to create at once
+        """
+        self.upload_operations = upload_operations
+        self.work_queue = work_queue
+        self.pool = ThreadPool(num_threads)
+
+    def add(self, upload_id, chunk_num, chunk, hash_data):
+        """
+        Create the url for a chunk in the background then add the chunk to the work queue.
+        :param upload_id: str: uuid of the upload this chunk is for
+        :param chunk_num: int: where in the file does this chunk go
+        :param chunk: FileChunk or BufferedChunk: location of the chunk
+        :param hash_data: HashData: hash of the chunk
+        """
+        self.pool.apply_async(self.create_url, (upload_id, chunk_num, chunk, hash_data),
+                              callback=self.work_queue.put)
+
+    def create_url(self, upload_id, chunk_num, chunk, hash_data):
+        """
+        Create the upload url for a chunk.
+        :return: tuple: work queue item for the chunk, url_info is None if the url couldn't be created
+        """
+        try:
+            url_info = self.upload_operations.create_chunk_url(upload_id, chunk_num, chunk.size, hash_data)
+        except Exception:
+            url_info = None
+        return upload_id, chunk_num, chunk, hash_data, url_info, 0
+
+    def close(self):
+        """
+        Wait for urls being created to be added to the work queue.
+        """
+        self.pool.close()
+        self.pool.join()
+
+
+def read_into(infile, buf):
+    """
+    Fill buf from infile stopping early only at the end of the file.
+    :param infile: file: unbuffered file opened in binary mode
+    :param buf: memoryview: writable buffer to fill
+    :return: int: number of bytes read into buf
+    """
+    num_read = 0
+    while num_read < len(buf):
+        bytes_read = infile.readinto(buf[num_read:])
+        if not bytes_read:
+            break
+        num_read += bytes_read
+    return num_read
+
+
+class FileRegionReader(object):
+    """
+    Read only file like object for the part of a file that makes up a chunk.
+    Passed to requests as the body of a chunk upload to stream it from disk instead of holding it in memory.
+    Hashes the data as it is read so we can tell if the file changed after the chunk was hashed.
+    """
+    def __init__(self, file_chunk):
+        """
+        Open the file file_chunk is part of.
+        Raises ValueError if the file's size or modification time no longer match those recorded in file_chunk,
+        so a changed file is caught before the chunk is sent instead of after.
+        :param file_chunk: FileChunk: location of the data to read
+        """
+        self.file_chunk = file_chunk
+        self.bytes_left = file_chunk.size
+        self.hash_util = HashUtil()
+        self.infile = io.open(file_chunk.path, 'rb')
+        try:
+            self._check_unchanged()
+        except ValueError:
+            self.infile.close()
+            raise
+        self.infile.seek(file_chunk.offset)
+
+    def _check_unchanged(self):
+        if self.file_chunk.file_size is not None:
+            stat_info = os.fstat(self.infile.fileno())
+            if (stat_info.st_size, get_mtime_ns(stat_info)) != (self.file_chunk.file_size, self.file_chunk.mtime_ns):
+                raise ValueError("File {} changed while it was being uploaded.".format(self.file_chunk.path))
+
+    def __len__(self):
+        # requests uses this to set the Content-Length header
+        return self.file_chunk.size
+
+    def read(self, size=-1):
+        """
+        Read up to size bytes without going past the end of the chunk.
+        :param size: int: max bytes to read, negative to read the rest of the chunk
+        :return: bytes: data read, empty at the end of the chunk
+        """
+        if size is None or size < 0 or size > self.bytes_left:
+            size = self.bytes_left
+        data = self.infile.read(size)
+        self.bytes_left -= len(data)
+        self.hash_util.add_chunk(data)
+        if not data and self.bytes_left:
+            raise ValueError("File {} changed while it was being uploaded.".format(self.file_chunk.path))
+        return data
+
+    def get_hash_data(self):
+        """
+        :return: HashData: hash of the data read so far
+        """
+        return HashData.create_from_hash_util(self.hash_util)
+
+    def check_hash(self, hash_data):
+        """
+        Raise ValueError if all of the chunk wasn't read or it doesn't match hash_data.
+        :param hash_data: HashData: hash the chunk was uploaded with
+        """
+        if self.bytes_left or not self.get_hash_data().matches(hash_data.alg, hash_data.value):
+            raise ValueError("File {} changed while it was being uploaded.".format(self.file_chunk.path))
+
+    def close(self):
+        self.infile.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+def make_data_service(config, data_service_auth_data):
+    """
+    Recreate a DataServiceApi so it can be used from another process or thread.
+    :param config: dds.Config configuration settings to use during upload
+    :param data_service_auth_data: tuple of auth data for rebuilding DataServiceAuth
+    :return: DataServiceApi
+    """
+    auth = DataServiceAuth(config)
+    auth.set_auth_data(data_service_auth_data)
+    return DataServiceApi(auth, config.url)
+
+
+def upload_async(data_service_auth_data, config, work_queue, chunk_slots, progress_queue, chunk_buffers=None):
     """
     Method run in another process called from ParallelChunkProcessor.make_and_start_process.
     :param data_service_auth_data: tuple of auth data for rebuilding DataServiceAuth
     :param config: dds.Config configuration settings to use during upload
-    :param upload_id: uuid unique id of the 'upload' we are uploading chunks into
-    :param filename: str path to file who's contents we will be uploading
-    :param index: int offset into filename where we will start sending bytes from (must multiply by upload_bytes_per_chunk)
-    :param num_chunks_to_send: int number of chunks of config.upload_bytes_per_chunk size to send.
+    :param work_queue: Queue: queue of (upload_id, chunk_num, FileChunk or BufferedChunk, HashData, url_info, failures)
+    tuples to send, None signals we should stop
+    :param chunk_slots: Semaphore: released after each chunk has been sent
     :param progress_queue: ProgressQueue queue to send notifications of progress or errors
+    :param chunk_buffers: ChunkBuffers: buffers holding the chunks read by the ChunkReader
     """
-    auth = DataServiceAuth(config)
-    auth.set_auth_data(data_service_auth_data)
-    data_service = DataServiceApi(auth, config.url)
-    sender = ChunkSender(data_service, upload_id, filename, config.upload_bytes_per_chunk, index, num_chunks_to_send,
-                         progress_queue)
+    data_service = make_data_service(config, data_service_auth_data)
+    sender = ChunkSender(data_service, work_queue, chunk_slots, progress_queue, chunk_buffers)
     try:
         sender.send()
     except:
@@ -295,51 +948,101 @@ def upload_async(data_service_auth_data, config, upload_id,
 
 class ChunkSender(object):
     """
-    Receives an index and seeks to that part of the file to upload.
-    Creates an upload url with the data_service.
-    Uploads the bytes at that point in the file.
-    Repeats last two steps for each chunk it is supposed to send.
+    Receives the buffer or location, hash and upload url of chunks found by a ChunkReader from a queue.
+    Chunks in a buffer are sent from that buffer (the same bytes the ChunkReader hashed) and the buffer is given back.
+    Chunks too large for a buffer are streamed from the file to their url so they are never held in memory. This is a
+    second read of the chunk (the ChunkReader read it to hash it) so the hash of the data sent is checked against the
+    hash the url was created with.
+    Creates the url first if the ChunkUrlPrefetcher couldn't.
+    Repeats until it receives None from the queue.
+    Chunks that fail due to connection errors are put back on the queue so any worker can retry them.
     """
-    def __init__(self, data_service, upload_id, filename, chunk_size, index, num_chunks_to_send, progress_queue):
+    def __init__(self, data_service, work_queue, chunk_slots, progress_queue, chunk_buffers=None):
         """
-        Sends num_chunks_to_send from filename at offset index*chunk_size.
+        Sends chunks received from work_queue.
         :param data_service: DataServiceApi remote service we will be uploading to
-        :param upload_id: str upload uuid we are sending chunks part of
-        :param filename: str path to file on disk we are uploading parts of
-        :param chunk_size: int size of block we will upload
-        :param index: int index into filename content(must multiply by chunk_size during seek)
-        :param num_chunks_to_send: how many chunks of chunk_size should we upload
-        :param progress_queue: ProgressQueue queue we will send updates or errors to.
+        :param work_queue: Queue: queue of (upload_id, chunk_num, FileChunk or BufferedChunk, HashData, url_info,
+        failures) tuples to send, None signals we should stop
+        :param chunk_slots: Semaphore: released after each chunk has been sent
+        :param progress_queue: ProgressQueue queue we will send (upload_id, chunk_num) updates or errors to.
+        :param chunk_buffers: ChunkBuffers: buffers holding the BufferedChunks we receive
         """
         self.data_service = data_service
         self.upload_operations = FileUploadOperations(self.data_service, None)
-        self.upload_id = upload_id
-        self.filename = filename
-        self.chunk_size = chunk_size
-        self.index = index
-        self.num_chunks_to_send = num_chunks_to_send
+        self.work_queue = work_queue
+        self.chunk_slots = chunk_slots
         self.progress_queue = progress_queue
+        self.chunk_buffers = chunk_buffers
+        self.consecutive_failures = 0
 
     def send(self):
         """
-        For each chunk we need to send, create upload url and send bytes. Raises exception on error.
+        For each chunk we receive, create upload url and send bytes. Raises exception on error.
         """
-        sent_chunks = 0
-        chunk_num = self.index
-        with open(self.filename, 'rb') as infile:
-            infile.seek(self.index * self.chunk_size)
-            while sent_chunks != self.num_chunks_to_send:
-                chunk = infile.read(self.chunk_size)
-                self._send_chunk(chunk, chunk_num)
-                self.progress_queue.processed(1)
-                chunk_num += 1
-                sent_chunks += 1
+        while True:
+            work = self.work_queue.get()
+            if work is None:
+                break
+            upload_id, chunk_num, chunk, hash_data, url_info, failures = work
+            try:
+                self._send_chunk(upload_id, chunk_num, chunk, hash_data, url_info)
+            except requests.exceptions.ConnectionError:
+                failures += 1
+                if failures >= SEND_EXTERNAL_PUT_RETRY_TIMES:
+                    raise
+                self._retry_chunk(upload_id, chunk_num, chunk, hash_data, failures)
+                continue
+            self.consecutive_failures = 0
+            if isinstance(chunk, BufferedChunk):
+                self.chunk_buffers.give_back(chunk.buffer_num)
+            self.chunk_slots.release()
+            self.progress_queue.processed((upload_id, chunk_num))
 
-    def _send_chunk(self, chunk, chunk_num):
+    def _send_chunk(self, upload_id, chunk_num, chunk, hash_data, url_info):
         """
         Send a single chunk to the remote service.
-        :param chunk: bytes data we are uploading
+        :param upload_id: str upload uuid this chunk is part of
+        :param chunk_num: int number associated with this chunk
+        :param chunk: FileChunk or BufferedChunk location of the data we are uploading
+        :param hash_data: HashData hash of the chunk computed by the ChunkReader
+        :param url_info: dict where/how to upload the chunk or None to create it
+        """
+        if isinstance(chunk, BufferedChunk):
+            if url_info is None:
+                url_info = self.upload_operations.create_chunk_url(upload_id, chunk_num, chunk.size, hash_data)
+            body = self.chunk_buffers.get_view(chunk.buffer_num, chunk.size)
+            self.upload_operations.send_file_external(url_info, body, allow_retry=False)
+        else:
+            with FileRegionReader(chunk) as body:
+                if url_info is None:
+                    url_info = self.upload_operations.create_chunk_url(upload_id, chunk_num, chunk.size, hash_data)
+                self.upload_operations.send_file_external(url_info, body, allow_retry=False)
+                body.check_hash(hash_data)
+
+    def _retry_chunk(self, upload_id, chunk_num, chunk, hash_data, failures):
+        """
+        Put a chunk that failed to send back on the queue so the next available worker can send it.
+        The chunk is queued without a url so a new one is created when it is retried.
+        Only pauses when this worker keeps failing since that suggests the remote service is down.
+        :param upload_id: str upload uuid this chunk is part of
         :param chunk_num: int number associated with this chunk
+        :param chunk: FileChunk or BufferedChunk location of the data we are uploading (a buffer is kept until sent)
+        :param hash_data: HashData hash of the chunk
+        :param failures: int number of times this chunk has failed to send
+        """
+        if failures == 1:  # Only show a warning the first time we fail to send a chunk
+            self._show_retry_warning(chunk_num)
+        self.work_queue.put((upload_id, chunk_num, chunk, hash_data, None, failures))
+        self.data_service.recreate_requests_session()
+        self.consecutive_failures += 1
+        if self.consecutive_failures > 1:
+            time.sleep(SEND_EXTERNAL_RETRY_SECONDS)
+
+    @staticmethod
+    def _show_retry_warning(chunk_num):
+        """
+        Displays a message on stderr that we failed to send a chunk and will retry.
+        :param chunk_num: int number associated with the chunk
         """
-        url_info = self.upload_operations.create_file_chunk_url(self.upload_id, chunk_num, chunk)
-        self.upload_operations.send_file_external(url_info, chunk)
+        sys.stderr.write("\nConnection failed sending chunk {}. Retrying.\n".format(chunk_num))
+        sys.stderr.flush()
@@ -0,0 +1,250 @@
+"""
+Persistent cache of file hashes so unchanged files do not have to be re-read on every upload/download.
+Entries are keyed on path and are only used when the size, modification time, inode and device still match.
+In trust mtime mode only the size and modification time need to match, for trees that are copied or synced between
+filesystems with tools that preserve modification times.
+"""
+from __future__ import print_function
+import os
+import sys
+import time
+import sqlite3
+import threading
+
+CREATE_TABLE_SQL = """
+CREATE TABLE IF NOT EXISTS file_hashes (
+    path TEXT PRIMARY KEY,
+    size INTEGER NOT NULL,
+    mtime_ns INTEGER NOT NULL,
+    inode INTEGER NOT NULL,
+    device INTEGER NOT NULL,
+    hash_alg TEXT NOT NULL,
+    hash_value TEXT NOT NULL,
+    last_used REAL NOT NULL
+)
+"""
+CREATE_INDEX_SQL = "CREATE INDEX IF NOT EXISTS file_hashes_last_used ON file_hashes (last_used)"
+LOOKUP_SQL = "SELECT size, mtime_ns, inode, device, hash_alg, hash_value FROM file_hashes WHERE path = ?"
+TOUCH_SQL = "UPDATE file_hashes SET last_used = ? WHERE path = ?"
+SAVE_SQL = "INSERT OR REPLACE INTO file_hashes VALUES (?, ?, ?, ?, ?, ?, ?, ?)"
+DELETE_SQL = "DELETE FROM file_hashes WHERE path = ?"
+COUNT_SQL = "SELECT COUNT(*) FROM file_hashes"
+EVICT_SQL = "DELETE FROM file_hashes WHERE path IN (SELECT path FROM file_hashes ORDER BY last_used LIMIT ?)"
+
+# When we go over max_items remove this fraction of extra items so we don't evict on every save
+EVICT_EXTRA_FRACTION = 0.1
+# Number of cache hits to collect before writing their last used times in a single transaction
+TOUCH_FLUSH_COUNT = 10000
+SQLITE_LOCK_TIMEOUT_SECONDS = 30
+# Write ahead logging lets other processes read while we write and makes our small commits cheap
+JOURNAL_MODE_SQL = "PRAGMA journal_mode=WAL"
+SYNCHRONOUS_SQL = "PRAGMA synchronous=NORMAL"
+
+
+def get_mtime_ns(stat_info):
+    """
+    Return modification time in nanoseconds for a stat result (python 2 lacks st_mtime_ns).
+    :param stat_info: os.stat_result: stat info about a file
+    :return: int: modification time in nanoseconds
+    """
+    mtime_ns = getattr(stat_info, 'st_mtime_ns', None)
+    if mtime_ns is None:
+        mtime_ns = int(stat_info.st_mtime * 1e9)
+    return mtime_ns
+
+
+class HashCache(object):
+    """
+    SQLite backed cache of (alg, value) hashes for file paths.
+    Can be used from multiple threads of the process that created it.
+    Each change is committed right away so other processes sharing the cache are never locked out for long.
+    Cache hits only read the database, their last used times are collected and written TOUCH_FLUSH_COUNT at a time
+    (and when the cache is closed).
+    Database errors are reported once and treated as a cache miss so files are hashed instead.
+    """
+    def __init__(self, filename, max_items, trust_mtime=False):
+        """
+        Setup cache stored in filename. The database is opened when first used.
+        :param filename: str: path to the sqlite database to store hashes in
+        :param max_items: int: number of entries to keep before evicting those least recently used
+        :param trust_mtime: bool: use entries when size and modification time match even if inode/device changed
+        """
+        self.filename = os.path.expanduser(filename)
+        self.max_items = max_items
+        self.trust_mtime = trust_mtime
+        self.conn = None
+        self.conn_pid = None
+        self.num_items = 0
+        self.touched_paths = {}
+        self.reported_error = False
+        self.lock = threading.Lock()
+
+    def _get_connection(self):
+        """
+        Open the database if necessary. Connections are not shared with child processes.
+        :return: sqlite3.Connection
+        """
+        if self.conn is None or self.conn_pid != os.getpid():
+            parent_dir = os.path.dirname(self.filename)
+            if parent_dir and not os.path.exists(parent_dir):
+                os.makedirs(parent_dir)
+            self.conn = sqlite3.connect(self.filename, timeout=SQLITE_LOCK_TIMEOUT_SECONDS,
+                                        check_same_thread=False)
+            self.conn_pid = os.getpid()
+            self.conn.execute(JOURNAL_MODE_SQL)
+            self.conn.execute(SYNCHRONOUS_SQL)
+            self.conn.execute(CREATE_TABLE_SQL)
+            self.conn.execute(CREATE_INDEX_SQL)
+            self.conn.commit()
+            self.num_items = self.conn.execute(COUNT_SQL).fetchone()[0]
+        return self.conn
+
+    def lookup(self, path, stat_info):
+        """
+        Find the hash for path if the file is unchanged since it was saved.
+        :param path: str: absolute path to the file
+        :param stat_info: os.stat_result: current stat info about the file
+        :return: (str, str): (hash algorithm, hash value) or None if not found or the file has changed
+        """
+        with self.lock:
+            try:
+                return self._lookup(path, stat_info)
+            except sqlite3.Error as err:
+                self._database_error(err)
+                return None
+
+    def _lookup(self, path, stat_info):
+        conn = self._get_connection()
+        row = conn.execute(LOOKUP_SQL, (path,)).fetchone()
+        if row:
+            size, mtime_ns, inode, device, hash_alg, hash_value = row
+            if self._stat_matches((size, mtime_ns, inode, device), self._stat_key(stat_info)):
+                self.touched_paths[path] = time.time()
+                if len(self.touched_paths) >= TOUCH_FLUSH_COUNT:
+                    self._flush_touched()
+                return hash_alg, hash_value
+            conn.execute(DELETE_SQL, (path,))
+            conn.commit()
+            self.touched_paths.pop(path, None)
+            self.num_items -= 1
+        return None
+
+    def _flush_touched(self):
+        """
+        Write the last used times of the entries found since the last flush.
+        """
+        touched_paths, self.touched_paths = self.touched_paths, {}
+        if touched_paths:
+            conn = self._get_connection()
+            conn.executemany(TOUCH_SQL, [(last_used, path) for path, last_used in touched_paths.items()])
+            conn.commit()
+
+    def save(self, path, stat_info, hash_alg, hash_value):
+        """
+        Save the hash for path. stat_info should be read before the file was hashed.
+        :param path: str: absolute path to the file
+        :param stat_info: os.stat_result: stat info about the file from before it was hashed
+        :param hash_alg: str: algorithm used to create hash_value
+        :param hash_value: str: hash of the file contents
+        """
+        with self.lock:
+            try:
+                self._save(path, stat_info, hash_alg, hash_value)
+            except sqlite3.Error as err:
+                self._database_error(err)
+
+    def _save(self, path, stat_info, hash_alg, hash_value):
+        conn = self._get_connection()
+        size, mtime_ns, inode, device = self._stat_key(stat_info)
+        existing = conn.execute(LOOKUP_SQL, (path,)).fetchone()
+        conn.execute(SAVE_SQL, (path, size, mtime_ns, inode, device, hash_alg, hash_value, time.time()))
+        if not existing:
+            self.num_items += 1
+        self.touched_paths.pop(path, None)
+        if self.num_items > self.max_items:
+            self._flush_touched()
+            self._evict()
+        conn.commit()
+
+    def _evict(self):
+        """
+        Remove least recently used entries so we are below max_items.
+        """
+        remove_count = self.num_items - self.max_items + int(self.max_items * EVICT_EXTRA_FRACTION)
+        self.conn.execute(EVICT_SQL, (remove_count,))
+        self.num_items = self.conn.execute(COUNT_SQL).fetchone()[0]
+
+    def _database_error(self, err):
+        """
+        Undo the failed change and warn the user the first time the cache can't be used.
+        :param err: sqlite3.Error: error raised by the database
+        """
+        if self.conn is not None and self.conn_pid == os.getpid():
+            try:
+                self.conn.rollback()
+            except sqlite3.Error:
+                pass
+        if not self.reported_error:
+            sys.stderr.write("Unable to use hash cache {}: {}\n".format(self.filename, err))
+            self.reported_error = True
+
+    def close(self):
+        """
+        Write the last used times of entries found since the last flush and close the database.
+        """
+        with self.lock:
+            if self.conn is not None and self.conn_pid == os.getpid():
+                try:
+                    self._flush_touched()
+                except sqlite3.Error as err:
+                    self._database_error(err)
+                self.conn.close()
+            self.conn = None
+            self.touched_paths = {}
+
+    def _stat_matches(self, saved_key, current_key):
+        if self.trust_mtime:
+            return saved_key[:2] == current_key[:2]
+        return saved_key == current_key
+
+    @staticmethod
+    def _stat_key(stat_info):
+        return stat_info.st_size, get_mtime_ns(stat_info), stat_info.st_ino, stat_info.st_dev
+
+
+_hash_cache = None
+
+
+def get_hash_cache():
+    """
+    Return the HashCache used when hashing files or None if caching is disabled.
+    """
+    return _hash_cache
+
+
+def set_hash_cache(hash_cache):
+    """
+    Set the HashCache used when hashing files, closing any previous cache.
+    :param hash_cache: HashCache: cache to use or None to disable caching
+    """
+    global _hash_cache
+    if _hash_cache:
+        _hash_cache.close()
+    _hash_cache = hash_cache
+
+
+def setup_hash_cache(config):
+    """
+    Enable hash caching based on config settings. Disables caching if the cache file cannot be used.
+    :param config: ddsc.config.Config: contains hash_cache_filename, hash_cache_max_items and hash_cache_trust_mtime
+    """
+    hash_cache = None
+    if config.hash_cache_filename:
+        hash_cache = HashCache(config.hash_cache_filename, config.hash_cache_max_items,
+                               config.hash_cache_trust_mtime)
+        try:
+            hash_cache._get_connection()
+        except (sqlite3.Error, OSError) as err:
+            sys.stderr.write("Unable to use hash cache {}: {}\n".format(hash_cache.filename, err))
+            hash_cache = None
+    set_hash_cache(hash_cache)
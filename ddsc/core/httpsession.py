@@ -0,0 +1,138 @@
+"""
+Per process registry of requests sessions.
+Everything a process runs (including every task a worker process runs) shares one session so connections
+to DukeDS and the external object store are kept alive and reused instead of paying for a new TCP+TLS
+handshake for each task.
+"""
+import os
+import socket
+import threading
+import requests
+from requests.adapters import HTTPAdapter, DEFAULT_POOLSIZE
+from requests.packages.urllib3.connection import HTTPConnection
+from ddsc.config import THREAD_TRANSFER_ENGINE, PIPELINE_SMALL_FILE_ENGINE
+from ddsc.core.parallel import THREAD_EXECUTOR
+
+# Sends TCP keep-alive probes so idle pooled connections are not silently dropped by firewalls between tasks
+TCP_KEEP_ALIVE_SOCKET_OPTIONS = HTTPConnection.default_socket_options + [(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)]
+
+
+class KeepAliveHTTPAdapter(HTTPAdapter):
+    """
+    HTTPAdapter that turns on TCP keep-alive for the connections in its pools.
+    """
+    def init_poolmanager(self, *args, **kwargs):
+        kwargs['socket_options'] = TCP_KEEP_ALIVE_SOCKET_OPTIONS
+        super(KeepAliveHTTPAdapter, self).init_poolmanager(*args, **kwargs)
+
+
+class SessionRegistry(object):
+    """
+    Creates a single requests.Session for each process.
+    Sessions are not shared with child processes since the connections they hold can't be shared.
+    """
+    def __init__(self, pool_connections=DEFAULT_POOLSIZE, pool_maxsize=DEFAULT_POOLSIZE, tcp_keep_alive=True):
+        """
+        :param pool_connections: int: number of hosts to keep connection pools for
+        :param pool_maxsize: int: max connections to keep for each host
+        :param tcp_keep_alive: bool: turn on TCP keep-alive for pooled connections
+        """
+        self.pool_connections = pool_connections
+        self.pool_maxsize = pool_maxsize
+        self.tcp_keep_alive = tcp_keep_alive
+        self.sessions = {}
+        self.lock = threading.Lock()
+
+    def get_session(self):
+        """
+        Return the session for the current process creating it if necessary.
+        :return: requests.Session
+        """
+        pid = os.getpid()
+        with self.lock:
+            session = self.sessions.get(pid)
+            if session is None:
+                session = self.create_session()
+                self.sessions[pid] = session
+            return session
+
+    def reset_session(self):
+        """
+        Replace the session for the current process (for example after connection failures).
+        The previous session isn't closed since other threads may still be using it.
+        :return: requests.Session: the new session
+        """
+        with self.lock:
+            self.sessions.pop(os.getpid(), None)
+        return self.get_session()
+
+    def create_session(self):
+        """
+        Create a session with pools sized based on our settings.
+        :return: requests.Session
+        """
+        session = requests.Session()
+        adapter_class = KeepAliveHTTPAdapter if self.tcp_keep_alive else HTTPAdapter
+        adapter = adapter_class(pool_connections=self.pool_connections, pool_maxsize=self.pool_maxsize)
+        session.mount('https://', adapter)
+        session.mount('http://', adapter)
+        return session
+
+    def after_fork(self):
+        # The lock may have been held by another thread when the process was forked
+        self.lock = threading.Lock()
+
+
+_session_registry = SessionRegistry()
+
+
+def get_requests_session():
+    """
+    Return the requests.Session shared by everything running in this process.
+    """
+    return _session_registry.get_session()
+
+
+def reset_requests_session():
+    """
+    Replace the requests.Session shared by everything running in this process.
+    :return: requests.Session: the new session
+    """
+    return _session_registry.reset_session()
+
+
+def set_session_registry(session_registry):
+    """
+    Set the SessionRegistry used to create sessions.
+    :param session_registry: SessionRegistry: registry to use
+    """
+    global _session_registry
+    _session_registry = session_registry
+
+
+def setup_session_registry(config):
+    """
+    Size connection pools based on config settings.
+    Each setting that makes requests from many threads of this process at once keeps at least that many connections
+    in the pools: the thread transfer engine (transfer_concurrency), the small file pipeline
+    (small_file_pipeline_depth) and the thread upload executor (upload_workers).
+    :param config: ddsc.config.Config: contains http_pool_connections, http_pool_maxsize, http_tcp_keep_alive,
+    transfer_engine, transfer_concurrency, small_file_engine, small_file_pipeline_depth, upload_executor and
+    upload_workers
+    """
+    pool_maxsize = config.http_pool_maxsize
+    if config.transfer_engine == THREAD_TRANSFER_ENGINE:
+        pool_maxsize = max(pool_maxsize, config.transfer_concurrency)
+    if config.small_file_engine == PIPELINE_SMALL_FILE_ENGINE:
+        pool_maxsize = max(pool_maxsize, config.small_file_pipeline_depth)
+    if config.upload_executor == THREAD_EXECUTOR:
+        pool_maxsize = max(pool_maxsize, int(config.upload_workers))
+    set_session_registry(SessionRegistry(config.http_pool_connections, pool_maxsize, config.http_tcp_keep_alive))
+
+
+def _after_fork_in_child():
+    _session_registry.after_fork()
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_after_fork_in_child)
@@ -81,10 +81,18 @@ class IgnoreFilePatterns(object):
         :param followlinks: boolean: should we traverse symbolic links
         """
         for dir_name, child_dirs, child_files in os.walk(top_path, followlinks=followlinks):
-            for child_filename in child_files:
-                if child_filename == DDS_IGNORE_FILENAME:
-                    pattern_lines = self._read_non_empty_lines(dir_name, child_filename)
-                    self.add_patterns(dir_name, pattern_lines)
+            self.load_ignore_file(dir_name, child_files)
+
+    def load_ignore_file(self, dir_name, child_filenames):
+        """
+        Save patterns from the .ddsignore file in dir_name if child_filenames contains one.
+        Lets a single directory walk load patterns as each directory is entered, before filtering its children.
+        :param dir_name: str: directory being walked
+        :param child_filenames: [str]: names of the files within dir_name
+        """
+        if DDS_IGNORE_FILENAME in child_filenames:
+            pattern_lines = self._read_non_empty_lines(dir_name, DDS_IGNORE_FILENAME)
+            self.add_patterns(dir_name, pattern_lines)
 
     def add_patterns(self, dir_name, pattern_lines):
         """
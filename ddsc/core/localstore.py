@@ -1,9 +1,17 @@
 import hashlib
+import io
 import math
 import mimetypes
 import os
+import threading
+from multiprocessing.pool import ThreadPool
+from six.moves import queue
 from ddsc.core.ignorefile import FileFilter, IgnoreFilePatterns
-from ddsc.core.util import KindType
+from ddsc.core.util import KindType, intern_str, scandir
+from ddsc.core.hashcache import get_hash_cache
+
+# Read files being hashed in large blocks (a multiple of the page size) so hashlib can release the GIL
+HASH_FILE_BLOCK_SIZE = 1024 * 1024
 
 
 class LocalProject(object):
@@ -11,11 +19,12 @@ class LocalProject(object):
     Represents a list of folder/file trees on the filesystem.
     Has kind property to allow project tree traversal with ProjectWalker.
     """
-    def __init__(self, followsymlinks, file_exclude_regex):
+    def __init__(self, followsymlinks, file_exclude_regex, scan_workers=1):
         """
         Creates a list of local file system content that can be sent to a remote project.
         :param followsymlinks: bool follow symbolic links when looking for content
         :param file_exclude_regex: str: regex that should be used to filter out files we do not want to upload
+        :param scan_workers: int: number of threads used to scan directories (1 scans on the current thread)
         """
         self.remote_id = ''
         self.kind = KindType.project_str
@@ -23,6 +32,7 @@ class LocalProject(object):
         self.sent_to_remote = False
         self.followsymlinks = followsymlinks
         self.file_filter = FileFilter(file_exclude_regex)
+        self.scan_workers = scan_workers
 
     def add_path(self, path):
         """
@@ -30,7 +40,8 @@ class LocalProject(object):
         :param path: str path to add
         """
         abspath = os.path.abspath(path)
-        self.children.append(_build_project_tree(abspath, self.followsymlinks, self.file_filter))
+        self.children.append(_build_project_tree(abspath, self.followsymlinks, self.file_filter,
+                                                 self.scan_workers))
 
     def add_paths(self, path_list):
         """
@@ -40,13 +51,16 @@ class LocalProject(object):
         for path in path_list:
             self.add_path(path)
 
-    def update_remote_ids(self, remote_project):
+    def update_remote_ids(self, remote_project, hash_workers=1):
         """
         Compare against remote_project saving off the matching uuids of of matching content.
         :param remote_project: RemoteProject project to compare against
+        :param hash_workers: int: number of threads used to hash local files that exist in remote_project
         """
         if remote_project:
             self.remote_id = remote_project.id
+            if hash_workers > 1:
+                _hash_local_files(_find_files_to_hash(remote_project, self.children), hash_workers)
             _update_remote_children(remote_project, self.children)
 
     def set_remote_id_after_send(self, remote_id):
@@ -57,6 +71,29 @@ class LocalProject(object):
         self.remote_id = remote_id
         self.sent_to_remote = True
 
+    def find_duplicate_files(self, hash_workers=1):
+        """
+        Find files that need to be sent whose contents are the same as another file that needs to be sent.
+        Only files that have the same size as another file are hashed. Empty files are ignored.
+        :param hash_workers: int: number of threads used to hash files
+        :return: [[LocalFile]]: groups of two or more files with the same size and hash, each sorted by path
+        """
+        size_to_files = {}
+        for local_file in _find_files_to_send(self.children):
+            if local_file.size:
+                size_to_files.setdefault(local_file.size, []).append(local_file)
+        same_size_files = [local_file for local_files in size_to_files.values() if len(local_files) > 1
+                           for local_file in local_files]
+        if hash_workers > 1:
+            _hash_local_files(same_size_files, hash_workers)
+        content_to_files = {}
+        for local_file in same_size_files:
+            hash_data = local_file.get_path_data().get_hash()
+            content_to_files.setdefault((local_file.size, hash_data.alg, hash_data.value), []).append(local_file)
+        duplicate_files = [sorted(local_files, key=lambda local_file: local_file.path)
+                           for local_files in content_to_files.values() if len(local_files) > 1]
+        return sorted(duplicate_files, key=lambda local_files: local_files[0].path)
+
     def __str__(self):
         child_str = ', '.join([str(child) for child in self.children])
         return 'project: [{}]'.format(child_str)
@@ -87,17 +124,82 @@ def _update_remote_children(remote_parent, children):
             local_child.update_remote_ids(remote_child)
 
 
-def _build_project_tree(path, followsymlinks, file_filter):
+def _find_files_to_hash(remote_parent, children):
+    """
+    Find the local files that have a remote file with the same path and size and so will need to be hashed.
+    :param remote_parent: RemoteProject/RemoteFolder who has children
+    :param children: [LocalFolder,LocalFile] children to match against remote_parent's children
+    :return: [LocalFile]: local files that might match their remote file
+    """
+    local_files = []
+    pending = [(remote_parent, children)]
+    while pending:
+        remote_parent, children = pending.pop()
+        name_to_child = _name_to_child_map(children)
+        for remote_child in remote_parent.children:
+            local_child = name_to_child.get(remote_child.name)
+            if local_child and local_child.kind == remote_child.kind:
+                if local_child.is_file:
+                    if local_child.size == remote_child.size:
+                        local_files.append(local_child)
+                else:
+                    pending.append((remote_child, local_child.children))
+    return local_files
+
+
+def _find_files_to_send(children):
+    """
+    Find the files within children (and their descendants) that need to be sent.
+    :param children: [LocalFolder,LocalFile] items to search
+    :return: [LocalFile]: files that need to be sent
+    """
+    local_files = []
+    pending = list(children)
+    while pending:
+        item = pending.pop()
+        if item.is_file:
+            if item.need_to_send:
+                local_files.append(item)
+        else:
+            pending.extend(item.children)
+    return local_files
+
+
+def _hash_local_files(local_files, hash_workers):
+    """
+    Hash local_files using hash_workers threads saving the results in each file's PathData.
+    hashlib releases the GIL while hashing large blocks so the threads can keep several cores and disks busy.
+    Larger files are started first so one big file isn't left hashing by itself at the end.
+    :param local_files: [LocalFile]: files to hash
+    :param hash_workers: int: number of threads to hash with
+    """
+    pool = ThreadPool(hash_workers)
+    try:
+        pool.map(_hash_local_file, sorted(local_files, key=lambda local_file: local_file.size, reverse=True),
+                 chunksize=1)
+    finally:
+        pool.close()
+        pool.join()
+
+
+def _hash_local_file(local_file):
+    local_file.get_path_data().get_hash()
+
+
+def _build_project_tree(path, followsymlinks, file_filter, scan_workers=1):
     """
     Build a tree of LocalFolder with children or just a LocalFile based on a path.
     :param path: str path to a directory to walk
     :param followsymlinks: bool should we follow symlinks when walking
     :param file_filter: FileFilter: include method returns True if we should include a file/folder
+    :param scan_workers: int: number of threads used to scan directories
     :return: the top node of the tree LocalFile or LocalFolder
     """
     result = None
     if os.path.isfile(path):
         result = LocalFile(path)
+    elif scan_workers > 1:
+        result = ParallelFolderScanner(followsymlinks, file_filter, scan_workers).run(os.path.abspath(path))
     else:
         result = _build_folder_tree(os.path.abspath(path), followsymlinks, file_filter)
     return result
@@ -106,57 +208,204 @@ def _build_project_tree(path, followsymlinks, file_filter):
 def _build_folder_tree(top_abspath, followsymlinks, file_filter):
     """
     Build a tree of LocalFolder with children based on a path.
+    Walks the directories once, loading .ddsignore patterns as each directory is entered and
+    using the directory entries for file sizes so each directory is read once and each file stat-ed once.
     :param top_abspath: str path to a directory to walk
     :param followsymlinks: bool should we follow symlinks when walking
     :param file_filter: FileFilter: include method returns True if we should include a file/folder
     :return: the top node of the tree LocalFolder
     """
-    path_to_content = {}
-    child_to_parent = {}
+    top_folder = None
     ignore_file_patterns = IgnoreFilePatterns(file_filter)
-    ignore_file_patterns.load_directory(top_abspath, followsymlinks)
-    for dir_name, child_dirs, child_files in os.walk(top_abspath, followlinks=followsymlinks):
-        abspath = os.path.abspath(dir_name)
-        folder = LocalFolder(abspath)
-        path_to_content[abspath] = folder
-        # If we have a parent add us to it.
-        parent_path = child_to_parent.get(abspath)
-        if parent_path:
-            path_to_content[parent_path].add_child(folder)
-        remove_child_dirs = []
-        for child_dir in child_dirs:
-            # Record dir_name as the parent of child_dir so we can call add_child when get to it.
-            abs_child_path = os.path.abspath(os.path.join(dir_name, child_dir))
-            if ignore_file_patterns.include(abs_child_path, is_file=False):
-                child_to_parent[abs_child_path] = abspath
+    # (directory path, parent LocalFolder) popped in the same order os.walk would visit them
+    pending = [(top_abspath, None)]
+    while pending:
+        dir_path, parent = pending.pop()
+        scan_result = _scan_directory(dir_path, followsymlinks, ignore_file_patterns)
+        if scan_result:
+            folder, child_dir_paths = scan_result
+            if parent:
+                parent.add_child(folder)
             else:
-                remove_child_dirs.append(child_dir)
-        for remove_child_dir in remove_child_dirs:
-            child_dirs.remove(remove_child_dir)
-        for child_filename in child_files:
-            abs_child_filename = os.path.join(dir_name, child_filename)
-            if ignore_file_patterns.include(abs_child_filename, is_file=True):
-                folder.add_child(LocalFile(abs_child_filename))
-    return path_to_content.get(top_abspath)
+                top_folder = folder
+            for child_dir_path in reversed(child_dir_paths):
+                pending.append((child_dir_path, folder))
+    return top_folder
+
+
+def _scan_directory(dir_path, followsymlinks, ignore_file_patterns):
+    """
+    Read a single directory creating a LocalFolder containing its included files.
+    Loads the directory's .ddsignore patterns before filtering its children.
+    :param dir_path: str: absolute path of the directory to read
+    :param followsymlinks: bool should we include symlinked directories
+    :param ignore_file_patterns: IgnoreFilePatterns: determines which children are included
+    :return: (LocalFolder, [str]): folder and paths of the included child directories, None if unreadable
+    """
+    try:
+        entries = scandir(dir_path)
+    except OSError:
+        # like os.walk skip directories we can't read
+        return None
+    folder = LocalFolder(dir_path)
+    child_dir_paths = []
+    child_file_entries = []
+    for entry in entries:
+        if _is_dir_entry(entry):
+            if followsymlinks or not entry.is_symlink():
+                child_dir_paths.append(entry.path)
+        else:
+            child_file_entries.append(entry)
+    ignore_file_patterns.load_ignore_file(dir_path, [entry.name for entry in child_file_entries])
+    for entry in child_file_entries:
+        if ignore_file_patterns.include(entry.path, is_file=True):
+            folder.add_child(LocalFile(entry.path, size=entry.stat().st_size))
+    child_dir_paths = [child_dir_path for child_dir_path in child_dir_paths
+                       if ignore_file_patterns.include(child_dir_path, is_file=False)]
+    return folder, child_dir_paths
+
+
+def _is_dir_entry(entry):
+    """
+    Determine if a directory entry is a directory following symlinks. Entries we can't stat are treated as files.
+    :param entry: os.DirEntry: entry to check
+    :return: bool: True if entry is a directory
+    """
+    try:
+        return entry.is_dir()
+    except OSError:
+        return False
+
+
+class ParallelFolderScanner(object):
+    """
+    Builds a tree of LocalFolder with children by reading directories on a bounded number of threads.
+    Useful on network/parallel filesystems where reading a directory is slow but many can be read at once.
+    The resulting tree has the same order as _build_folder_tree regardless of which thread finishes first.
+    A directory's .ddsignore patterns only apply below it and are loaded before its child directories are queued.
+    """
+    def __init__(self, followsymlinks, file_filter, max_workers):
+        """
+        :param followsymlinks: bool should we follow symlinks when walking
+        :param file_filter: FileFilter: include method returns True if we should include a file/folder
+        :param max_workers: int: number of threads reading directories
+        """
+        self.followsymlinks = followsymlinks
+        self.ignore_file_patterns = IgnoreFilePatterns(file_filter)
+        self.max_workers = max_workers
+        self.work_queue = queue.Queue()
+        self.result_queue = queue.Queue()
+
+    def run(self, top_abspath):
+        """
+        Scan top_abspath and all included directories below it.
+        Raises the first error encountered reading a directory's contents.
+        :param top_abspath: str path to a directory to walk
+        :return: the top node of the tree LocalFolder or None if top_abspath can't be read
+        """
+        scanned = {}
+        threads = self._start_threads()
+        try:
+            self.work_queue.put(top_abspath)
+            in_flight = 1
+            while in_flight:
+                dir_path, scan_result, error = self.result_queue.get()
+                in_flight -= 1
+                if error is not None:
+                    raise error
+                if scan_result:
+                    scanned[dir_path] = scan_result
+                    for child_dir_path in scan_result[1]:
+                        self.work_queue.put(child_dir_path)
+                        in_flight += 1
+        finally:
+            for _ in threads:
+                self.work_queue.put(None)
+        return self._assemble_tree(top_abspath, scanned)
+
+    @staticmethod
+    def _assemble_tree(top_abspath, scanned):
+        """
+        Add each scanned folder to its parent in the order the parent listed them.
+        :param top_abspath: str path of the top directory
+        :param scanned: dict: directory path -> (LocalFolder, [str]) for each directory that could be read
+        :return: LocalFolder: top of the tree or None if top_abspath wasn't read
+        """
+        if top_abspath not in scanned:
+            return None
+        pending = [top_abspath]
+        while pending:
+            folder, child_dir_paths = scanned[pending.pop()]
+            for child_dir_path in child_dir_paths:
+                if child_dir_path in scanned:
+                    folder.add_child(scanned[child_dir_path][0])
+                    pending.append(child_dir_path)
+        return scanned[top_abspath][0]
+
+    def _start_threads(self):
+        threads = []
+        for _ in range(self.max_workers):
+            thread = threading.Thread(target=self._scan_directories)
+            thread.daemon = True
+            thread.start()
+            threads.append(thread)
+        return threads
+
+    def _scan_directories(self):
+        """
+        Called in a thread to read directories from work_queue until it receives None.
+        """
+        while True:
+            dir_path = self.work_queue.get()
+            if dir_path is None:
+                break
+            try:
+                scan_result = _scan_directory(dir_path, self.followsymlinks, self.ignore_file_patterns)
+                self.result_queue.put((dir_path, scan_result, None))
+            except Exception as err:
+                self.result_queue.put((dir_path, None, err))
+
+
+def get_local_path(item):
+    """
+    Build the absolute path of a LocalFolder/LocalFile by walking up its parent links.
+    The top most item stores its own absolute path in parent.
+    :param item: LocalFolder/LocalFile: item to find the path for
+    :return: str: absolute path of the item
+    """
+    names = []
+    while isinstance(item, (LocalFolder, LocalFile)):
+        names.append(item.name)
+        item = item.parent
+    names[-1] = item
+    return os.path.join(*reversed(names))
 
 
 class LocalFolder(object):
     """
     A folder on disk.
     Has kind property to allow project tree traversal with ProjectWalker.
+    Uses __slots__ and derives path from its parents to keep large trees small.
     """
+    __slots__ = ['name', 'children', 'remote_id', 'sent_to_remote', 'parent']
+    is_file = False
+    kind = KindType.folder_str
+
     def __init__(self, path):
         """
         Setup folder based on a path.
         :param path: str path to filesystem directory
         """
-        self.path = os.path.abspath(path)
-        self.name = os.path.basename(self.path)
+        abspath = os.path.abspath(path)
+        self.name = intern_str(os.path.basename(abspath))
         self.children = []
         self.remote_id = ''
-        self.is_file = False
-        self.kind = KindType.folder_str
         self.sent_to_remote = False
+        self.parent = abspath  # replaced by the parent folder when added to one
+
+    @property
+    def path(self):
+        return get_local_path(self)
 
     def add_child(self, child):
         """
@@ -164,6 +413,7 @@ class LocalFolder(object):
         :param child: LocalFolder/LocalFile to add
         """
         self.children.append(child)
+        child.parent = self
 
     def update_remote_ids(self, remote_folder):
         """
@@ -190,45 +440,61 @@ class LocalFile(object):
     """
     Represents a file on disk.
     Has kind property to allow project tree traversal with ProjectWalker.
+    Uses __slots__, derives path from its parents and creates PathData when first needed to keep large trees small.
     """
-    def __init__(self, path):
+    __slots__ = ['name', 'size', 'need_to_send', 'remote_id', 'sent_to_remote', 'parent', '_path_data']
+    is_file = True
+    kind = KindType.file_str
+
+    def __init__(self, path, size=None):
         """
         Setup file based on filesystem path.
         :param path: path to a file on the filesystem
+        :param size: int: size of the file if already known (otherwise read from the filesystem)
         """
-        self.path = os.path.abspath(path)
-        self.path_data = PathData(self.path)
-        self.name = self.path_data.name()
-        self.size = self.path_data.size()
-        self.mimetype = self.path_data.mime_type()
+        abspath = os.path.abspath(path)
+        self.name = os.path.basename(abspath)
+        self.size = size if size is not None else os.path.getsize(abspath)
         self.need_to_send = True
         self.remote_id = ''
-        self.is_file = True
-        self.kind = KindType.file_str
         self.sent_to_remote = False
+        self.parent = abspath  # replaced by the parent folder when added to one
+        self._path_data = None
+
+    @property
+    def path(self):
+        return get_local_path(self)
+
+    @property
+    def mimetype(self):
+        return self.get_path_data().mime_type()
 
     def get_path_data(self):
         """
         Return PathData created from internal path.
         """
-        return self.path_data
+        if self._path_data is None:
+            self._path_data = PathData(self.path)
+        return self._path_data
 
     def get_hash_value(self):
         """
         Return the current hash value for our path.
         :return: str: hash value
         """
-        return self.path_data.get_hash().value
+        return self.get_path_data().get_hash().value
 
     def update_remote_ids(self, remote_file):
         """
         Based on a remote file try to assign a remote_id and compare hash info.
+        Files with a different size than remote_file are different without needing to read them.
         :param remote_file: RemoteFile remote data pull remote_id from
         """
         self.remote_id = remote_file.id
-        hash_data = self.path_data.get_hash()
-        if hash_data.matches(remote_file.hash_alg, remote_file.file_hash):
-            self.need_to_send = False
+        if self.size == remote_file.size:
+            hash_data = self.get_path_data().get_hash()
+            if hash_data.matches(remote_file.hash_alg, remote_file.file_hash):
+                self.need_to_send = False
 
     def set_remote_id_after_send(self, remote_id):
         """
@@ -256,12 +522,12 @@ class HashData(object):
     """
     Hash info about a file.
     """
-    def __init__(self, hash_util):
+    def __init__(self, alg, value):
         """
-        Create hash info from hash_util with data already loaded.
-        :param hash_util: HashUtil with data populated
+        Create hash info from an algorithm and hash value.
+        :param alg: str: hash algorithm
+        :param value: str: hash value
         """
-        alg, value = hash_util.hexdigest()
         self.alg = alg
         self.value = value
 
@@ -274,16 +540,37 @@ class HashData(object):
         """
         return self.alg == hash_alg and self.value == hash_value
 
+    @staticmethod
+    def create_from_hash_util(hash_util):
+        """
+        Create hash info from hash_util with data already loaded.
+        :param hash_util: HashUtil with data populated
+        :return: HashData: hash alg and value
+        """
+        alg, value = hash_util.hexdigest()
+        return HashData(alg, value)
+
     @staticmethod
     def create_from_path(path):
         """
         Hash the local file at path and return HashData with results.
+        Uses the hash cache when the file hasn't changed since it was last hashed.
         :param path: str: path to file we will hash
         :return: HashData: hash alg and value
         """
+        hash_cache = get_hash_cache()
+        if hash_cache:
+            abspath = os.path.abspath(path)
+            stat_info = os.stat(abspath)
+            cached_hash = hash_cache.lookup(abspath, stat_info)
+            if cached_hash:
+                return HashData(*cached_hash)
         hash_util = HashUtil()
         hash_util.add_file(path)
-        return HashData(hash_util)
+        hash_data = HashData.create_from_hash_util(hash_util)
+        if hash_cache:
+            hash_cache.save(abspath, stat_info, hash_data.alg, hash_data.value)
+        return hash_data
 
     @staticmethod
     def create_from_chunk(chunk):
@@ -294,7 +581,7 @@ class HashData(object):
         """
         hash_util = HashUtil()
         hash_util.add_chunk(chunk)
-        return HashData(hash_util)
+        return HashData.create_from_hash_util(hash_util)
 
 
 class PathData(object):
@@ -307,6 +594,7 @@ class PathData(object):
         :param path: str: path
         """
         self.path = path
+        self.hash_data = None
 
     def name(self):
         """
@@ -334,10 +622,23 @@ class PathData(object):
 
     def get_hash(self):
         """
-        Create HashData for the file
+        Create HashData for the file (only reads the file the first time this is called).
         :return: HashData: alg and value of contents of the file
         """
-        return HashData.create_from_path(self.path)
+        if not self.hash_data:
+            self.hash_data = HashData.create_from_path(self.path)
+        return self.hash_data
+
+    def set_hash(self, hash_data, stat_info=None):
+        """
+        Save hash data that was computed while reading the file for some other purpose(such as uploading).
+        :param hash_data: HashData: alg and value of contents of the file
+        :param stat_info: os.stat_result: stat of the file from before it was read, when passed saves to the hash cache
+        """
+        self.hash_data = hash_data
+        hash_cache = get_hash_cache()
+        if hash_cache and stat_info:
+            hash_cache.save(os.path.abspath(self.path), stat_info, hash_data.alg, hash_data.value)
 
     def read_whole_file(self):
         """
@@ -359,15 +660,21 @@ class HashUtil(object):
     def __init__(self):
         self.hash = hashlib.md5()
 
-    def add_file(self, filename, block_size=4096):
+    def add_file(self, filename, block_size=HASH_FILE_BLOCK_SIZE):
         """
         Add an entire file to this hash.
+        Reads into a single reused buffer without python level buffering.
         :param filename: str filename of the file to hash
         :param block_size: int size of chunks when reading the file
         """
-        with open(filename, "rb") as f:
-            for chunk in iter(lambda: f.read(block_size), b""):
-                self.hash.update(chunk)
+        buf = bytearray(block_size)
+        view = memoryview(buf)
+        with io.open(filename, "rb", buffering=0) as f:
+            while True:
+                num_read = f.readinto(buf)
+                if not num_read:
+                    break
+                self.hash.update(view[:num_read])
 
     def add_chunk(self, chunk):
         """
@@ -4,14 +4,22 @@ TaskRunner executes a list of Tasks in parallel based on how many processes can
 Each Task consists of a unique_id, an task_id that it will wait for before running and a Command to execute.
 Each Command contains a function pointer to a global function to be run in the background and some
 setup/cleanup methods that will be run in the foreground.
+Tasks are run in a pool of processes by TaskExecutor or a pool of threads by ThreadTaskExecutor.
 """
 
 import multiprocessing
+from multiprocessing.pool import ThreadPool
 import queue
+import threading
 from collections import deque
 import traceback
 import sys
 
+PROCESS_EXECUTOR = 'process'
+THREAD_EXECUTOR = 'thread'
+# How long to wait for a task to finish before checking for messages from running tasks
+WAIT_FOR_TASK_SECONDS = 0.1
+
 
 class Task(object):
     """
@@ -159,12 +167,28 @@ class TaskExecutor(object):
         Setup to run tasks in background limiting to tasks_at_once processes.
         :param tasks_at_once: int: number of tasks we can run at once
         """
-        self.pool = multiprocessing.Pool()
+        self.pool = self.create_pool(tasks_at_once)
         self.tasks = deque()
         self.task_id_to_task = {}
         self.pending_results = []
         self.tasks_at_once = tasks_at_once
-        self.message_queue = multiprocessing.Manager().Queue()
+        self.message_queue = self.create_message_queue()
+        self.task_finished = threading.Event()
+
+    def create_pool(self, tasks_at_once):
+        """
+        Create the pool that will run task functions.
+        :param tasks_at_once: int: number of tasks we can run at once
+        :return: multiprocessing.Pool
+        """
+        return multiprocessing.Pool()
+
+    def create_message_queue(self):
+        """
+        Create the queue that tasks use to send messages back to their commands.
+        :return: Queue
+        """
+        return multiprocessing.Manager().Queue()
 
     def add_task(self, task, parent_task_result):
         """
@@ -198,9 +222,13 @@ class TaskExecutor(object):
         while len(finished_tasks_and_results) == 0:
             if self.is_done():
                 break
+            self.task_finished.clear()
             self.start_tasks()
             self.process_all_messages_in_queue()
             finished_tasks_and_results = self.get_finished_results()
+            if not finished_tasks_and_results:
+                # Sleep until a task finishes instead of spinning (which would starve worker threads)
+                self.task_finished.wait(WAIT_FOR_TASK_SECONDS)
         return finished_tasks_and_results
 
     def start_tasks(self):
@@ -219,9 +247,19 @@ class TaskExecutor(object):
         """
         task.before_run(parent_result)
         context = task.create_context(self.message_queue)
-        pending_result = self.pool.apply_async(execute_task_async, (task.func, task.id, context))
+        # failed tasks don't call _on_task_finished (error_callback requires python 3) and are noticed after
+        # WAIT_FOR_TASK_SECONDS instead
+        pending_result = self.pool.apply_async(execute_task_async, (task.func, task.id, context),
+                                               callback=self._on_task_finished)
         self.pending_results.append(pending_result)
 
+    def _on_task_finished(self, result):
+        """
+        Called by the pool in a background thread when a task finishes.
+        :param result: (task_id, object): result of the task
+        """
+        self.task_finished.set()
+
     def process_all_messages_in_queue(self):
         """
         Process all messages in the queue coming from tasks.
@@ -263,6 +301,43 @@ class TaskExecutor(object):
         return task_and_results
 
 
+class ThreadTaskExecutor(TaskExecutor):
+    """
+    Executes tasks in a pool of threads within this process.
+    Task contexts are not pickled and no processes are started so this suits tasks that mostly wait on the network.
+    Task functions must be safe to run in several threads at once.
+    """
+    def create_pool(self, tasks_at_once):
+        """
+        Create a pool with a thread for each task we can run at once.
+        :param tasks_at_once: int: number of tasks we can run at once
+        :return: multiprocessing.pool.ThreadPool
+        """
+        return ThreadPool(tasks_at_once)
+
+    def create_message_queue(self):
+        """
+        Create an in-process queue for tasks to send messages back to their commands.
+        :return: queue.Queue
+        """
+        return queue.Queue()
+
+
+def create_task_executor(executor_type, tasks_at_once):
+    """
+    Create a task executor of the specified type.
+    :param executor_type: str: PROCESS_EXECUTOR or THREAD_EXECUTOR
+    :param tasks_at_once: int: number of tasks we can run at once
+    :return: TaskExecutor
+    """
+    if executor_type == PROCESS_EXECUTOR:
+        return TaskExecutor(tasks_at_once)
+    if executor_type == THREAD_EXECUTOR:
+        return ThreadTaskExecutor(tasks_at_once)
+    raise ValueError("Invalid executor type {}, should be {} or {}.".format(
+        executor_type, PROCESS_EXECUTOR, THREAD_EXECUTOR))
+
+
 def execute_task_async(task_func, task_id, context):
     """
     Global function run for Task. multiprocessing requires a top level function.
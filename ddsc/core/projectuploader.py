@@ -1,7 +1,9 @@
 from ddsc.core.util import ProjectWalker, KindType
 from ddsc.core.ddsapi import DataServiceAuth, DataServiceApi
-from ddsc.core.fileuploader import FileUploader, FileUploadOperations, ParentData
-from ddsc.core.parallel import TaskExecutor, TaskRunner
+from ddsc.core.fileuploader import FileUploadOperations, ParentData, LargeFileUpload, create_chunk_processor
+from ddsc.core.parallel import TaskRunner, create_task_executor
+from ddsc.core.localstore import HashData
+from ddsc.core.smallfileuploader import SmallFilePipeline, create_small_file_uploads, use_small_file_pipeline
 
 
 class UploadSettings(object):
@@ -100,9 +102,11 @@ class ProjectUploader(object):
         Setup to talk to the data service based on settings.
         :param settings: UploadSettings: settings to use for uploading.
         """
-        self.runner = TaskRunner(TaskExecutor(settings.config.upload_workers))
+        config = settings.config
+        self.runner = TaskRunner(create_task_executor(config.upload_executor, config.upload_workers))
         self.settings = settings
         self.small_item_task_builder = SmallItemUploadTaskBuilder(self.settings, self.runner)
+        self.use_small_file_pipeline = use_small_file_pipeline(config)
         self.small_items = []
         self.large_items = []
 
@@ -112,9 +116,12 @@ class ProjectUploader(object):
         :param local_project: LocalProject: project to upload
         """
         # Walk project adding small items to runner saving large items to large_items
+        # (and small files to small_items when they are sent through the small file pipeline)
         ProjectWalker.walk_project(local_project, self)
         # Run small items in parallel
         self.runner.run()
+        # Send small files through the pipeline now that their parents exist
+        self.upload_small_items()
         # Run parts of each large item in parallel
         self.upload_large_items()
 
@@ -134,35 +141,42 @@ class ProjectUploader(object):
     def visit_file(self, item, parent):
         """
         If file is large add it to the large items to be processed after small task list.
-        else file is small add it to the small task list.
+        else file is small add it to the small items for the small file pipeline or the small task list.
         """
         if self.is_large_file(item):
             self.large_items.append((item, parent))
+        elif self.use_small_file_pipeline:
+            self.small_items.append((item, parent))
         else:
             self.small_item_task_builder.visit_file(item, parent)
 
     def is_large_file(self, item):
         return item.size > self.settings.config.upload_bytes_per_chunk
 
-    def upload_large_items(self):
+    def upload_small_items(self):
         """
-        Upload files that were too large.
+        Upload files saved in small_items through a SmallFilePipeline.
+        Updates each local_file with it's remote_id when done.
         """
-        for local_file, parent in self.large_items:
-            if local_file.need_to_send:
-                self.process_large_file(local_file, parent)
+        small_files = create_small_file_uploads(self.small_items)
+        if small_files:
+            pipeline = SmallFilePipeline(self.settings.config, self.settings.data_service, self.settings.watcher,
+                                         self.settings.file_upload_post_processor)
+            pipeline.run(self.settings.project_id, small_files)
 
-    def process_large_file(self, local_file, parent):
+    def upload_large_items(self):
         """
-        Upload a single file using multiple processes to upload multiple chunks at the same time.
-        Updates local_file with it's remote_id when done.
-        :param local_file: LocalFile: file we are uploading
-        :param parent: LocalFolder/LocalProject: parent of the file
+        Upload files that were too large sending chunks from all of them through a single pool of workers.
+        Updates each local_file with it's remote_id when done.
         """
-        file_content_sender = FileUploader(self.settings.config, self.settings.data_service, local_file,
-                                           self.settings.watcher, self.settings.file_upload_post_processor)
-        remote_id = file_content_sender.upload(self.settings.project_id, parent.kind, parent.remote_id)
-        local_file.set_remote_id_after_send(remote_id)
+        large_files = []
+        for local_file, parent in self.large_items:
+            if local_file.need_to_send:
+                large_files.append(LargeFileUpload(local_file, ParentData(parent.kind, parent.remote_id)))
+        if large_files:
+            chunk_processor = create_chunk_processor(self.settings.config, self.settings.data_service,
+                                                     self.settings.watcher, self.settings.file_upload_post_processor)
+            chunk_processor.run(self.settings.project_id, large_files)
 
 
 class SmallItemUploadTaskBuilder(object):
@@ -404,12 +418,12 @@ def create_small_file(upload_context):
     # The small file will fit into one chunk so read into memory and hash it.
     chunk_num = 1
     chunk = path_data.read_whole_file()
-    hash_data = path_data.get_hash()
+    hash_data = HashData.create_from_chunk(chunk)
 
     # Talk to data service uploading chunk and creating the file.
     upload_operations = FileUploadOperations(data_service, upload_context)
     upload_id = upload_operations.create_upload(upload_context.project_id, path_data, hash_data)
-    url_info = upload_operations.create_file_chunk_url(upload_id, chunk_num, chunk)
+    url_info = upload_operations.create_file_chunk_url(upload_id, chunk_num, chunk, hash_data)
     upload_operations.send_file_external(url_info, chunk)
     return upload_operations.finish_upload(upload_id, hash_data, parent_data, remote_file_id)
 
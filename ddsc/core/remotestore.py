@@ -1,6 +1,6 @@
 import os
 from ddsc.core.ddsapi import DataServiceApi, DataServiceError, DataServiceAuth
-from ddsc.core.util import KindType
+from ddsc.core.util import KindType, intern_str
 from ddsc.core.localstore import HashUtil
 
 FETCH_ALL_USERS_PAGE_SIZE = 25
@@ -74,8 +74,8 @@ class RemoteStore(object):
         :param project: RemoteProject root of the project tree to add children too
         :param exclude_response_fields: [str]: list of fields to exclude in the children response items
         """
-        response = self.data_service.get_project_children(project.id, '', exclude_response_fields).json()
-        project_children = RemoteProjectChildren(project.id, response['results'])
+        children_data = self.data_service.iterate_project_children(project.id, '', exclude_response_fields)
+        project_children = RemoteProjectChildren(project.id, children_data)
         for child in project_children.get_tree():
             project.add_child(child)
 
@@ -366,7 +366,11 @@ class RemoteFolder(object):
     Folder data from a remote store project_id_children or folder_id_children request.
     Represents a leaf or branch in a project tree.
     Has kind property to allow project tree traversal with ProjectWalker.
+    Uses __slots__ and derives remote_path from its parents to keep large trees small.
     """
+    __slots__ = ['id', 'name', 'is_deleted', 'children', 'parent']
+    kind = KindType.folder_str
+
     def __init__(self, json_data, parent_remote_path):
         """
         Set properties based on json_data.
@@ -374,11 +378,14 @@ class RemoteFolder(object):
         :param parent_remote_path: remote_path path to this folder's parent
         """
         self.id = json_data['id']
-        self.kind = json_data['kind']
-        self.name = json_data['name']
+        self.name = intern_str(json_data['name'])
         self.is_deleted = json_data['is_deleted']
         self.children = []
-        self.remote_path = os.path.join(parent_remote_path, self.name)
+        self.parent = parent_remote_path
+
+    @property
+    def remote_path(self):
+        return get_remote_path(self)
 
     def add_child(self, child):
         """
@@ -386,6 +393,7 @@ class RemoteFolder(object):
         :param child: RemoteFolder or remoteFile to add.
         """
         self.children.append(child)
+        child.parent = self
 
     def __str__(self):
         return 'folder: {} id:{} {}'.format(self.name, self.id, self.children)
@@ -396,7 +404,11 @@ class RemoteFile(object):
     File data from a remote store project_id_children or folder_id_children request.
     Represents a leaf in a project tree.
     Has kind property to allow project tree traversal with ProjectWalker.
+    Uses __slots__ and derives remote_path from its parents to keep large trees small.
     """
+    __slots__ = ['id', 'file_version_id', 'name', 'is_deleted', 'size', 'file_hash', 'hash_alg', 'parent']
+    kind = KindType.file_str
+
     def __init__(self, json_data, parent_remote_path):
         """
         Set properties based on json_data.
@@ -405,9 +417,7 @@ class RemoteFile(object):
         """
         self.id = json_data['id']
         self.file_version_id = json_data['current_version']['id']
-        self.kind = json_data['kind']
         self.name = json_data['name']
-        self.path = self.name  # for compatibility with ProgressPrinter
         self.is_deleted = json_data['is_deleted']
         upload = RemoteFile.get_upload_from_json(json_data)
         self.size = upload['size']
@@ -416,8 +426,19 @@ class RemoteFile(object):
         hash_data = RemoteFile.get_hash_from_upload(upload)
         if hash_data:
             self.file_hash = hash_data.get('value')
-            self.hash_alg = hash_data.get('algorithm')
-        self.remote_path = os.path.join(parent_remote_path, self.name)
+            self.hash_alg = intern_str(hash_data.get('algorithm'))
+        self.parent = parent_remote_path
+
+    @property
+    def path(self):
+        """
+        Name of the file for compatibility with ProgressPrinter.
+        """
+        return self.name
+
+    @property
+    def remote_path(self):
+        return get_remote_path(self)
 
     def set_hash(self, file_hash, hash_alg):
         """
@@ -501,57 +522,58 @@ class RemoteAuthRole(object):
         return 'id:{} name:{} description:{}'.format(self.id, self.name, self.description)
 
 
+def get_remote_path(item):
+    """
+    Build the remote path of a RemoteFolder/RemoteFile by walking up its parent links.
+    The top most item's parent is the remote path of its parent.
+    :param item: RemoteFolder/RemoteFile: item to find the path for
+    :return: str: remote path of the item
+    """
+    names = []
+    while isinstance(item, (RemoteFolder, RemoteFile)):
+        names.append(item.name)
+        item = item.parent
+    names.append(item)
+    return os.path.join(*reversed(names))
+
+
 class RemoteProjectChildren(object):
     """
     Creates RemoteFolders and RemoteFiles as tree structure based on DukeDS recursive project children data.
     """
     def __init__(self, project_id, data):
         """
-        Specify the project_id and the array of item dictionaries.
+        Specify the project_id and the item dictionaries.
         :param project_id: str: uuid of the project
-        :param data: [object]: DukeDS recursive project children
+        :param data: [object]: DukeDS recursive project children (can be a generator that is read once)
         """
         self.project_id = project_id
         self.data = data
 
-    def _get_children_for_parent(self, parent_id):
-        """
-        Given a parent uuid return a list of dictionaries.
-        :param parent_id: str: uuid of the parent
-        :return: [dict]: children in this list with parent_id parent
-        """
-        children = []
-        for child in self.data:
-            parent = child['parent']
-            if parent['id'] == parent_id:
-                children.append(child)
-        return children
-
     def get_tree(self):
         """
         Return array of RemoteFolders(with appropriate children)/RemoteFiles based on the values from constructor.
+        Each item is created as it is read from data so the item dictionaries can be discarded immediately.
+        Children are then added to their folders using a stack instead of recursion so deeply nested projects
+        are supported.
         :return: [RemoteFolder/RemoteFile]
         """
-        return self.get_tree_recur(self.project_id, '')
-
-    def get_tree_recur(self, parent_id, parent_path):
-        """
-        Recursively create array RemoteFolders/RemoteFiles.
-        :param parent_id: str: uuid if the parent to find children for
-        :param parent_path: str: remote path of parent to build child paths
-        :return: [RemoteFolder/RemoteFile]
-        """
-        children = []
-        for child_data in self._get_children_for_parent(parent_id):
+        children_by_parent = {}
+        for child_data in self.data:
             if child_data['kind'] == KindType.folder_str:
-                folder = RemoteFolder(child_data, parent_path)
-                for grand_child in self.get_tree_recur(child_data['id'], folder.remote_path):
-                    folder.add_child(grand_child)
-                children.append(folder)
+                child = RemoteFolder(child_data, '')
             else:
-                file = RemoteFile(child_data, parent_path)
-                children.append(file)
-        return children
+                child = RemoteFile(child_data, '')
+            children_by_parent.setdefault(child_data['parent']['id'], []).append(child)
+        tree = children_by_parent.pop(self.project_id, [])
+        pending = list(tree)
+        while pending:
+            child = pending.pop()
+            if child.kind == KindType.folder_str:
+                for grand_child in children_by_parent.pop(child.id, []):
+                    child.add_child(grand_child)
+                pending.extend(child.children)
+        return tree
 
 
 class RemoteAuthProvider(object):
@@ -0,0 +1,254 @@
+"""
+Uploads files small enough to be sent in a single chunk through a pipeline of stages.
+Each file needs five requests to DukeDS and the object store made one after another. Instead of a worker waiting
+on every request for one file before starting the next file, many files are kept in the pipeline at once and
+the next stage of each file is started as soon as its previous stage finishes, so requests for different files
+(and different stages) overlap and throughput is limited by how fast the servers respond rather than round trips.
+"""
+import sys
+import queue
+import threading
+import traceback
+from collections import deque
+from multiprocessing.pool import ThreadPool
+from ddsc.core.fileuploader import FileUploadOperations, ParentData, make_data_service
+from ddsc.core.localstore import HashData
+from ddsc.core.util import ProgressQueue
+from ddsc.config import TASK_SMALL_FILE_ENGINE, PIPELINE_SMALL_FILE_ENGINE
+
+SMALL_FILE_CHUNK_NUM = 1
+PIPELINE_CHUNKS_IN_FLIGHT = 2  # chunks worth of file contents held in the pipeline when upload_bytes_in_flight is unset
+
+
+class SmallFileUpload(object):
+    """
+    Holds the state of a single file while SmallFilePipeline moves it through the upload stages.
+    """
+    def __init__(self, local_file, parent_data):
+        """
+        :param local_file: LocalFile: file we are sending to remote store
+        :param parent_data: ParentData: info about the parent of this file
+        """
+        self.local_file = local_file
+        self.parent_data = parent_data
+        self.stage = 0
+        self.chunk = None
+        self.hash_data = None
+        self.upload_id = None
+        self.url_info = None
+        self.remote_file_data = None
+
+
+class SmallFilePipeline(object):
+    """
+    Uploads small files keeping up to depth files in the pipeline at once.
+    Stages run on a pool of threads that each have their own data service, so one thread replacing its requests
+    session after a connection error doesn't swap the session out from under requests other threads are making.
+    When a stage finishes the file is handed back to the main thread via a ProgressQueue which starts the file's
+    next stage, so the watcher and local files are only updated from the main thread.
+    Each file's contents are held in memory from when it is read until it has been sent, so files are only added to
+    the pipeline while the contents it holds stay within upload_bytes_in_flight.
+    """
+    def __init__(self, config, data_service, watcher, file_upload_post_processor=None):
+        """
+        :param config: ddsc.config.Config user configuration settings from YAML file/environment
+        :param data_service: DataServiceApi data service we are sending the content to.
+        :param watcher: ProgressPrinter we notify of our progress
+        :param file_upload_post_processor: object: has run(data_service, file_response) method to run after upload
+        """
+        self.config = config
+        self.depth = config.small_file_pipeline_depth
+        self.max_bytes_in_pipeline = self.determine_max_bytes_in_pipeline(config.upload_bytes_in_flight,
+                                                                          config.upload_bytes_per_chunk)
+        self.data_service = data_service
+        self.watcher = watcher
+        self.file_upload_post_processor = file_upload_post_processor
+        self.progress_queue = ProgressQueue(queue.Queue())
+        self.thread_data = threading.local()
+        self.project_id = None
+        self.stages = [
+            self.read_file,
+            self.create_upload,
+            self.create_url,
+            self.send_file,
+            self.complete_upload,
+            self.create_file,
+        ]
+
+    def run(self, project_id, small_files):
+        """
+        Upload small_files updating each local_file with its remote id as soon as it has been created.
+        Raises ValueError if any stage fails.
+        :param project_id: str: uuid of the project we are uploading files into
+        :param small_files: [SmallFileUpload]: files to upload
+        """
+        self.project_id = project_id
+        waiting_files = deque(small_files)
+        files_in_pipeline = 0
+        bytes_in_pipeline = 0
+        pool = ThreadPool(max(min(self.depth, len(small_files)), 1), initializer=self.setup_thread)
+        succeeded = False
+        try:
+            while waiting_files or files_in_pipeline:
+                while waiting_files and files_in_pipeline < self.depth and \
+                        self.has_room_for(bytes_in_pipeline, waiting_files[0]):
+                    small_file = waiting_files.popleft()
+                    self.start_stage(pool, small_file)
+                    files_in_pipeline += 1
+                    bytes_in_pipeline += small_file.local_file.size
+                progress_type, value = self.progress_queue.get()
+                if progress_type == ProgressQueue.PROCESSED:
+                    small_file = value
+                    if self.stages[small_file.stage] == self.send_file:
+                        bytes_in_pipeline -= small_file.local_file.size
+                    small_file.stage += 1
+                    if small_file.stage < len(self.stages):
+                        self.start_stage(pool, small_file)
+                    else:
+                        files_in_pipeline -= 1
+                        self.finish_file(small_file)
+                elif progress_type == ProgressQueue.START_WAITING:
+                    self.watcher.start_waiting()
+                elif progress_type == ProgressQueue.DONE_WAITING:
+                    self.watcher.done_waiting()
+                else:
+                    raise ValueError(value)
+            succeeded = True
+        finally:
+            if succeeded:
+                pool.close()
+            else:
+                pool.terminate()
+            pool.join()
+
+    @staticmethod
+    def determine_max_bytes_in_pipeline(bytes_in_flight, chunk_size):
+        """
+        Determine how many bytes of file contents may be held in the pipeline at once.
+        :param bytes_in_flight: int: max bytes of chunks to hold in memory or None to base it on chunk_size
+        :param chunk_size: int: size of each chunk we upload, small files are no larger than this
+        :return: int: max bytes of file contents read but not yet sent
+        """
+        if not bytes_in_flight:
+            return chunk_size * PIPELINE_CHUNKS_IN_FLIGHT
+        return bytes_in_flight
+
+    def has_room_for(self, bytes_in_pipeline, small_file):
+        """
+        Determine if small_file can be added to the pipeline without holding too many bytes of file contents.
+        A file is always added to an empty pipeline so files larger than the limit are still sent (one at a time).
+        :param bytes_in_pipeline: int: bytes of file contents read (or about to be read) but not yet sent
+        :param small_file: SmallFileUpload: next file to add
+        :return: bool: True if the file can be added
+        """
+        return not bytes_in_pipeline or bytes_in_pipeline + small_file.local_file.size <= self.max_bytes_in_pipeline
+
+    def setup_thread(self):
+        """
+        Create the data service used by the stages run in the current pool thread.
+        """
+        data_service = make_data_service(self.config, self.data_service.auth.get_auth_data())
+        self.thread_data.data_service = data_service
+        self.thread_data.upload_operations = FileUploadOperations(data_service, self.progress_queue)
+
+    def start_stage(self, pool, small_file):
+        """
+        Run the current stage of small_file in the background.
+        :param pool: ThreadPool: pool to run the stage in
+        :param small_file: SmallFileUpload: file to advance
+        """
+        pool.apply_async(self.run_stage, (small_file,))
+
+    def run_stage(self, small_file):
+        """
+        Run the current stage of small_file sending it to the progress queue when done or an error if it fails.
+        Runs in a pool thread.
+        :param small_file: SmallFileUpload: file to advance
+        """
+        try:
+            self.stages[small_file.stage](small_file)
+            self.progress_queue.processed(small_file)
+        except Exception:
+            self.progress_queue.error("".join(traceback.format_exception(*sys.exc_info())))
+
+    @staticmethod
+    def read_file(small_file):
+        """
+        The small file will fit into one chunk so read it into memory and hash it.
+        """
+        small_file.chunk = small_file.local_file.get_path_data().read_whole_file()
+        small_file.hash_data = HashData.create_from_chunk(small_file.chunk)
+
+    def create_upload(self, small_file):
+        """
+        Create an upload for the file, waiting for the project to be ready if necessary.
+        """
+        path_data = small_file.local_file.get_path_data()
+        small_file.upload_id = self.thread_data.upload_operations.create_upload(self.project_id, path_data,
+                                                                                small_file.hash_data)
+
+    def create_url(self, small_file):
+        """
+        Create the url for sending the file's only chunk.
+        """
+        small_file.url_info = self.thread_data.upload_operations.create_chunk_url(
+            small_file.upload_id, SMALL_FILE_CHUNK_NUM, len(small_file.chunk), small_file.hash_data)
+
+    def send_file(self, small_file):
+        """
+        Send the contents of the file to the object store, then release them.
+        """
+        self.thread_data.upload_operations.send_file_external(small_file.url_info, small_file.chunk)
+        small_file.chunk = None
+
+    def complete_upload(self, small_file):
+        """
+        Tell DukeDS all of the file's contents have been sent.
+        """
+        hash_data = small_file.hash_data
+        self.thread_data.data_service.complete_upload(small_file.upload_id, hash_data.value, hash_data.alg)
+
+    def create_file(self, small_file):
+        """
+        Create a new file or a new version of an existing file from the completed upload.
+        """
+        remote_file_id = small_file.local_file.remote_id
+        if remote_file_id:
+            resp = self.thread_data.data_service.update_file(remote_file_id, small_file.upload_id)
+        else:
+            parent_data = small_file.parent_data
+            resp = self.thread_data.data_service.create_file(parent_data.kind, parent_data.id, small_file.upload_id)
+        small_file.remote_file_data = resp.json()
+
+    def finish_file(self, small_file):
+        """
+        Save the results of a file that has made it through every stage.
+        :param small_file: SmallFileUpload: file that has been created in DukeDS
+        """
+        if self.file_upload_post_processor:
+            self.file_upload_post_processor.run(self.data_service, small_file.remote_file_data)
+        self.watcher.transferring_item(small_file.local_file)
+        small_file.local_file.set_remote_id_after_send(small_file.remote_file_data['id'])
+
+
+def create_small_file_uploads(small_items):
+    """
+    Create SmallFileUpload for each (local_file, parent) pair that needs to be sent.
+    :param small_items: [(LocalFile, parent)]: files and the folder/project they belong in
+    :return: [SmallFileUpload]
+    """
+    return [SmallFileUpload(local_file, ParentData(parent.kind, parent.remote_id))
+            for local_file, parent in small_items if local_file.need_to_send]
+
+
+def use_small_file_pipeline(config):
+    """
+    Determine if small files should be uploaded by SmallFilePipeline based on config.small_file_engine.
+    :param config: ddsc.config.Config user configuration settings from YAML file/environment
+    :return: bool: True for the pipeline engine, False to upload each file as a task
+    """
+    small_file_engine = config.small_file_engine
+    if small_file_engine not in (TASK_SMALL_FILE_ENGINE, PIPELINE_SMALL_FILE_ENGINE):
+        raise ValueError("Invalid small file engine {}, should be {} or {}.".format(
+            small_file_engine, TASK_SMALL_FILE_ENGINE, PIPELINE_SMALL_FILE_ENGINE))
+    return small_file_engine == PIPELINE_SMALL_FILE_ENGINE
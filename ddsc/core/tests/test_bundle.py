@@ -0,0 +1,228 @@
+from unittest import TestCase
+import hashlib
+import io
+import json
+import os
+import shutil
+import tarfile
+import tempfile
+from ddsc.core.bundle import bundle_small_files, create_bundle, write_bundle, write_bundles, unpack_bundle, \
+    is_bundle, is_unpacked, LocalBundleFile, BUNDLE_FILENAME, BUNDLE_MANIFEST_NAME
+from ddsc.core.localstore import LocalProject, LocalFile
+from mock import Mock
+
+
+class BundleTestCase(TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir)
+
+    def write_file(self, path, data):
+        path = os.path.join(self.temp_dir, path)
+        directory = os.path.dirname(path)
+        if not os.path.exists(directory):
+            os.makedirs(directory)
+        with open(path, 'wb') as outfile:
+            outfile.write(data)
+        return path
+
+
+class TestCreateBundle(BundleTestCase):
+    def test_create_bundle_then_unpack(self):
+        local_files = [LocalFile(self.write_file('data/b.txt', b'bbb')), LocalFile(self.write_file('data/a.txt', b'a'))]
+        os.chmod(local_files[0].path, 0o755)
+        bundle_path = os.path.join(self.temp_dir, 'bundles', '0', BUNDLE_FILENAME)
+
+        bundle = create_bundle(local_files)
+        self.assertFalse(os.path.exists(os.path.join(self.temp_dir, 'bundles')))
+        write_bundle(bundle, bundle_path)
+
+        self.assertEqual(BUNDLE_FILENAME, bundle.name)
+        self.assertEqual(bundle_path, bundle.get_path_data().path)
+        self.assertEqual(os.path.getsize(bundle_path), bundle.size)
+        with open(bundle_path, 'rb') as infile:
+            self.assertEqual(hashlib.md5(infile.read()).hexdigest(), bundle.get_hash_value())
+        self.assertEqual(['a.txt', 'b.txt'], [local_file.name for local_file in bundle.bundled_files])
+        with tarfile.open(bundle_path) as tar:
+            self.assertEqual(['a.txt', 'b.txt', BUNDLE_MANIFEST_NAME], tar.getnames())
+            manifest = json.loads(tar.extractfile(BUNDLE_MANIFEST_NAME).read().decode('utf-8'))
+        self.assertEqual([
+            {'name': 'a.txt', 'size': 1, 'hash_alg': 'md5', 'hash_value': hashlib.md5(b'a').hexdigest()},
+            {'name': 'b.txt', 'size': 3, 'hash_alg': 'md5', 'hash_value': hashlib.md5(b'bbb').hexdigest()},
+        ], manifest['files'])
+
+        dest_dir = os.path.join(self.temp_dir, 'download')
+        os.mkdir(dest_dir)
+        self.assertEqual(['a.txt', 'b.txt'], unpack_bundle(bundle_path, dest_dir))
+        with open(os.path.join(dest_dir, 'b.txt'), 'rb') as infile:
+            self.assertEqual(b'bbb', infile.read())
+        self.assertEqual(0o755, os.stat(os.path.join(dest_dir, 'b.txt')).st_mode & 0o777)
+
+    def test_create_bundle_is_repeatable(self):
+        local_files = [LocalFile(self.write_file('data/a.txt', b'a')), LocalFile(self.write_file('data/b.txt', b'b'))]
+        bundle1 = create_bundle(local_files)
+        os.utime(local_files[0].path, (0, 12345))
+        bundle2 = create_bundle(list(reversed(local_files)))
+        self.assertEqual(bundle1.get_hash_value(), bundle2.get_hash_value())
+
+    def test_write_bundle_raises_when_files_changed(self):
+        local_files = [LocalFile(self.write_file('data/a.txt', b'a'))]
+        bundle = create_bundle(local_files)
+        self.write_file('data/a.txt', b'b')
+        with self.assertRaises(ValueError) as raised_error:
+            write_bundle(bundle, os.path.join(self.temp_dir, 'bundles', BUNDLE_FILENAME))
+        self.assertIn('changed while they were being uploaded', str(raised_error.exception))
+        self.assertEqual(None, bundle.bundle_path)
+
+    def test_write_bundles_only_writes_bundles_that_need_to_be_sent(self):
+        bundle = create_bundle([LocalFile(self.write_file('data/a.txt', b'a'))])
+        unchanged_bundle = create_bundle([LocalFile(self.write_file('data/b.txt', b'b'))])
+        unchanged_bundle.need_to_send = False
+        write_bundles([bundle, unchanged_bundle])
+        self.assertTrue(os.path.exists(bundle.bundle_path))
+        self.assertEqual(None, unchanged_bundle.bundle_path)
+
+
+class TestBundleSmallFiles(BundleTestCase):
+    def test_bundles_folders_with_enough_tiny_files(self):
+        for name in ['a.txt', 'b.txt', 'c.txt']:
+            self.write_file(os.path.join('project', 'many', name), b'tiny')
+        self.write_file(os.path.join('project', 'many', 'big.txt'), b'x' * 100)
+        self.write_file(os.path.join('project', 'many', 'sub', 'd.txt'), b'tiny')
+        self.write_file(os.path.join('project', 'few', 'e.txt'), b'tiny')
+        local_project = LocalProject(followsymlinks=False, file_exclude_regex='')
+        local_project.add_path(os.path.join(self.temp_dir, 'project'))
+
+        bundles = bundle_small_files(local_project, max_file_size=10, min_files=2)
+
+        self.assertEqual(1, len(bundles))
+        self.assertEqual(['a.txt', 'b.txt', 'c.txt'], [local_file.name for local_file in bundles[0].bundled_files])
+        top_folder = local_project.children[0]
+        many_folder = [child for child in top_folder.children if child.name == 'many'][0]
+        few_folder = [child for child in top_folder.children if child.name == 'few'][0]
+        self.assertEqual([BUNDLE_FILENAME, 'big.txt', 'sub'], sorted(child.name for child in many_folder.children))
+        self.assertEqual(many_folder, bundles[0].parent)
+        self.assertIsInstance(many_folder.children[-1], LocalBundleFile)
+        self.assertEqual(['e.txt'], [child.name for child in few_folder.children])
+        self.assertEqual(os.path.join(self.temp_dir, 'project', 'many', BUNDLE_FILENAME), bundles[0].path)
+        self.assertFalse(os.path.exists(bundles[0].path))
+        self.assertEqual(None, bundles[0].bundle_path)
+
+    def test_skips_folder_that_already_has_a_bundle(self):
+        for name in ['a.txt', 'b.txt', BUNDLE_FILENAME]:
+            self.write_file(os.path.join('project', name), b'tiny')
+        local_project = LocalProject(followsymlinks=False, file_exclude_regex='')
+        local_project.add_path(os.path.join(self.temp_dir, 'project'))
+        self.assertEqual([], bundle_small_files(local_project, max_file_size=10, min_files=2))
+
+
+class TestUnpackBundle(BundleTestCase):
+    def create_tar(self, members):
+        bundle_path = os.path.join(self.temp_dir, BUNDLE_FILENAME)
+        with tarfile.open(bundle_path, 'w') as tar:
+            for name, data in members:
+                tar_info = tarfile.TarInfo(name)
+                tar_info.size = len(data)
+                tar.addfile(tar_info, io.BytesIO(data))
+        return bundle_path
+
+    def manifest(self, files):
+        return json.dumps({'version': 1, 'files': [
+            {'name': name, 'size': len(data), 'hash_alg': 'md5', 'hash_value': hashlib.md5(data).hexdigest()}
+            for name, data in files
+        ]}).encode('utf-8')
+
+    def test_rejects_paths_outside_destination(self):
+        bundle_path = self.create_tar([('../evil.txt', b'evil'), (BUNDLE_MANIFEST_NAME, self.manifest([]))])
+        with self.assertRaises(ValueError):
+            unpack_bundle(bundle_path, self.temp_dir)
+        self.assertFalse(os.path.exists(os.path.join(os.path.dirname(self.temp_dir), 'evil.txt')))
+
+    def test_raises_when_file_does_not_match_manifest(self):
+        bundle_path = self.create_tar([('a.txt', b'changed'), (BUNDLE_MANIFEST_NAME, self.manifest([('a.txt', b'a')]))])
+        with self.assertRaises(ValueError) as raised_error:
+            unpack_bundle(bundle_path, self.temp_dir)
+        self.assertIn('a.txt', str(raised_error.exception))
+
+    def test_raises_when_manifest_is_missing(self):
+        bundle_path = self.create_tar([('a.txt', b'a')])
+        with self.assertRaises(ValueError):
+            unpack_bundle(bundle_path, self.temp_dir)
+
+    def test_skips_existing_files_with_the_same_contents(self):
+        bundle_path = self.create_tar([('a.txt', b'a'), ('b.txt', b'b'),
+                                       (BUNDLE_MANIFEST_NAME, self.manifest([('a.txt', b'a'), ('b.txt', b'b')]))])
+        dest_dir = os.path.join(self.temp_dir, 'download')
+        existing_path = self.write_file(os.path.join('download', 'a.txt'), b'a')
+        os.chmod(existing_path, 0o600)
+        self.assertEqual(['a.txt', 'b.txt'], unpack_bundle(bundle_path, dest_dir))
+        self.assertEqual(0o600, os.stat(existing_path).st_mode & 0o777)
+        with open(os.path.join(dest_dir, 'b.txt'), 'rb') as infile:
+            self.assertEqual(b'b', infile.read())
+        self.assertEqual([BUNDLE_MANIFEST_NAME, 'a.txt', 'b.txt'], sorted(os.listdir(dest_dir)))
+
+    def test_raises_without_writing_anything_when_a_different_file_exists(self):
+        bundle_path = self.create_tar([('a.txt', b'a'), ('b.txt', b'b'),
+                                       (BUNDLE_MANIFEST_NAME, self.manifest([('a.txt', b'a'), ('b.txt', b'b')]))])
+        dest_dir = os.path.join(self.temp_dir, 'download')
+        existing_path = self.write_file(os.path.join('download', 'b.txt'), b'local changes')
+        with self.assertRaises(ValueError) as raised_error:
+            unpack_bundle(bundle_path, dest_dir)
+        self.assertIn(existing_path, str(raised_error.exception))
+        with open(existing_path, 'rb') as infile:
+            self.assertEqual(b'local changes', infile.read())
+        self.assertEqual(['b.txt'], os.listdir(dest_dir))
+
+
+class TestIsUnpacked(TestUnpackBundle):
+    def setUp(self):
+        super(TestIsUnpacked, self).setUp()
+        self.bundle_path = self.create_tar([('a.txt', b'a'), ('b.txt', b'bb'),
+                                            (BUNDLE_MANIFEST_NAME, self.manifest([('a.txt', b'a'), ('b.txt', b'bb')]))])
+        with open(self.bundle_path, 'rb') as infile:
+            self.remote_file = Mock(size=os.path.getsize(self.bundle_path), hash_alg='md5',
+                                    file_hash=hashlib.md5(infile.read()).hexdigest())
+        self.dest_dir = os.path.join(self.temp_dir, 'download')
+        os.mkdir(self.dest_dir)
+
+    def test_unpacked_bundle(self):
+        self.assertEqual(False, is_unpacked(self.remote_file, self.dest_dir))
+        unpack_bundle(self.bundle_path, self.dest_dir)
+        self.assertEqual(True, is_unpacked(self.remote_file, self.dest_dir))
+        with open(os.path.join(self.dest_dir, BUNDLE_MANIFEST_NAME), 'rb') as infile:
+            manifest = json.loads(infile.read().decode('utf-8'))
+        self.assertEqual({'size': self.remote_file.size, 'hash_alg': 'md5', 'hash_value': self.remote_file.file_hash},
+                         manifest['bundle'])
+        self.assertEqual(['a.txt', 'b.txt'], [manifest_file['name'] for manifest_file in manifest['files']])
+
+    def test_different_bundle(self):
+        unpack_bundle(self.bundle_path, self.dest_dir)
+        self.remote_file.file_hash = hashlib.md5(b'other').hexdigest()
+        self.assertEqual(False, is_unpacked(self.remote_file, self.dest_dir))
+
+    def test_changed_file(self):
+        unpack_bundle(self.bundle_path, self.dest_dir)
+        self.write_file(os.path.join('download', 'b.txt'), b'BB')
+        self.assertEqual(False, is_unpacked(self.remote_file, self.dest_dir))
+
+    def test_missing_file(self):
+        unpack_bundle(self.bundle_path, self.dest_dir)
+        os.remove(os.path.join(self.dest_dir, 'a.txt'))
+        self.assertEqual(False, is_unpacked(self.remote_file, self.dest_dir))
+
+    def test_unreadable_manifest(self):
+        self.write_file(os.path.join('download', BUNDLE_MANIFEST_NAME), b'not json')
+        self.assertEqual(False, is_unpacked(self.remote_file, self.dest_dir))
+        self.write_file(os.path.join('download', BUNDLE_MANIFEST_NAME), self.manifest([('a.txt', b'a')]))
+        self.assertEqual(False, is_unpacked(self.remote_file, self.dest_dir))
+
+
+class TestIsBundle(TestCase):
+    def test_is_bundle(self):
+        remote_file = Mock()
+        remote_file.name = BUNDLE_FILENAME
+        self.assertEqual(True, is_bundle(remote_file))
+        remote_file.name = 'data.tar'
+        self.assertEqual(False, is_bundle(remote_file))
@@ -4,7 +4,7 @@ import requests
 from ddsc.core.ddsapi import MultiJSONResponse, DataServiceApi, DataServiceAuth, SETUP_GUIDE_URL
 from ddsc.core.ddsapi import MissingInitialSetupError, SoftwareAgentNotFoundError, AuthTokenCreationError, \
     UnexpectedPagingReceivedError, DataServiceError, DSResourceNotConsistentError, \
-    retry_until_resource_is_consistent, retry_when_service_down
+    retry_until_resource_is_consistent, retry_when_service_down, ConcurrentPageFetcher
 from mock import MagicMock, Mock, patch
 
 
@@ -52,7 +52,7 @@ class TestMultiJSONResponse(TestCase):
 
 class TestDataServiceApi(TestCase):
     def create_mock_auth(self, config_page_size):
-        return MagicMock(set_status_msg=print, config=Mock(page_size=config_page_size))
+        return MagicMock(set_status_msg=print, config=Mock(page_size=config_page_size, page_fetch_workers=1))
 
     def test_get_collection_one_page(self):
         mock_requests = MagicMock()
@@ -455,6 +455,123 @@ class TestDataServiceApi(TestCase):
         self.assertEqual('this that', params['exclude_response_fields'])
 
 
+class TestConcurrentPageFetcher(TestCase):
+    def setUp(self):
+        self.mock_requests = MagicMock()
+        self.mock_requests.get.side_effect = self.get_page
+        self.failures = {}
+        self.num_pages = 6
+        auth = MagicMock(set_status_msg=print, config=Mock(page_size=100, page_fetch_workers=3))
+        self.api = DataServiceApi(auth=auth, url="something.com/v1/", http=self.mock_requests)
+
+    def get_page(self, url, headers, params):
+        page_num = params['page']
+        failures = self.failures.get(page_num)
+        if failures:
+            failure = failures.pop(0)
+            if isinstance(failure, Exception):
+                raise failure
+            return failure
+        return fake_response_with_pages(status_code=200, json_return_value={"results": [page_num]},
+                                        num_pages=self.num_pages)
+
+    def requested_pages(self):
+        return sorted(kwargs['params']['page'] for args, kwargs in self.mock_requests.get.call_args_list)
+
+    def test_get_collection_fetches_pages_concurrently_in_order(self):
+        response = self.api._get_collection(url_suffix="projects", data={})
+        self.assertEqual([1, 2, 3, 4, 5, 6], response.json()["results"])
+        self.assertEqual([1, 2, 3, 4, 5, 6], self.requested_pages())
+
+    @patch('ddsc.core.ddsapi.time.sleep')
+    def test_get_collection_retries_overloaded_pages(self, mock_sleep):
+        self.failures[3] = [fake_response(status_code=503, json_return_value={})]
+        self.failures[5] = [requests.exceptions.ConnectionError()]
+        response = self.api._get_collection(url_suffix="projects", data={})
+        self.assertEqual([1, 2, 3, 4, 5, 6], response.json()["results"])
+        self.assertEqual([1, 2, 3, 3, 4, 5, 5, 6], self.requested_pages())
+        self.assertEqual(2, mock_sleep.call_count)
+
+    @patch('ddsc.core.ddsapi.time.sleep')
+    def test_get_collection_waits_for_service_after_max_retries(self, mock_sleep):
+        self.api.set_status_message = Mock()
+        self.failures[2] = [fake_response(status_code=503, json_return_value={}) for _ in range(4)]
+        response = self.api._get_collection(url_suffix="projects", data={})
+        self.assertEqual([1, 2, 3, 4, 5, 6], response.json()["results"])
+        self.assertEqual([1, 2, 2, 2, 2, 2, 3, 4, 5, 6], self.requested_pages())
+        # the last failure shows the service down message while waiting
+        self.assertEqual(2, self.api.set_status_message.call_count)
+
+    def test_get_collection_raises_other_errors(self):
+        self.failures[4] = [fake_response(status_code=500, json_return_value={})]
+        with self.assertRaises(DataServiceError) as raised_error:
+            self.api._get_collection(url_suffix="projects", data={})
+        self.assertEqual(500, raised_error.exception.status_code)
+
+    def test_iterate_collection_yields_items_in_order(self):
+        items = self.api._iterate_collection(url_suffix="projects", data={})
+        self.assertEqual(1, next(items))
+        self.assertEqual(1, self.mock_requests.get.call_count, 'later pages are fetched once they are needed')
+        self.assertEqual([2, 3, 4, 5, 6], list(items))
+        self.assertEqual([1, 2, 3, 4, 5, 6], self.requested_pages())
+
+    def test_iterate_collection_sequential(self):
+        self.api.auth.config.page_fetch_workers = 1
+        self.assertEqual([1, 2, 3, 4, 5, 6], list(self.api._iterate_collection(url_suffix="projects", data={})))
+
+    def test_iterate_collection_single_page(self):
+        self.num_pages = 1
+        self.assertEqual([1], list(self.api._iterate_collection(url_suffix="projects", data={})))
+        self.mock_requests.get.side_effect = None
+        self.mock_requests.get.return_value = fake_response(status_code=200, json_return_value={"results": [1]})
+        self.assertEqual([1], list(self.api._iterate_collection(url_suffix="projects", data={})))
+
+    def test_iterate_limits_pages_ahead(self):
+        fetcher = ConcurrentPageFetcher(self.api, 'projects', {}, max_workers=2)
+        fetcher.data_service = Mock()
+        fetcher.data_service._fetch_page.side_effect = lambda url_suffix, data, page_num: page_num
+        responses = fetcher.iterate(list(range(2, 20)))
+        self.assertEqual(2, next(responses))
+        self.assertLessEqual(fetcher.data_service._fetch_page.call_count, 5)
+        self.assertEqual(list(range(3, 20)), list(responses))
+
+    def test_concurrency_adapts_to_overload(self):
+        fetcher = ConcurrentPageFetcher(self.api, 'projects', {}, max_workers=4)
+        fetcher.data_service = Mock()
+        overload_error = DataServiceError(fake_response(status_code=503, json_return_value={}), '', '')
+        fetcher.data_service._fetch_page.side_effect = [overload_error, overload_error, 'page2', 'page3']
+        with patch('ddsc.core.ddsapi.time.sleep'):
+            self.assertEqual(['page2', 'page3'], fetcher.run([2, 3]))
+        self.assertEqual(3, fetcher.concurrency)
+
+    def test_is_overload_error(self):
+        self.assertTrue(ConcurrentPageFetcher.is_overload_error(
+            DataServiceError(fake_response(status_code=503, json_return_value={}), '', '')))
+        self.assertTrue(ConcurrentPageFetcher.is_overload_error(
+            DataServiceError(fake_response(status_code=429, json_return_value={}), '', '')))
+        self.assertTrue(ConcurrentPageFetcher.is_overload_error(requests.exceptions.Timeout()))
+        self.assertFalse(ConcurrentPageFetcher.is_overload_error(
+            DataServiceError(fake_response(status_code=400, json_return_value={}), '', '')))
+        self.assertFalse(ConcurrentPageFetcher.is_overload_error(ValueError()))
+
+
+class TestIterateProjectChildren(TestCase):
+    def test_iterate_project_children(self):
+        mock_requests = MagicMock()
+        mock_requests.get.return_value = fake_response_with_pages(status_code=200,
+                                                                  json_return_value={"results": [{'id': '1'}]},
+                                                                  num_pages=1)
+        auth = MagicMock(set_status_msg=print, config=Mock(page_size=100, page_fetch_workers=4))
+        api = DataServiceApi(auth=auth, url="something.com/v1", http=mock_requests)
+        children = api.iterate_project_children(project_id='123', name_contains='test',
+                                                exclude_response_fields=['this', 'that'])
+        self.assertEqual([{'id': '1'}], list(children))
+        args, kwargs = mock_requests.get.call_args
+        self.assertEqual('something.com/v1/projects/123/children', args[0])
+        self.assertEqual('test', kwargs['params']['name_contains'])
+        self.assertEqual('this that', kwargs['params']['exclude_response_fields'])
+
+
 class TestDataServiceAuth(TestCase):
     @patch('ddsc.core.ddsapi.get_user_agent_str')
     @patch('ddsc.core.ddsapi.requests')
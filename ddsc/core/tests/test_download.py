@@ -1,7 +1,7 @@
 from __future__ import absolute_import
 from unittest import TestCase
 from ddsc.core.download import ProjectDownload
-from mock import MagicMock, Mock, patch
+from mock import MagicMock, Mock, patch, call
 
 
 class TestProjectDownload(TestCase):
@@ -39,11 +39,139 @@ class TestProjectDownload(TestCase):
         # args[0] is data_service
         self.assertEqual(fake_file, args[1])
 
+    @patch('ddsc.core.download.create_download_pool')
+    def test_run_shares_download_pool(self, mock_download_pool):
+        project_download = ProjectDownload(remote_store=MagicMock(),
+                                           project=Mock(name='test'),
+                                           dest_directory='/tmp/fakedir',
+                                           path_filter=MagicMock())
+        project_download.walk_project = MagicMock()
+        project_download.walk_project.side_effect = ValueError("oops")
+        with self.assertRaises(ValueError):
+            project_download.run()
+        mock_download_pool.assert_called_with(project_download.remote_store.config)
+        mock_download_pool.return_value.shutdown.assert_called_with()
+
+    @patch('ddsc.core.download.FileDownloader')
+    @patch('ddsc.core.download.ProjectDownload.check_file_size')
+    @patch('ddsc.core.download.os')
+    @patch('ddsc.core.download.PathData')
+    def test_visit_file_uses_download_pool(self, mock_path_data, mock_os, mock_check_file_size,
+                                           mock_file_downloader):
+        mock_path_data.return_value.get_hash.return_value.matches.return_value = False
+        project_download = ProjectDownload(remote_store=MagicMock(),
+                                           project=Mock(name='test'),
+                                           dest_directory='/tmp/fakedir',
+                                           path_filter=MagicMock())
+        project_download.watcher = Mock()
+        project_download.download_pool = Mock()
+        fake_file = MagicMock()
+        project_download.visit_file(fake_file, None)
+        args, kwargs = mock_file_downloader.call_args
+        self.assertEqual(project_download.download_pool, args[4])
+        mock_file_downloader.return_value.run.assert_not_called()
+        self.assertEqual([mock_file_downloader.return_value], project_download.file_downloaders)
+
+    @patch('ddsc.core.download.FileDownloader')
+    @patch('ddsc.core.download.PartialDownloadState')
+    @patch('ddsc.core.download.PathData')
+    def test_visit_file_partial_download_skips_hash(self, mock_path_data, mock_partial_download_state,
+                                                    mock_file_downloader):
+        mock_partial_download_state.exists.return_value = True
+        project_download = ProjectDownload(remote_store=MagicMock(),
+                                           project=Mock(name='test'),
+                                           dest_directory='/tmp/fakedir',
+                                           path_filter=MagicMock())
+        project_download.watcher = Mock()
+        fake_file = MagicMock(remote_path='data.txt')
+        project_download.visit_file(fake_file, None)
+        mock_partial_download_state.exists.assert_called_with('/tmp/fakedir/data.txt')
+        mock_path_data.assert_not_called()
+        self.assertEqual([mock_file_downloader.return_value], project_download.file_downloaders)
+
+    @patch('ddsc.core.download.is_unpacked')
+    @patch('ddsc.core.download.FileDownloader')
+    @patch('ddsc.core.download.PartialDownloadState')
+    @patch('ddsc.core.download.PathData')
+    def test_visit_file_records_bundles(self, mock_path_data, mock_partial_download_state, mock_file_downloader,
+                                        mock_is_unpacked):
+        mock_is_unpacked.return_value = False
+        mock_partial_download_state.exists.return_value = True
+        project_download = ProjectDownload(remote_store=MagicMock(),
+                                           project=Mock(name='test'),
+                                           dest_directory='/tmp/fakedir',
+                                           path_filter=MagicMock())
+        project_download.watcher = Mock()
+        bundle_file = MagicMock(remote_path='data/.ddsclient-bundle.tar')
+        bundle_file.name = '.ddsclient-bundle.tar'
+        other_file = MagicMock(remote_path='data/data.txt')
+        other_file.name = 'data.txt'
+        project_download.visit_file(bundle_file, None)
+        project_download.visit_file(other_file, None)
+        self.assertEqual(['/tmp/fakedir/data/.ddsclient-bundle.tar'], project_download.bundle_paths)
+        self.assertEqual(2, len(project_download.file_downloaders))
+        mock_is_unpacked.assert_called_once_with(bundle_file, '/tmp/fakedir/data')
+
+    @patch('ddsc.core.download.is_unpacked')
+    @patch('ddsc.core.download.FileDownloader')
+    @patch('ddsc.core.download.PartialDownloadState')
+    def test_visit_file_skips_unpacked_bundles(self, mock_partial_download_state, mock_file_downloader,
+                                               mock_is_unpacked):
+        mock_is_unpacked.return_value = True
+        project_download = ProjectDownload(remote_store=MagicMock(),
+                                           project=Mock(name='test'),
+                                           dest_directory='/tmp/fakedir',
+                                           path_filter=MagicMock())
+        project_download.watcher = Mock()
+        bundle_file = MagicMock(remote_path='data/.ddsclient-bundle.tar', size=1000)
+        bundle_file.name = '.ddsclient-bundle.tar'
+        project_download.visit_file(bundle_file, None)
+        self.assertEqual([], project_download.bundle_paths)
+        self.assertEqual([], project_download.file_downloaders)
+        mock_file_downloader.assert_not_called()
+        project_download.watcher.transferring_item.assert_called_with(bundle_file, increment_amt=1000)
+
+    @patch('ddsc.core.download.os')
+    @patch('ddsc.core.download.unpack_bundle')
+    def test_unpack_bundles(self, mock_unpack_bundle, mock_os):
+        mock_os.path.dirname.return_value = '/tmp/fakedir/data'
+        project_download = ProjectDownload(remote_store=MagicMock(),
+                                           project=Mock(name='test'),
+                                           dest_directory='/tmp/fakedir',
+                                           path_filter=MagicMock())
+        project_download.bundle_paths = ['/tmp/fakedir/data/.ddsclient-bundle.tar']
+        project_download.unpack_bundles()
+        mock_unpack_bundle.assert_called_with('/tmp/fakedir/data/.ddsclient-bundle.tar', '/tmp/fakedir/data')
+        mock_os.remove.assert_called_with('/tmp/fakedir/data/.ddsclient-bundle.tar')
+
+    @patch('ddsc.core.download.FileDownloadPlanner')
+    @patch('ddsc.core.download.ProjectDownload.check_file_size')
+    def test_download_files(self, mock_check_file_size, mock_planner):
+        project_download = ProjectDownload(remote_store=MagicMock(),
+                                           project=Mock(name='test'),
+                                           dest_directory='/tmp/fakedir',
+                                           path_filter=MagicMock())
+        project_download.watcher = Mock()
+        project_download.download_pool = Mock()
+        file_downloader1 = Mock(remote_file='file1', path='/tmp/fakedir/file1')
+        file_downloader2 = Mock(remote_file='file2', path='/tmp/fakedir/file2')
+        project_download.file_downloaders = [file_downloader1, file_downloader2]
+        project_download.download_files()
+        mock_planner.assert_called_with(project_download.remote_store.config, project_download.download_pool,
+                                        project_download.watcher)
+        mock_planner.return_value.add_file.assert_has_calls([call(file_downloader1), call(file_downloader2)])
+        mock_planner.return_value.run.assert_called_with()
+        mock_check_file_size.assert_has_calls([
+            call('file1', '/tmp/fakedir/file1'),
+            call('file2', '/tmp/fakedir/file2'),
+        ])
+
     @patch('ddsc.core.download.os')
     @patch('ddsc.core.download.PathData')
     def test_file_exists_with_same_hash(self, mock_path_data, mock_os):
-        item = Mock(hash_alg='md5', file_hash='f@ncyh@shvalue')
+        item = Mock(hash_alg='md5', file_hash='f@ncyh@shvalue', size=100)
         path = '/tmp/somepath/data.txt'
+        mock_os.path.getsize.return_value = 100
 
         # Case where file doesn't exist
         mock_os.path.exists.return_value = False
@@ -63,3 +191,9 @@ class TestProjectDownload(TestCase):
         self.assertEqual(False, ProjectDownload.file_exists_with_same_hash(item, path))
         mock_path_data.return_value.get_hash.return_value.matches.assert_called_with('md5', 'f@ncyh@shvalue')
         mock_path_data.reset_mock()
+
+        # Case where file exists with a different size is not read
+        mock_os.path.getsize.return_value = 101
+        mock_path_data.return_value.get_hash.return_value.matches.return_value = True
+        self.assertEqual(False, ProjectDownload.file_exists_with_same_hash(item, path))
+        mock_path_data.assert_not_called()
@@ -1,20 +1,30 @@
 from unittest import TestCase
-import ddsc.core.filedownloader
-from ddsc.core.filedownloader import FileDownloader, download_async, ChunkDownloader, \
-    TooLargeChunkDownloadError, PartialChunkDownloadError, get_file_chunk_url_and_headers, GetFileUrl
+import os
+import json
+import shutil
+import tempfile
+from ddsc.core.filedownloader import FileDownloader, download_range, download_worker, ChunkDownloader, \
+    TooLargeChunkDownloadError, PartialChunkDownloadError, get_file_chunk_url_and_headers, GetFileUrl, \
+    DownloadWorkerPool, FileDownloadPlanner, RangeProgressQueue, PartialDownloadState, make_range_headers, \
+    create_download_pool, ThreadDownloadPool
+from ddsc.core.util import ProgressQueue
 from requests.exceptions import ConnectionError
-from mock import patch, MagicMock, Mock, call
+from mock import patch, MagicMock, Mock, call, ANY
 
 
 class FakeConfig(object):
-    def __init__(self, download_workers):
+    def __init__(self, download_workers, download_bytes_in_flight=None):
         self.download_workers = download_workers
+        self.download_bytes_in_flight = download_bytes_in_flight
+        self.transfer_engine = 'process'
 
 
 class FakeFile(object):
     def __init__(self, size):
         self.size = size
         self.id = '123'
+        self.hash_alg = 'md5'
+        self.file_hash = 'abc'
 
 
 class FakeWatcher(object):
@@ -26,12 +36,18 @@ class FakeWatcher(object):
 
 
 class TestDownloader(FileDownloader):
-    def __init__(self, config, remote_file, path, watcher):
-        super(TestDownloader, self).__init__(config, remote_file, path, watcher)
+    def __init__(self, config, remote_file, path, watcher, download_pool=None):
+        super(TestDownloader, self).__init__(config, remote_file, path, watcher, download_pool)
 
     def make_big_empty_file(self):
         pass
 
+    def load_partial_state(self):
+        return None
+
+    def create_partial_state(self, ranges):
+        return None
+
 
 sample_url_parts = {
     'host': 'myhost',
@@ -88,46 +104,61 @@ class TestFileDownloader(TestCase):
         downloader = FileDownloader(config, FakeFile(file_size), None, None)
         self.assertEqual(expected, downloader.make_ranges())
 
-    def test_chunk_that_fails(self):
+    @patch('ddsc.core.filedownloader.RemoteStore')
+    def test_chunk_that_fails(self, mock_remote_store):
         file_size = 83833112
         config = FakeConfig(3)
-        ddsc.core.filedownloader.download_async = self.chunk_download_fails
         downloader = TestDownloader(config, FakeFile(file_size), None, None)
-        try:
-            downloader.run()
-        except ValueError as err:
-            self.assertEqual("oops", str(err))
+        with patch('ddsc.core.filedownloader.download_range', self.chunk_download_fails):
+            with self.assertRaises(ValueError) as raised_error:
+                downloader.run()
+        self.assertEqual("oops", str(raised_error.exception))
 
-    def chunk_download_fails(self, config, remote_file_id, range_headers, path, seek_amt, bytes_to_read,
-                             progress_queue):
+    def chunk_download_fails(self, remote_store, requests_session, remote_file_id, range_headers, path, seek_amt,
+                             bytes_to_read, progress_queue):
         progress_queue.error("oops")
 
-    def test_download_whole_chunk(self):
+    @patch('ddsc.core.filedownloader.RemoteStore')
+    def test_download_whole_chunk(self, mock_remote_store):
         file_size = 83833112
         config = FakeConfig(3)
         watcher = FakeWatcher()
-        ddsc.core.filedownloader.download_async = self.chunk_download_one_piece
         downloader = TestDownloader(config, FakeFile(file_size), None, watcher)
-        downloader.run()
+        with patch('ddsc.core.filedownloader.download_range', self.chunk_download_one_piece):
+            downloader.run()
         self.assertEqual(file_size, watcher.amt)
 
-    def chunk_download_one_piece(self, config, remote_file_id, range_headers, path, seek_amt, bytes_to_read,
-                                 progress_queue):
+    def chunk_download_one_piece(self, remote_store, requests_session, remote_file_id, range_headers, path,
+                                 seek_amt, bytes_to_read, progress_queue):
         start, end = range_headers['Range'].replace("bytes=", "").split('-')
         total = (int(end) - int(start) + 1)
         progress_queue.processed(total)
 
-    def test_download_chunk_in_two_parts(self):
+    @patch('ddsc.core.filedownloader.RemoteStore')
+    def test_download_chunk_in_two_parts(self, mock_remote_store):
         file_size = 83833112
         config = FakeConfig(3)
         watcher = FakeWatcher()
-        ddsc.core.filedownloader.download_async = self.chunk_download_two_parts
         downloader = TestDownloader(config, FakeFile(file_size), None, watcher)
-        downloader.run()
+        with patch('ddsc.core.filedownloader.download_range', self.chunk_download_two_parts):
+            downloader.run()
         self.assertEqual(file_size, watcher.amt)
 
-    def chunk_download_two_parts(self, config, remote_file_id, range_headers, path, seek_amt, bytes_to_read,
-                                 progress_queue):
+    @patch('ddsc.core.filedownloader.RemoteStore')
+    def test_download_with_shared_pool(self, mock_remote_store):
+        config = FakeConfig(3)
+        watcher = FakeWatcher()
+        download_pool = DownloadWorkerPool(config)
+        with patch('ddsc.core.filedownloader.download_range', self.chunk_download_two_parts):
+            for file_size in [83833112, 100, 0]:
+                TestDownloader(config, FakeFile(file_size), None, watcher, download_pool).run()
+            self.assertEqual(3, len(download_pool.processes))
+            download_pool.shutdown()
+        self.assertEqual(83833112 + 100, watcher.amt)
+        self.assertEqual([], download_pool.processes)
+
+    def chunk_download_two_parts(self, remote_store, requests_session, remote_file_id, range_headers, path,
+                                 seek_amt, bytes_to_read, progress_queue):
         start, end = range_headers['Range'].replace("bytes=", "").split('-')
         total = (int(end) - int(start) + 1)
         first = int(total / 2)
@@ -138,55 +169,74 @@ class TestFileDownloader(TestCase):
 
 class TestDownloadFunctions(TestCase):
     @patch('ddsc.core.filedownloader.ChunkDownloader')
-    @patch('ddsc.core.filedownloader.RemoteStore')
-    def test_download_async_too_large_error(self, mock_remote_store, mock_chunk_downloader):
+    def test_download_range_too_large_error(self, mock_chunk_downloader):
         # If we get too much data we should quit immediately sending a message to the progress_queue error
         mock_chunk_downloader.return_value.run.side_effect = TooLargeChunkDownloadError(100, 10, '/tmp/data.dat')
         progress_queue = MagicMock()
-        download_async(config=MagicMock(), remote_file_id=123, range_headers={}, path=None, seek_amt=0,
-                       bytes_to_read=10, progress_queue=progress_queue)
+        download_range(remote_store=MagicMock(), requests_session=MagicMock(), remote_file_id=123, range_headers={},
+                       path=None, seek_amt=0, bytes_to_read=10, progress_queue=progress_queue)
         self.assertEqual(1, mock_chunk_downloader.call_count, "on too big we should only try downloading once")
         expected = 'Received too many bytes downloading part of a file. Actual: 100 Expected: 10 File:/tmp/data.dat'
         progress_queue.error.assert_called_with(expected)
 
     @patch('ddsc.core.filedownloader.ChunkDownloader')
     @patch('ddsc.core.filedownloader.time.sleep')
-    @patch('ddsc.core.filedownloader.RemoteStore')
-    def test_download_async_partial_twice(self, mock_remote_store, mock_sleep, mock_chunk_downloader):
+    def test_download_range_partial_twice(self, mock_sleep, mock_chunk_downloader):
+        mock_chunk_downloader.return_value.actual_bytes_read = 0
         mock_chunk_downloader.return_value.run.side_effect = [
             PartialChunkDownloadError(2, 10, '/tmp/data.dat'),
             PartialChunkDownloadError(2, 10, '/tmp/data.dat'),
             None
         ]
         progress_queue = MagicMock()
-        download_async(config=MagicMock(), remote_file_id=123, range_headers={}, path=None, seek_amt=0,
-                       bytes_to_read=10, progress_queue=progress_queue)
+        download_range(remote_store=MagicMock(), requests_session=MagicMock(), remote_file_id=123, range_headers={},
+                       path=None, seek_amt=0, bytes_to_read=10, progress_queue=progress_queue)
         self.assertEqual(3, mock_chunk_downloader.call_count, 'we should retry downloading multiple times')
         self.assertEqual(0, progress_queue.error.call_count, 'there should have been no errors')
         self.assertEqual(2, mock_sleep.call_count, 'we should have called sleep')
-        self.assertEqual(2, mock_chunk_downloader().revert_progress.call_count)
 
+    @patch('ddsc.core.filedownloader.get_file_chunk_url_and_headers')
     @patch('ddsc.core.filedownloader.ChunkDownloader')
     @patch('ddsc.core.filedownloader.time.sleep')
-    @patch('ddsc.core.filedownloader.RemoteStore')
-    def test_download_async_connection_error_twice(self, mock_remote_store, mock_sleep, mock_chunk_downloader):
+    def test_download_range_partial_resumes_range(self, mock_sleep, mock_chunk_downloader, mock_get_url_and_headers):
+        mock_get_url_and_headers.return_value = ('someurl', {})
+        mock_chunk_downloader.return_value.actual_bytes_read = 4
+        mock_chunk_downloader.return_value.run.side_effect = [
+            PartialChunkDownloadError(4, 10, '/tmp/data.dat'),
+            PartialChunkDownloadError(4, 6, '/tmp/data.dat'),
+            None
+        ]
+        progress_queue = MagicMock()
+        download_range(remote_store=MagicMock(), requests_session=MagicMock(), remote_file_id=123,
+                       range_headers={'Range': 'bytes=100-109'}, path=None, seek_amt=100, bytes_to_read=10,
+                       progress_queue=progress_queue)
+        self.assertEqual(0, progress_queue.error.call_count, 'there should have been no errors')
+        range_headers = [args[2] for args, kwargs in mock_get_url_and_headers.call_args_list]
+        self.assertEqual([{'Range': 'bytes=100-109'}, {'Range': 'bytes=104-109'}, {'Range': 'bytes=108-109'}],
+                         range_headers)
+        seek_and_size = [args[3:5] for args, kwargs in mock_chunk_downloader.call_args_list]
+        self.assertEqual([(100, 10), (104, 6), (108, 2)], seek_and_size)
+
+    @patch('ddsc.core.filedownloader.ChunkDownloader')
+    @patch('ddsc.core.filedownloader.time.sleep')
+    def test_download_range_connection_error_twice(self, mock_sleep, mock_chunk_downloader):
+        mock_chunk_downloader.return_value.actual_bytes_read = 0
         mock_chunk_downloader.return_value.run.side_effect = [
             ConnectionError(),
             ConnectionError(),
             None
         ]
         progress_queue = MagicMock()
-        download_async(config=MagicMock(), remote_file_id=123, range_headers={}, path=None, seek_amt=0,
-                       bytes_to_read=10, progress_queue=progress_queue)
+        download_range(remote_store=MagicMock(), requests_session=MagicMock(), remote_file_id=123, range_headers={},
+                       path=None, seek_amt=0, bytes_to_read=10, progress_queue=progress_queue)
         self.assertEqual(3, mock_chunk_downloader.call_count, 'we should retry downloading multiple times')
         self.assertEqual(0, progress_queue.error.call_count, 'there should have been no errors')
         self.assertEqual(2, mock_sleep.call_count, 'we should have called sleep')
-        self.assertEqual(2, mock_chunk_downloader().revert_progress.call_count)
 
     @patch('ddsc.core.filedownloader.ChunkDownloader')
     @patch('ddsc.core.filedownloader.time.sleep')
-    @patch('ddsc.core.filedownloader.RemoteStore')
-    def test_download_async_partial_too_many_times(self, mock_remote_store, mock_sleep, mock_chunk_downloader):
+    def test_download_range_partial_too_many_times(self, mock_sleep, mock_chunk_downloader):
+        mock_chunk_downloader.return_value.actual_bytes_read = 0
         mock_chunk_downloader.return_value.run.side_effect = [
             PartialChunkDownloadError(2, 10, '/tmp/data.dat'),
             PartialChunkDownloadError(2, 10, '/tmp/data.dat'),
@@ -196,14 +246,50 @@ class TestDownloadFunctions(TestCase):
             PartialChunkDownloadError(2, 10, '/tmp/data.dat'),
         ]
         progress_queue = MagicMock()
-        download_async(config=MagicMock(), remote_file_id=123, range_headers={}, path=None, seek_amt=0,
-                       bytes_to_read=10, progress_queue=progress_queue)
+        download_range(remote_store=MagicMock(), requests_session=MagicMock(), remote_file_id=123, range_headers={},
+                       path=None, seek_amt=0, bytes_to_read=10, progress_queue=progress_queue)
         self.assertEqual(6, mock_chunk_downloader.call_count, 'we should retry downloading multiple times')
         self.assertEqual(5, mock_sleep.call_count, 'we should have called sleep four times')
         self.assertEqual(1, progress_queue.error.call_count)
         expected = 'Received too few bytes downloading part of a file. Actual: 2 Expected: 10 File:/tmp/data.dat'
         progress_queue.error.assert_called_with(expected)
-        self.assertEqual(5, mock_chunk_downloader().revert_progress.call_count)
+
+    @patch('ddsc.core.filedownloader.download_range')
+    @patch('ddsc.core.filedownloader.get_requests_session')
+    @patch('ddsc.core.filedownloader.RemoteStore')
+    def test_download_worker_reuses_connections(self, mock_remote_store, mock_get_requests_session,
+                                                mock_download_range):
+        work_queue = MagicMock()
+        work_queue.get.side_effect = [
+            (0, '123', {'Range': 'bytes=0-9'}, '/tmp/data1.dat', 0, 10),
+            (1, '456', {'Range': 'bytes=0-4'}, '/tmp/data2.dat', 0, 5),
+            None
+        ]
+        progress_queue = MagicMock()
+        download_worker(MagicMock(), work_queue, progress_queue)
+        self.assertEqual(1, mock_remote_store.call_count)
+        self.assertEqual(1, mock_get_requests_session.call_count)
+        remote_store = mock_remote_store.return_value
+        requests_session = mock_get_requests_session.return_value
+        self.assertEqual(2, mock_download_range.call_count)
+        for range_id, expected_args in enumerate([
+            (remote_store, requests_session, '123', {'Range': 'bytes=0-9'}, '/tmp/data1.dat', 0, 10),
+            (remote_store, requests_session, '456', {'Range': 'bytes=0-4'}, '/tmp/data2.dat', 0, 5),
+        ]):
+            args, kwargs = mock_download_range.call_args_list[range_id]
+            self.assertEqual(expected_args, args[:-1])
+            range_progress_queue = args[-1]
+            self.assertEqual(progress_queue, range_progress_queue.progress_queue)
+            self.assertEqual(range_id, range_progress_queue.range_id)
+
+    @patch('ddsc.core.filedownloader.RemoteStore')
+    def test_download_worker_setup_error(self, mock_remote_store):
+        mock_remote_store.side_effect = ValueError("bad config")
+        work_queue = MagicMock()
+        progress_queue = MagicMock()
+        download_worker(MagicMock(), work_queue, progress_queue)
+        progress_queue.error.assert_called_with("bad config")
+        work_queue.get.assert_not_called()
 
     @patch('ddsc.core.filedownloader.retry_until_resource_is_consistent')
     def test_get_file_chunk_url_and_headers(self, mock_retry_func):
@@ -284,17 +370,154 @@ class ChunkDownloaderTest(TestCase):
         with self.assertRaises(PartialChunkDownloadError):
             chunk_downloader.run()
 
-    def test_revert_progress(self):
+    @patch("ddsc.core.filedownloader.open")
+    def test_flushes_each_chunk_before_reporting_progress(self, mock_open):
+        calls = Mock()
+        outfile = mock_open.return_value.__enter__.return_value
+        calls.attach_mock(outfile.write, 'write')
+        calls.attach_mock(outfile.flush, 'flush')
         progress_queue = MagicMock()
-        chunk_downloader = ChunkDownloader(url=None,
-                                           http_headers=None,
+        calls.attach_mock(progress_queue.processed, 'processed')
+        requests_session = MagicMock()
+        requests_session.get.return_value.iter_content.return_value = ['12345', '67890']
+        chunk_downloader = ChunkDownloader(url='someurl',
+                                           http_headers={},
                                            path=None,
-                                           seek_amt=10,
+                                           seek_amt=0,
                                            bytes_to_read=10,
-                                           progress_queue=progress_queue)
-        chunk_downloader.actual_bytes_read = 101
-        chunk_downloader.revert_progress()
-        progress_queue.processed.assert_called_with(-101)
+                                           progress_queue=progress_queue,
+                                           requests_session=requests_session)
+        chunk_downloader.run()
+        self.assertEqual([
+            call.write('12345'), call.flush(), call.processed(5),
+            call.write('67890'), call.flush(), call.processed(5),
+        ], calls.mock_calls)
+
+    @patch("ddsc.core.filedownloader.open")
+    def test_run_uses_requests_session(self, mock_open):
+        requests_session = MagicMock()
+        requests_session.get.return_value.iter_content.return_value = ['12345']
+        chunk_downloader = ChunkDownloader(url='someurl',
+                                           http_headers={},
+                                           path=None,
+                                           seek_amt=0,
+                                           bytes_to_read=5,
+                                           progress_queue=MagicMock(),
+                                           requests_session=requests_session)
+        chunk_downloader.run()
+        requests_session.get.assert_called_with('someurl', headers={}, stream=True)
+
+    def test_make_range_headers(self):
+        self.assertEqual({'Range': 'bytes=0-9'}, make_range_headers(0, 10))
+        self.assertEqual({'Range': 'bytes=10-10'}, make_range_headers(10, 1))
+
+
+class TestDownloadWorkerPool(TestCase):
+    def test_determine_num_workers(self):
+        values = [
+            # download_workers, expected
+            (4, 4),
+            (1, 1),
+            (0, 1),
+            (None, 1),
+            ('None', 1),
+        ]
+        for download_workers, expected in values:
+            self.assertEqual(expected, DownloadWorkerPool.determine_num_workers(download_workers))
+
+    @patch('ddsc.core.filedownloader.Process')
+    def test_add_range_starts_workers_once(self, mock_process):
+        download_pool = DownloadWorkerPool(FakeConfig(2))
+        download_pool.work_queue = MagicMock()
+        download_pool.add_range(0, '123', '/tmp/data.dat', 0, 9)
+        download_pool.add_range(1, '123', '/tmp/data.dat', 10, 14)
+        self.assertEqual(2, mock_process.call_count)
+        download_pool.work_queue.put.assert_has_calls([
+            call((0, '123', {'Range': 'bytes=0-9'}, '/tmp/data.dat', 0, 10)),
+            call((1, '123', {'Range': 'bytes=10-14'}, '/tmp/data.dat', 10, 5)),
+        ])
+
+
+class TestRangeProgressQueue(TestCase):
+    def test_processed_includes_range_id(self):
+        progress_queue = MagicMock()
+        range_progress_queue = RangeProgressQueue(progress_queue, 7)
+        range_progress_queue.processed(100)
+        progress_queue.processed.assert_called_with((7, 100))
+        range_progress_queue.error('oops')
+        progress_queue.error.assert_called_with('oops')
+        range_progress_queue.start_waiting()
+        progress_queue.start_waiting.assert_called_with()
+        range_progress_queue.done_waiting()
+        progress_queue.done_waiting.assert_called_with()
+
+
+class TestFileDownloadPlanner(TestCase):
+    def setUp(self):
+        self.config = MagicMock(download_workers=2, download_bytes_in_flight=None)
+        self.download_pool = MagicMock(num_workers=2)
+        self.watcher = FakeWatcher()
+        self.messages = []
+        self.download_pool.progress_queue.get.side_effect = lambda: self.messages.pop(0)
+        self.download_pool.add_range.side_effect = self.add_range
+        self.added_ranges = []
+
+    def add_range(self, range_id, remote_file_id, path, range_start, range_end):
+        self.added_ranges.append((range_id, remote_file_id, range_start, range_end))
+        self.messages.append((ProgressQueue.PROCESSED, (range_id, range_end - range_start + 1)))
+
+    def make_file_downloader(self, file_id, file_size):
+        remote_file = FakeFile(file_size)
+        remote_file.id = file_id
+        return TestDownloader(self.config, remote_file, '/tmp/' + file_id, self.watcher)
+
+    def test_run_downloads_ranges_from_all_files(self):
+        planner = FileDownloadPlanner(self.config, self.download_pool, self.watcher)
+        for file_id, file_size in [('1', 10), ('2', 0), ('3', 50 * 1024 * 1024), ('4', 5)]:
+            planner.add_file(self.make_file_downloader(file_id, file_size))
+        planner.run()
+        self.assertEqual([
+            (0, '1', 0, 9),
+            (1, '3', 0, 26214399),
+            (2, '3', 26214400, 52428799),
+            (3, '4', 0, 4),
+        ], self.added_ranges)
+        self.assertEqual(10 + 50 * 1024 * 1024 + 5, self.watcher.amt)
+        self.assertEqual({}, planner.ranges_in_flight)
+        self.assertEqual(0, planner.bytes_in_flight)
+
+    def test_run_limits_ranges_in_flight(self):
+        # Don't report progress until we have stopped adding ranges
+        self.download_pool.add_range.side_effect = lambda *args: self.added_ranges.append(args)
+        self.download_pool.progress_queue.get.side_effect = ValueError("waiting for progress")
+        planner = FileDownloadPlanner(self.config, self.download_pool, self.watcher)
+        for file_id in ['1', '2', '3', '4', '5', '6']:
+            planner.add_file(self.make_file_downloader(file_id, 10))
+        with self.assertRaises(ValueError):
+            planner.run()
+        self.assertEqual(4, len(self.added_ranges))
+
+    def test_run_limits_bytes_in_flight(self):
+        self.config.download_bytes_in_flight = 25
+        self.download_pool.add_range.side_effect = lambda *args: self.added_ranges.append(args)
+        self.download_pool.progress_queue.get.side_effect = ValueError("waiting for progress")
+        planner = FileDownloadPlanner(self.config, self.download_pool, self.watcher)
+        for file_id in ['1', '2', '3', '4']:
+            planner.add_file(self.make_file_downloader(file_id, 10))
+        with self.assertRaises(ValueError):
+            planner.run()
+        self.assertEqual(2, len(self.added_ranges))
+        self.assertEqual(20, planner.bytes_in_flight)
+
+    def test_run_terminates_workers_on_error(self):
+        self.download_pool.add_range.side_effect = None
+        self.messages.append((ProgressQueue.ERROR, 'oops'))
+        planner = FileDownloadPlanner(self.config, self.download_pool, self.watcher)
+        planner.add_file(self.make_file_downloader('1', 10))
+        with self.assertRaises(ValueError) as raised_error:
+            planner.run()
+        self.assertEqual('oops', str(raised_error.exception))
+        self.download_pool.terminate.assert_called_with()
 
 
 class TestGetFileUrl(TestCase):
@@ -309,3 +532,192 @@ class TestGetFileUrl(TestCase):
         url_info = get_file_url.run()
         mock_data_service.get_file_url.assert_called_with('123')
         self.assertEqual({'url': '/files/1'}, url_info)
+
+
+class TestPartialDownloadState(TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.temp_dir, 'data.dat')
+        with open(self.path, 'wb') as outfile:
+            outfile.write(b'\0' * 30)
+        self.remote_file = FakeFile(30)
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir)
+
+    def test_save_and_load(self):
+        partial_state = PartialDownloadState(self.path, self.remote_file, [[0, 9, 0], [10, 19, 0], [20, 29, 0]])
+        self.assertFalse(PartialDownloadState.exists(self.path))
+        partial_state.save()
+        self.assertTrue(PartialDownloadState.exists(self.path))
+        partial_state.add_progress(0, 10)
+        partial_state.add_progress(10, 4)
+
+        partial_state = PartialDownloadState.load(self.path, self.remote_file)
+        self.assertTrue(partial_state.resumed)
+        self.assertEqual([(10, 19), (20, 29)], partial_state.remaining_ranges())
+        self.assertEqual(20, partial_state.bytes_remaining())
+
+        partial_state.remove()
+        self.assertFalse(PartialDownloadState.exists(self.path))
+
+    @patch('ddsc.core.filedownloader.time')
+    def test_add_progress_saves_periodically(self, mock_time):
+        mock_time.time.return_value = 100
+        partial_state = PartialDownloadState(self.path, self.remote_file, [[0, 29, 0]])
+        partial_state.save()
+        partial_state.add_progress(0, 5)
+        self.assertEqual([(0, 29)], PartialDownloadState.load(self.path, self.remote_file).remaining_ranges())
+        mock_time.time.return_value = 200
+        partial_state.add_progress(0, 5)
+        self.assertEqual([(10, 29)], PartialDownloadState.load(self.path, self.remote_file).remaining_ranges())
+
+    def test_load_removes_state_for_different_file(self):
+        PartialDownloadState(self.path, self.remote_file, [[0, 29, 0]]).save()
+        other_version = FakeFile(30)
+        other_version.file_hash = 'def'
+        self.assertEqual(None, PartialDownloadState.load(self.path, other_version))
+        self.assertFalse(PartialDownloadState.exists(self.path))
+
+    def test_load_removes_state_when_file_size_changed(self):
+        PartialDownloadState(self.path, self.remote_file, [[0, 29, 0]]).save()
+        with open(self.path, 'ab') as outfile:
+            outfile.write(b'more')
+        self.assertEqual(None, PartialDownloadState.load(self.path, self.remote_file))
+        self.assertFalse(PartialDownloadState.exists(self.path))
+
+    def test_load_removes_invalid_state(self):
+        with open(PartialDownloadState.state_path(self.path), 'w') as outfile:
+            outfile.write('{"file":')
+        self.assertEqual(None, PartialDownloadState.load(self.path, self.remote_file))
+        self.assertFalse(PartialDownloadState.exists(self.path))
+
+
+class TestFileDownloaderResume(TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.temp_dir, 'data.dat')
+        self.file_size = 50 * 1024 * 1024
+        self.remote_file = FakeFile(self.file_size)
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir)
+
+    def read_state_ranges(self):
+        with open(PartialDownloadState.state_path(self.path)) as infile:
+            return json.load(infile)['ranges']
+
+    def test_prepare_ranges_new_large_file_saves_state(self):
+        file_downloader = FileDownloader(FakeConfig(2), self.remote_file, self.path, FakeWatcher())
+        self.assertEqual([(0, 26214399), (26214400, 52428799)], file_downloader.prepare_ranges())
+        self.assertEqual(self.file_size, os.path.getsize(self.path))
+        self.assertEqual([[0, 26214399, 0], [26214400, 52428799, 0]], self.read_state_ranges())
+        self.assertEqual(0, file_downloader.bytes_already_downloaded())
+
+    def test_prepare_ranges_small_file_has_no_state(self):
+        file_downloader = FileDownloader(FakeConfig(2), FakeFile(10), self.path, FakeWatcher())
+        self.assertEqual([(0, 9)], file_downloader.prepare_ranges())
+        self.assertFalse(PartialDownloadState.exists(self.path))
+
+    def test_prepare_ranges_resumes_partial_download(self):
+        file_downloader = FileDownloader(FakeConfig(2), self.remote_file, self.path, FakeWatcher())
+        file_downloader.prepare_ranges()
+        file_downloader.range_progress(0, 26214400)
+        file_downloader.range_finished()
+        with open(self.path, 'r+b') as outfile:
+            outfile.write(b'data')
+
+        file_downloader = FileDownloader(FakeConfig(2), self.remote_file, self.path, FakeWatcher())
+        self.assertEqual([(26214400, 52428799)], file_downloader.prepare_ranges())
+        self.assertEqual(26214400, file_downloader.bytes_already_downloaded())
+        with open(self.path, 'rb') as infile:
+            self.assertEqual(b'data', infile.read(4), 'resuming should not truncate the file')
+
+    @patch('ddsc.core.filedownloader.HashData')
+    def test_finish_resumed_download_verifies_hash(self, mock_hash_data):
+        mock_hash_data.create_from_path.return_value.matches.return_value = True
+        file_downloader = FileDownloader(FakeConfig(1), self.remote_file, self.path, FakeWatcher())
+        file_downloader.prepare_ranges()
+        file_downloader.finish()
+        mock_hash_data.create_from_path.assert_not_called()
+        self.assertFalse(PartialDownloadState.exists(self.path))
+
+        PartialDownloadState(self.path, self.remote_file, [[0, self.file_size - 1, 0]]).save()
+        file_downloader.prepare_ranges()
+        file_downloader.range_progress(0, self.file_size)
+        file_downloader.range_finished()
+        mock_hash_data.create_from_path.assert_called_with(self.path)
+        mock_hash_data.create_from_path.return_value.matches.assert_called_with('md5', 'abc')
+        self.assertFalse(PartialDownloadState.exists(self.path))
+        self.assertTrue(os.path.exists(self.path))
+
+    @patch('ddsc.core.filedownloader.HashData')
+    def test_finish_resumed_download_bad_hash(self, mock_hash_data):
+        mock_hash_data.create_from_path.return_value.matches.return_value = False
+        file_downloader = FileDownloader(FakeConfig(1), self.remote_file, self.path, FakeWatcher())
+        file_downloader.make_big_empty_file()
+        PartialDownloadState(self.path, self.remote_file, [[0, self.file_size - 1, 0]]).save()
+        file_downloader.prepare_ranges()
+        with self.assertRaises(ValueError):
+            file_downloader.finish()
+        self.assertFalse(os.path.exists(self.path))
+        self.assertFalse(PartialDownloadState.exists(self.path))
+
+    def test_planner_only_downloads_missing_ranges(self):
+        file_downloader = FileDownloader(FakeConfig(2), self.remote_file, self.path, FakeWatcher())
+        file_downloader.make_big_empty_file()
+        PartialDownloadState(self.path, self.remote_file, [[26214400, 52428799, 100]]).save()
+        download_pool = MagicMock(num_workers=2)
+        download_pool.progress_queue.get.return_value = (ProgressQueue.PROCESSED, (0, 26214300))
+        watcher = FakeWatcher()
+        planner = FileDownloadPlanner(FakeConfig(2), download_pool, watcher)
+        planner.add_file(FileDownloader(FakeConfig(2), self.remote_file, self.path, watcher))
+        with patch('ddsc.core.filedownloader.HashData') as mock_hash_data:
+            mock_hash_data.create_from_path.return_value.matches.return_value = True
+            planner.run()
+        download_pool.add_range.assert_called_once_with(0, '123', self.path, 26214500, 52428799)
+        self.assertEqual(self.file_size, watcher.amt)
+        self.assertFalse(PartialDownloadState.exists(self.path))
+
+
+class TestCreateDownloadPool(TestCase):
+    def test_transfer_engines(self):
+        download_pool = create_download_pool(Mock(transfer_engine='process', download_workers=3))
+        self.assertEqual(DownloadWorkerPool, type(download_pool))
+        self.assertEqual(3, download_pool.num_workers)
+        with self.assertRaises(ValueError):
+            create_download_pool(Mock(transfer_engine='other'))
+
+    def test_thread_transfer_engine(self):
+        download_pool = create_download_pool(Mock(transfer_engine='thread', transfer_concurrency=100))
+        self.assertEqual(ThreadDownloadPool, type(download_pool))
+        self.assertEqual(100, download_pool.num_workers)
+
+
+class TestThreadDownloadPool(TestCase):
+    @patch('ddsc.core.filedownloader.download_range')
+    @patch('ddsc.core.filedownloader.RemoteStore')
+    def test_downloads_ranges_on_threads(self, mock_remote_store, mock_download_range):
+        def download_range(remote_store, requests_session, remote_file_id, range_headers, path, seek_amt,
+                           bytes_to_read, progress_queue):
+            progress_queue.processed(bytes_to_read)
+        mock_download_range.side_effect = download_range
+        download_pool = ThreadDownloadPool(Mock(transfer_concurrency=2))
+        download_pool.add_range(0, 'file1', '/tmp/data.txt', 0, 9)
+        download_pool.add_range(1, 'file1', '/tmp/data.txt', 10, 14)
+        progress = sorted(download_pool.progress_queue.get() for _ in range(2))
+        download_pool.shutdown()
+        self.assertEqual([(ProgressQueue.PROCESSED, (0, 10)), (ProgressQueue.PROCESSED, (1, 5))], progress)
+        self.assertEqual(2, mock_remote_store.call_count)
+        mock_download_range.assert_any_call(mock_remote_store.return_value, ANY, 'file1', {'Range': 'bytes=10-14'},
+                                            '/tmp/data.txt', 10, 5, ANY)
+        self.assertEqual([], download_pool.processes)
+
+    def test_terminate_drops_queued_ranges_and_stops_threads(self):
+        download_pool = ThreadDownloadPool(Mock(transfer_concurrency=2))
+        download_pool.processes = [Mock(), Mock()]
+        download_pool.work_queue.put('range1')
+        download_pool.terminate()
+        self.assertEqual([None, None], [download_pool.work_queue.get_nowait() for _ in range(2)])
+        self.assertTrue(download_pool.work_queue.empty())
+        self.assertEqual([], download_pool.processes)
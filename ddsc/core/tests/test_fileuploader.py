@@ -1,7 +1,18 @@
 from unittest import TestCase
+import hashlib
+import os
+import queue
+import tempfile
+import threading
+from multiprocessing import RawArray
 from ddsc.core.fileuploader import ParallelChunkProcessor, upload_async, FileUploadOperations, \
-    RESOURCE_NOT_CONSISTENT_RETRY_SECONDS
+    RESOURCE_NOT_CONSISTENT_RETRY_SECONDS, SEND_EXTERNAL_RETRY_SECONDS, ChunkReader, ChunkSender, LargeFileUpload, \
+    FileChunk, FileRegionReader, create_chunk_processor, ThreadChunkProcessor, ChunkSenderThread, ChunkBuffers, \
+    BufferedChunk
+from ddsc.core.util import ProgressQueue
 from ddsc.core.ddsapi import DSResourceNotConsistentError, DataServiceError
+from ddsc.core.localstore import HashData
+from ddsc.core.hashcache import get_mtime_ns
 import requests
 from mock import MagicMock, Mock, patch, call
 
@@ -35,32 +46,626 @@ class TestParallelChunkProcessor(TestCase):
             num_chunks = ParallelChunkProcessor.determine_num_chunks(chunk_size, file_size)
             self.assertEqual(expected, num_chunks)
 
-    def test_make_work_parcels(self):
+    def test_determine_num_workers(self):
         values = [
             # upload_workers, num_chunks, expected
-            (4, 4, [(0, 1), (1, 1), (2, 1), (3, 1)]),
-            (4, 19, [(0, 5), (5, 5), (10, 5), (15, 4)]),
-            (5, 31, [(0, 7), (7, 7), (14, 7), (21, 7), (28, 3)]),
-            (5, 4, [(0, 1), (1, 1), (2, 1), (3, 1)]),
-            (1, 4, [(0, 4)]),
+            (4, 4, 4),
+            (4, 19, 4),
+            (5, 4, 4),
+            (1, 4, 1),
+            (8, 1, 1),
+            (None, 4, 1),
+            ('None', 4, 1),
         ]
         for upload_workers, num_chunks, expected in values:
-            result = ParallelChunkProcessor.make_work_parcels(upload_workers, num_chunks)
+            result = ParallelChunkProcessor.determine_num_workers(upload_workers, num_chunks)
             self.assertEqual(expected, result)
 
+    def test_determine_num_chunk_slots(self):
+        values = [
+            # bytes_in_flight, chunk_size, num_workers, expected
+            (None, 100, 4, 8),
+            (0, 100, 1, 2),
+            (1000, 100, 4, 10),
+            (1050, 100, 4, 10),
+            (50, 100, 4, 1),
+        ]
+        for bytes_in_flight, chunk_size, num_workers, expected in values:
+            result = ParallelChunkProcessor.determine_num_chunk_slots(bytes_in_flight, chunk_size, num_workers)
+            self.assertEqual(expected, result)
+
+    def test_wait_for_chunks_finishes_each_file_when_its_chunks_are_sent(self):
+        watcher = MagicMock()
+        processor = ParallelChunkProcessor(MagicMock(), MagicMock(), watcher)
+        processor.finish_file = MagicMock()
+        file1 = LargeFileUpload(MagicMock(), MagicMock())
+        file1.chunks_left = 2
+        file2 = LargeFileUpload(MagicMock(), MagicMock())
+        file2.chunks_left = 1
+        processor.uploads = {'upload1': file1, 'upload2': file2}
+        progress_queue = MagicMock()
+        progress_queue.get.side_effect = [
+            (ProgressQueue.PROCESSED, ('upload1', 0)),
+            (ProgressQueue.START_WAITING, None),
+            (ProgressQueue.DONE_WAITING, None),
+            (ProgressQueue.PROCESSED, ('upload2', 0)),
+            (ProgressQueue.PROCESSED, ('upload1', 1)),
+        ]
+        processor.upload_journal = MagicMock()
+        processor.wait_for_chunks([], 3, progress_queue)
+        processor.finish_file.assert_has_calls([call(file2), call(file1)])
+        processor.upload_journal.chunk_sent.assert_has_calls([
+            call('upload1', 0),
+            call('upload2', 0),
+            call('upload1', 1),
+        ])
+        watcher.transferring_item.assert_has_calls([
+            call(file1.local_file, increment_amt=1),
+            call(file2.local_file, increment_amt=1),
+            call(file1.local_file, increment_amt=1),
+        ])
+        watcher.start_waiting.assert_called_with()
+        watcher.done_waiting.assert_called_with()
+
+    def test_wait_for_chunks_terminates_processes_on_error(self):
+        processor = ParallelChunkProcessor(MagicMock(), MagicMock(), MagicMock())
+        process = MagicMock()
+        progress_queue = MagicMock()
+        progress_queue.get.return_value = (ProgressQueue.ERROR, 'Oops')
+        with self.assertRaises(ValueError):
+            processor.wait_for_chunks([process], 3, progress_queue)
+        process.terminate.assert_called_with()
+
+    @patch('ddsc.core.fileuploader.make_data_service')
+    @patch('ddsc.core.fileuploader.ChunkReader')
+    def test_run_stops_workers_and_reader_when_finishing_a_file_fails(self, mock_chunk_reader, mock_make_data_service):
+        data_service = MagicMock()
+        data_service.complete_upload.side_effect = ValueError('complete failed')
+        config = MagicMock(upload_workers=2, upload_bytes_per_chunk=100, upload_bytes_in_flight=None,
+                           upload_stream_chunks_over=None)
+        processor = ParallelChunkProcessor(config, data_service, MagicMock())
+        processor.upload_journal = None
+        process = MagicMock()
+        process.is_alive.return_value = True
+        processor.make_and_start_process = MagicMock(return_value=process)
+        large_file = LargeFileUpload(MagicMock(size=10, remote_id=None), MagicMock())
+
+        def read_chunks():
+            large_file.upload_id = 'upload1'
+            large_file.chunks_left = 1
+            large_file.hash_data = MagicMock()
+            processor.uploads['upload1'] = large_file
+            progress_queue = mock_chunk_reader.call_args[0][-2]
+            progress_queue.processed(('upload1', 0))
+        mock_chunk_reader.return_value.run.side_effect = read_chunks
+
+        with self.assertRaises(ValueError) as raised_error:
+            processor.run('project1', [large_file])
+
+        self.assertEqual('complete failed', str(raised_error.exception))
+        process.terminate.assert_called_with()
+        process.join.assert_called_with()
+        mock_chunk_reader.return_value.stop.assert_called_once_with()
+
+    def test_make_chunk_buffers(self):
+        values = [
+            # upload_bytes_per_chunk, upload_stream_chunks_over, file sizes, expected buffer size, expected buffers
+            (100, None, [250, 30], 100, 3),
+            (100, None, [30, 20], 30, 3),
+            (100, 50, [250], 50, 3),
+            (100, 200, [250], 100, 3),
+            (100, 0, [250], 0, 0),
+            (100, None, [0, 0], 0, 0),
+        ]
+        for chunk_size, stream_chunks_over, file_sizes, expected_buffer_size, expected_buffers in values:
+            config = MagicMock(upload_bytes_per_chunk=chunk_size, upload_stream_chunks_over=stream_chunks_over)
+            processor = ParallelChunkProcessor(config, MagicMock(), MagicMock())
+            large_files = [LargeFileUpload(MagicMock(size=size), MagicMock()) for size in file_sizes]
+            chunk_buffers = processor.make_chunk_buffers(large_files, 3)
+            self.assertEqual(expected_buffers, len(chunk_buffers.buffers))
+            self.assertEqual(expected_buffer_size, chunk_buffers.buffer_size)
+            self.assertTrue(all(len(buf) == expected_buffer_size for buf in chunk_buffers.buffers))
+
+    def test_make_buffer_is_shared_with_worker_processes(self):
+        self.assertEqual(RawArray('B', 1)._type_, ParallelChunkProcessor.make_buffer(10)._type_)
+        self.assertEqual(10, len(ParallelChunkProcessor.make_buffer(10)))
+        self.assertEqual(bytearray(10), ThreadChunkProcessor.make_buffer(10))
+
+    @patch('ddsc.core.fileuploader.FileUploadOperations')
+    def test_finish_file(self, mock_upload_operations):
+        mock_upload_operations().finish_upload.return_value = {'id': '456'}
+        post_processor = MagicMock()
+        data_service = MagicMock()
+        processor = ParallelChunkProcessor(MagicMock(), data_service, MagicMock(), post_processor)
+        processor.upload_journal = MagicMock()
+        local_file = MagicMock(remote_id=None)
+        large_file = LargeFileUpload(local_file, MagicMock())
+        large_file.upload_id = '123'
+        processor.finish_file(large_file)
+        local_file.get_path_data().set_hash.assert_called_with(large_file.hash_data, large_file.stat_info)
+        mock_upload_operations().finish_upload.assert_called_with('123', large_file.hash_data, large_file.parent_data,
+                                                                  None)
+        post_processor.run.assert_called_with(data_service, {'id': '456'})
+        local_file.set_remote_id_after_send.assert_called_with('456')
+        self.assertEqual({'id': '456'}, large_file.remote_file_data)
+        processor.upload_journal.remove_upload.assert_called_with('123')
+
+
+class TestChunkReader(TestCase):
+    def setUp(self):
+        self.temp_file = tempfile.NamedTemporaryFile()
+        self.contents = b'abcdefghij' * 10
+        self.temp_file.write(self.contents)
+        self.temp_file.flush()
+
+    def tearDown(self):
+        self.temp_file.close()
+
+    @staticmethod
+    def make_chunk(path, offset, size):
+        stat_info = os.stat(path)
+        return FileChunk(path, offset, size, stat_info.st_size, get_mtime_ns(stat_info))
+
+    def make_large_file(self, path, num_chunks):
+        local_file = MagicMock(path=path)
+        local_file.get_path_data.return_value.path = path
+        large_file = LargeFileUpload(local_file, MagicMock())
+        large_file.num_chunks = num_chunks
+        return large_file
+
+    @staticmethod
+    def get_work(work_queue, count):
+        # urls are created on a thread pool so chunks may be queued out of order
+        items = sorted([work_queue.get() for _ in range(count)], key=lambda item: (item[0], item[1]))
+        return [(upload_id, chunk_num, chunk, hash_data.value, url_info, failures)
+                for upload_id, chunk_num, chunk, hash_data, url_info, failures in items]
+
+    def test_run_reads_chunks_and_hashes_file(self):
+        work_queue = queue.Queue()
+        progress_queue = MagicMock()
+        chunk_slots = MagicMock()
+        upload_operations = MagicMock()
+        upload_operations.create_upload.return_value = 'upload1'
+        upload_operations.create_chunk_url.side_effect = lambda upload_id, chunk_num, size, hash_data: {'n': chunk_num}
+        large_file = self.make_large_file(self.temp_file.name, 4)
+        uploads = {}
+        reader = ChunkReader(upload_operations, None, 'project1', [large_file], uploads, 30, work_queue, chunk_slots,
+                             progress_queue)
+        reader.run()
+        upload_operations.create_upload.assert_called_with('project1', large_file.local_file.get_path_data())
+        self.assertEqual({'upload1': large_file}, uploads)
+        self.assertEqual(4, large_file.chunks_left)
+        path = self.temp_file.name
+        self.assertEqual([
+            ('upload1', 0, self.make_chunk(path, 0, 30), hashlib.md5(self.contents[0:30]).hexdigest(), {'n': 0}, 0),
+            ('upload1', 1, self.make_chunk(path, 30, 30), hashlib.md5(self.contents[30:60]).hexdigest(), {'n': 1}, 0),
+            ('upload1', 2, self.make_chunk(path, 60, 30), hashlib.md5(self.contents[60:90]).hexdigest(), {'n': 2}, 0),
+            ('upload1', 3, self.make_chunk(path, 90, 10), hashlib.md5(self.contents[90:]).hexdigest(), {'n': 3}, 0),
+        ], self.get_work(work_queue, 4))
+        create_url_args = sorted(args[:3] for args, kwargs in upload_operations.create_chunk_url.call_args_list)
+        self.assertEqual([('upload1', 0, 30), ('upload1', 1, 30), ('upload1', 2, 30), ('upload1', 3, 10)],
+                         create_url_args)
+        self.assertTrue(work_queue.empty())
+        self.assertEqual(4, chunk_slots.acquire.call_count)
+        self.assertEqual('md5', large_file.hash_data.alg)
+        self.assertEqual(hashlib.md5(self.contents).hexdigest(), large_file.hash_data.value)
+        self.assertEqual(len(self.contents), large_file.stat_info.st_size)
+        progress_queue.error.assert_not_called()
+
+    @patch('ddsc.core.fileuploader.HASH_FILE_BLOCK_SIZE', 7)
+    def test_run_reads_chunks_in_blocks(self):
+        work_queue = queue.Queue()
+        large_file = self.make_large_file(self.temp_file.name, 4)
+        reader = ChunkReader(MagicMock(), None, 'project1', [large_file], {}, 30, work_queue, MagicMock(),
+                             MagicMock())
+        reader.run()
+        self.assertEqual(7, len(reader.buffer))
+        items = self.get_work(work_queue, 4)
+        self.assertEqual([0, 30, 60, 90], [item[2].offset for item in items])
+        self.assertEqual(hashlib.md5(self.contents[30:60]).hexdigest(), items[1][3])
+        self.assertEqual(hashlib.md5(self.contents).hexdigest(), large_file.hash_data.value)
+
+    def test_run_reads_chunks_into_buffers(self):
+        work_queue = queue.Queue()
+        progress_queue = MagicMock()
+        upload_operations = MagicMock()
+        upload_operations.create_upload.return_value = 'upload1'
+        upload_operations.create_chunk_url.side_effect = lambda upload_id, chunk_num, size, hash_data: {'n': chunk_num}
+        chunk_buffers = ChunkBuffers([bytearray(30) for _ in range(4)], queue.Queue())
+        large_file = self.make_large_file(self.temp_file.name, 4)
+        reader = ChunkReader(upload_operations, None, 'project1', [large_file], {}, 30, work_queue, MagicMock(),
+                             progress_queue, chunk_buffers)
+        reader.run()
+        items = self.get_work(work_queue, 4)
+        self.assertEqual([
+            ('upload1', 0, BufferedChunk(0, 30), hashlib.md5(self.contents[0:30]).hexdigest(), {'n': 0}, 0),
+            ('upload1', 1, BufferedChunk(1, 30), hashlib.md5(self.contents[30:60]).hexdigest(), {'n': 1}, 0),
+            ('upload1', 2, BufferedChunk(2, 30), hashlib.md5(self.contents[60:90]).hexdigest(), {'n': 2}, 0),
+            ('upload1', 3, BufferedChunk(3, 10), hashlib.md5(self.contents[90:]).hexdigest(), {'n': 3}, 0),
+        ], items)
+        self.assertEqual([self.contents[0:30], self.contents[30:60], self.contents[60:90], self.contents[90:]],
+                         [chunk_buffers.get_view(chunk.buffer_num, chunk.size).tobytes() for _, _, chunk, _, _, _ in items])
+        self.assertTrue(chunk_buffers.free_queue.empty())
+        self.assertIsNone(reader.buffer)
+        self.assertEqual(hashlib.md5(self.contents).hexdigest(), large_file.hash_data.value)
+        progress_queue.error.assert_not_called()
+
+    def test_run_streams_chunks_too_large_for_buffers(self):
+        work_queue = queue.Queue()
+        chunk_buffers = ChunkBuffers([bytearray(10)], queue.Queue())
+        large_file = self.make_large_file(self.temp_file.name, 4)
+        reader = ChunkReader(MagicMock(), None, 'project1', [large_file], {}, 30, work_queue, MagicMock(),
+                             MagicMock(), chunk_buffers)
+        reader.run()
+        items = self.get_work(work_queue, 4)
+        path = self.temp_file.name
+        self.assertEqual([self.make_chunk(path, 0, 30), self.make_chunk(path, 30, 30), self.make_chunk(path, 60, 30),
+                          BufferedChunk(0, 10)], [item[2] for item in items])
+        self.assertEqual(hashlib.md5(self.contents[90:]).hexdigest(), items[3][3])
+        self.assertEqual(hashlib.md5(self.contents).hexdigest(), large_file.hash_data.value)
+
+    @patch('ddsc.core.fileuploader.FileUploadOperations')
+    def test_url_hash_is_from_the_data_sent(self, mock_upload_operations):
+        work_queue = queue.Queue()
+        reader_operations = MagicMock()
+        reader_operations.create_upload.return_value = 'upload1'
+        reader_operations.create_chunk_url.side_effect = \
+            lambda upload_id, chunk_num, size, hash_data: {'hash': hash_data.value}
+        chunk_buffers = ChunkBuffers([bytearray(30) for _ in range(4)], queue.Queue())
+        large_file = self.make_large_file(self.temp_file.name, 4)
+        reader = ChunkReader(reader_operations, None, 'project1', [large_file], {}, 30, work_queue, MagicMock(),
+                             MagicMock(), chunk_buffers)
+        reader.run()
+        # changing the file after it was read doesn't change what is sent
+        with open(self.temp_file.name, 'wb') as outfile:
+            outfile.write(b'changed')
+        sent_chunks = []
+        mock_upload_operations().send_file_external.side_effect = \
+            lambda url_info, chunk, allow_retry: sent_chunks.append((url_info['hash'], chunk.tobytes()))
+        work_queue.put(None)
+        progress_queue = MagicMock()
+        ChunkSender(MagicMock(), work_queue, MagicMock(), progress_queue, chunk_buffers).send()
+        self.assertEqual(4, len(sent_chunks))
+        for url_hash, data in sent_chunks:
+            self.assertEqual(hashlib.md5(data).hexdigest(), url_hash)
+        self.assertEqual(sorted([self.contents[0:30], self.contents[30:60], self.contents[60:90], self.contents[90:]]),
+                         sorted(data for _, data in sent_chunks))
+        self.assertEqual(4, progress_queue.processed.call_count)
+
+    def test_run_queues_chunk_without_url_when_url_creation_fails(self):
+        work_queue = queue.Queue()
+        progress_queue = MagicMock()
+        upload_operations = MagicMock()
+        upload_operations.create_upload.return_value = 'upload1'
+        upload_operations.create_chunk_url.side_effect = DataServiceError(MagicMock(), '', {})
+        large_file = self.make_large_file(self.temp_file.name, 1)
+        reader = ChunkReader(upload_operations, None, 'project1', [large_file], {}, 100, work_queue, MagicMock(),
+                             progress_queue)
+        reader.run()
+        self.assertEqual([('upload1', 0, self.make_chunk(self.temp_file.name, 0, 100), hashlib.md5(self.contents).hexdigest(),
+                           None, 0)], self.get_work(work_queue, 1))
+        progress_queue.error.assert_not_called()
+
+    def test_run_reads_files_in_order(self):
+        empty_file = tempfile.NamedTemporaryFile()
+        work_queue = queue.Queue()
+        upload_operations = MagicMock()
+        upload_operations.create_upload.side_effect = ['upload1', 'upload2']
+        upload_operations.create_chunk_url.return_value = {}
+        large_file1 = self.make_large_file(empty_file.name, 1)
+        large_file2 = self.make_large_file(self.temp_file.name, 1)
+        reader = ChunkReader(upload_operations, None, 'project1', [large_file1, large_file2], {}, 100, work_queue,
+                             MagicMock(), MagicMock())
+        reader.run()
+        self.assertEqual([
+            ('upload1', 0, self.make_chunk(empty_file.name, 0, 0), hashlib.md5(b'').hexdigest(), {}, 0),
+            ('upload2', 0, self.make_chunk(self.temp_file.name, 0, 100), hashlib.md5(self.contents).hexdigest(), {}, 0),
+        ], self.get_work(work_queue, 2))
+        self.assertEqual([call('project1', large_file1.local_file.get_path_data()),
+                          call('project1', large_file2.local_file.get_path_data())],
+                         upload_operations.create_upload.call_args_list)
+        self.assertEqual(hashlib.md5(b'').hexdigest(), large_file1.hash_data.value)
+        self.assertEqual(hashlib.md5(self.contents).hexdigest(), large_file2.hash_data.value)
+        empty_file.close()
+
+    def test_run_records_new_upload_in_journal(self):
+        upload_operations = MagicMock()
+        upload_operations.create_upload.return_value = 'upload1'
+        upload_journal = MagicMock()
+        upload_journal.find_upload.return_value = None
+        large_file = self.make_large_file(self.temp_file.name, 4)
+        reader = ChunkReader(upload_operations, upload_journal, 'project1', [large_file], {}, 30, queue.Queue(),
+                             MagicMock(), MagicMock())
+        reader.run()
+        args, kwargs = upload_journal.start_upload.call_args
+        project_id, path, stat_info, chunk_size, upload_id = args
+        self.assertEqual(('project1', self.temp_file.name, 30, 'upload1'), (project_id, path, chunk_size, upload_id))
+        self.assertEqual(len(self.contents), stat_info.st_size)
+
+    def test_run_resumes_upload_from_journal(self):
+        work_queue = queue.Queue()
+        progress_queue = MagicMock()
+        chunk_slots = MagicMock()
+        upload_operations = MagicMock()
+        upload_operations.can_resume_upload.return_value = True
+        upload_operations.create_chunk_url.return_value = {}
+        upload_journal = MagicMock()
+        upload_journal.find_upload.return_value = ('upload1', set([0, 2]))
+        large_file = self.make_large_file(self.temp_file.name, 4)
+        reader = ChunkReader(upload_operations, upload_journal, 'project1', [large_file], {}, 30, work_queue,
+                             chunk_slots, progress_queue)
+        reader.run()
+        upload_operations.create_upload.assert_not_called()
+        upload_operations.can_resume_upload.assert_called_with('upload1')
+        self.assertEqual('upload1', large_file.upload_id)
+        self.assertEqual(4, large_file.chunks_left)
+        self.assertEqual([
+            ('upload1', 1, self.make_chunk(self.temp_file.name, 30, 30), hashlib.md5(self.contents[30:60]).hexdigest(),
+             {}, 0),
+            ('upload1', 3, self.make_chunk(self.temp_file.name, 90, 10), hashlib.md5(self.contents[90:]).hexdigest(),
+             {}, 0),
+        ], self.get_work(work_queue, 2))
+        self.assertTrue(work_queue.empty())
+        self.assertEqual(2, chunk_slots.acquire.call_count)
+        progress_queue.processed.assert_has_calls([call(('upload1', 0)), call(('upload1', 2))])
+        self.assertEqual(hashlib.md5(self.contents).hexdigest(), large_file.hash_data.value)
+
+    def test_run_starts_new_upload_when_journal_upload_is_gone(self):
+        upload_operations = MagicMock()
+        upload_operations.can_resume_upload.return_value = False
+        upload_operations.create_upload.return_value = 'upload2'
+        upload_journal = MagicMock()
+        upload_journal.find_upload.return_value = ('upload1', set([0, 2]))
+        large_file = self.make_large_file(self.temp_file.name, 4)
+        work_queue = queue.Queue()
+        reader = ChunkReader(upload_operations, upload_journal, 'project1', [large_file], {}, 30, work_queue,
+                             MagicMock(), MagicMock())
+        reader.run()
+        upload_journal.remove_upload.assert_called_with('upload1')
+        self.assertEqual('upload2', large_file.upload_id)
+        self.assertEqual(4, work_queue.qsize())
+
+    def test_stop_wakes_reader_waiting_for_a_chunk_slot(self):
+        work_queue = queue.Queue()
+        upload_operations = MagicMock()
+        upload_operations.create_upload.return_value = 'upload1'
+        large_files = [self.make_large_file(self.temp_file.name, 4), self.make_large_file(self.temp_file.name, 4)]
+        reader = ChunkReader(upload_operations, None, 'project1', large_files, {}, 30, work_queue,
+                             threading.Semaphore(1), MagicMock())
+        reader_thread = threading.Thread(target=reader.run)
+        reader_thread.start()
+        while work_queue.empty():
+            reader_thread.join(0.01)
+        reader.stop()
+        reader_thread.join(5)
+        self.assertFalse(reader_thread.is_alive())
+        self.assertEqual(1, work_queue.qsize())
+        upload_operations.create_upload.assert_called_once_with('project1', large_files[0].local_file.get_path_data())
+
+    def test_run_sends_errors_to_progress_queue(self):
+        progress_queue = MagicMock()
+        large_file = self.make_large_file('/tmp/nonexistent/somefile.txt', 1)
+        reader = ChunkReader(MagicMock(), None, 'project1', [large_file], {}, 30, queue.Queue(), MagicMock(),
+                             progress_queue)
+        reader.run()
+        progress_queue.error.assert_called()
+        self.assertEqual(None, large_file.hash_data)
+
+
+class TestChunkBuffers(TestCase):
+    def test_buffers_start_free(self):
+        chunk_buffers = ChunkBuffers([bytearray(10), bytearray(10)], queue.Queue())
+        self.assertEqual(10, chunk_buffers.buffer_size)
+        self.assertEqual([0, 1], [chunk_buffers.take(), chunk_buffers.take()])
+        chunk_buffers.give_back(1)
+        self.assertEqual(1, chunk_buffers.take())
+
+    def test_fits(self):
+        chunk_buffers = ChunkBuffers([bytearray(10)], queue.Queue())
+        self.assertTrue(chunk_buffers.fits(10))
+        self.assertTrue(chunk_buffers.fits(1))
+        self.assertFalse(chunk_buffers.fits(11))
+        self.assertFalse(chunk_buffers.fits(0))
+        self.assertFalse(ChunkBuffers([], queue.Queue()).fits(1))
+
+    def test_get_view(self):
+        chunk_buffers = ChunkBuffers([bytearray(10), RawArray('B', 10)], queue.Queue())
+        for buffer_num in range(2):
+            view = chunk_buffers.get_view(buffer_num, 4)
+            self.assertEqual(4, len(view))
+            self.assertEqual(b'\x00' * 4, view.tobytes())
+
+
+class TestChunkSender(TestCase):
+    @patch('ddsc.core.fileuploader.FileUploadOperations')
+    def test_send_until_none_received(self, mock_upload_operations):
+        with tempfile.NamedTemporaryFile() as data_file:
+            data_file.write(b'data1data22')
+            data_file.flush()
+            work_queue = queue.Queue()
+            work_queue.put(('123', 0, FileChunk(data_file.name, 0, 5), HashData('md5', hashlib.md5(b'data1').hexdigest()),
+                            {'url': '/chunk0'}, 0))
+            work_queue.put(('456', 1, FileChunk(data_file.name, 5, 6), HashData('md5', hashlib.md5(b'data22').hexdigest()),
+                            None, 0))
+            work_queue.put(None)
+            progress_queue = MagicMock()
+            chunk_slots = MagicMock()
+            sent_chunks = []
+            mock_upload_operations().create_chunk_url.return_value = {'url': '/chunk1'}
+            mock_upload_operations().send_file_external.side_effect = \
+                lambda url_info, chunk, allow_retry: sent_chunks.append((url_info, chunk.read()))
+            sender = ChunkSender(MagicMock(), work_queue, chunk_slots, progress_queue)
+            sender.send()
+        self.assertEqual([({'url': '/chunk0'}, b'data1'), ({'url': '/chunk1'}, b'data22')], sent_chunks)
+        create_url_calls = mock_upload_operations().create_chunk_url.call_args_list
+        self.assertEqual(1, len(create_url_calls))
+        upload_id, chunk_num, chunk_size, hash_data = create_url_calls[0][0]
+        self.assertEqual(('456', 1, 6), (upload_id, chunk_num, chunk_size))
+        self.assertEqual(hashlib.md5(b'data22').hexdigest(), hash_data.value)
+        progress_queue.processed.assert_has_calls([call(('123', 0)), call(('456', 1))])
+        self.assertEqual(2, chunk_slots.release.call_count)
+
+    @patch('ddsc.core.fileuploader.FileRegionReader')
+    @patch('ddsc.core.fileuploader.FileUploadOperations')
+    def test_send_chunks_from_buffers(self, mock_upload_operations, mock_file_region_reader):
+        chunk_buffers = ChunkBuffers([bytearray(b'data1xxxxx'), bytearray(b'data22xxxx')], queue.Queue())
+        chunk_buffers.take()
+        chunk_buffers.take()
+        work_queue = queue.Queue()
+        work_queue.put(('123', 0, BufferedChunk(0, 5), HashData('md5', hashlib.md5(b'data1').hexdigest()),
+                        {'url': '/chunk0'}, 0))
+        work_queue.put(('456', 1, BufferedChunk(1, 6), HashData('md5', hashlib.md5(b'data22').hexdigest()), None, 0))
+        work_queue.put(None)
+        manager = Mock()
+        chunk_slots = manager.chunk_slots
+        manager.attach_mock(Mock(side_effect=chunk_buffers.give_back), 'give_back')
+        chunk_buffers.give_back = manager.give_back
+        sent_chunks = []
+        mock_upload_operations().create_chunk_url.return_value = {'url': '/chunk1'}
+        mock_upload_operations().send_file_external.side_effect = \
+            lambda url_info, chunk, allow_retry: sent_chunks.append((url_info, chunk.tobytes()))
+        sender = ChunkSender(MagicMock(), work_queue, chunk_slots, MagicMock(), chunk_buffers)
+        sender.send()
+        self.assertEqual([({'url': '/chunk0'}, b'data1'), ({'url': '/chunk1'}, b'data22')], sent_chunks)
+        self.assertEqual(('456', 1, 6), mock_upload_operations().create_chunk_url.call_args[0][:3])
+        mock_file_region_reader.assert_not_called()
+        # each buffer is given back before its chunk slot is released so the reader never waits for a buffer
+        self.assertEqual([call.give_back(0), call.chunk_slots.release(), call.give_back(1), call.chunk_slots.release()],
+                         manager.mock_calls)
+        self.assertEqual([0, 1], [chunk_buffers.take(), chunk_buffers.take()])
+
+    @patch('ddsc.core.fileuploader.FileUploadOperations')
+    def test_send_raises_when_file_changes(self, mock_upload_operations):
+        with tempfile.NamedTemporaryFile() as data_file:
+            data_file.write(b'data1')
+            data_file.flush()
+
+            def change_file(url_info, chunk, allow_retry):
+                with open(data_file.name, 'wb') as outfile:
+                    outfile.write(b'DATA1')
+                chunk.read()
+
+            mock_upload_operations().send_file_external.side_effect = change_file
+            work_queue = queue.Queue()
+            work_queue.put(('123', 0, FileChunk(data_file.name, 0, 5), HashData('md5', hashlib.md5(b'data1').hexdigest()),
+                            {}, 0))
+            sender = ChunkSender(MagicMock(), work_queue, MagicMock(), MagicMock())
+            with self.assertRaises(ValueError):
+                sender.send()
+
+    @patch('ddsc.core.fileuploader.FileUploadOperations')
+    def test_send_raises_before_sending_when_file_changed_since_it_was_hashed(self, mock_upload_operations):
+        with tempfile.NamedTemporaryFile() as data_file:
+            data_file.write(b'data1')
+            data_file.flush()
+            stat_info = os.stat(data_file.name)
+            file_chunk = FileChunk(data_file.name, 0, 5, stat_info.st_size, get_mtime_ns(stat_info))
+            data_file.write(b'more data')
+            data_file.flush()
+            work_queue = queue.Queue()
+            work_queue.put(('123', 0, file_chunk, HashData('md5', hashlib.md5(b'data1').hexdigest()), {}, 0))
+            sender = ChunkSender(MagicMock(), work_queue, MagicMock(), MagicMock())
+            with self.assertRaises(ValueError) as raised_error:
+                sender.send()
+            self.assertIn('changed while it was being uploaded', str(raised_error.exception))
+            mock_upload_operations().send_file_external.assert_not_called()
+
+    @patch('ddsc.core.fileuploader.FileRegionReader')
+    @patch('ddsc.core.fileuploader.time')
+    @patch('ddsc.core.fileuploader.FileUploadOperations')
+    def test_send_puts_failed_chunk_back_on_queue(self, mock_upload_operations, mock_time, mock_file_region_reader):
+        mock_upload_operations().send_file_external.side_effect = [
+            requests.exceptions.ConnectionError, None, None
+        ]
+        work_queue = MagicMock()
+        work_queue.get.side_effect = [('123', 0, FileChunk('data', 0, 5), 'hash1', {}, 0), ('123', 1, FileChunk('data', 5, 5), 'hash2', {}, 0),
+                                      ('123', 0, FileChunk('data', 0, 5), 'hash1', None, 1), None]
+        progress_queue = MagicMock()
+        chunk_slots = MagicMock()
+        data_service = MagicMock()
+        sender = ChunkSender(data_service, work_queue, chunk_slots, progress_queue)
+        sender.send()
+        work_queue.put.assert_called_once_with(('123', 0, FileChunk('data', 0, 5), 'hash1', None, 1))
+        data_service.recreate_requests_session.assert_called_once_with()
+        mock_time.sleep.assert_not_called()
+        self.assertEqual(2, progress_queue.processed.call_count)
+        self.assertEqual(2, chunk_slots.release.call_count)
+
+    @patch('ddsc.core.fileuploader.FileRegionReader')
+    @patch('ddsc.core.fileuploader.time')
+    @patch('ddsc.core.fileuploader.FileUploadOperations')
+    def test_send_pauses_after_consecutive_failures(self, mock_upload_operations, mock_time, mock_file_region_reader):
+        mock_upload_operations().send_file_external.side_effect = [
+            requests.exceptions.ConnectionError, requests.exceptions.ConnectionError, None, None
+        ]
+        work_queue = MagicMock()
+        work_queue.get.side_effect = [('123', 0, FileChunk('data', 0, 5), 'hash1', {}, 0), ('123', 1, FileChunk('data', 5, 5), 'hash2', {}, 0),
+                                      ('123', 0, FileChunk('data', 0, 5), 'hash1', None, 1), ('123', 1, FileChunk('data', 5, 5), 'hash2', None, 1),
+                                      None]
+        sender = ChunkSender(MagicMock(), work_queue, MagicMock(), MagicMock())
+        sender.send()
+        mock_time.sleep.assert_called_once_with(SEND_EXTERNAL_RETRY_SECONDS)
+
+    @patch('ddsc.core.fileuploader.FileRegionReader')
+    @patch('ddsc.core.fileuploader.time')
+    @patch('ddsc.core.fileuploader.FileUploadOperations')
+    def test_send_raises_after_too_many_failures(self, mock_upload_operations, mock_time, mock_file_region_reader):
+        mock_upload_operations().send_file_external.side_effect = requests.exceptions.ConnectionError
+        work_queue = queue.Queue()
+        work_queue.put(('123', 0, FileChunk('data', 0, 5), 'hash1', {}, 4))
+        sender = ChunkSender(MagicMock(), work_queue, MagicMock(), MagicMock())
+        with self.assertRaises(requests.exceptions.ConnectionError):
+            sender.send()
+
+
+class TestFileRegionReader(TestCase):
+    def setUp(self):
+        self.data_file = tempfile.NamedTemporaryFile()
+        self.data_file.write(b'0123456789')
+        self.data_file.flush()
+
+    def tearDown(self):
+        self.data_file.close()
+
+    def test_read_stops_at_end_of_region(self):
+        with FileRegionReader(FileChunk(self.data_file.name, 2, 5)) as region:
+            self.assertEqual(5, len(region))
+            self.assertEqual(b'234', region.read(3))
+            self.assertEqual(b'56', region.read(100))
+            self.assertEqual(b'', region.read())
+            self.assertEqual(hashlib.md5(b'23456').hexdigest(), region.get_hash_data().value)
+            region.check_hash(HashData('md5', hashlib.md5(b'23456').hexdigest()))
+            with self.assertRaises(ValueError):
+                region.check_hash(HashData('md5', hashlib.md5(b'other').hexdigest()))
+
+    def test_raises_before_reading_when_file_changed_since_it_was_hashed(self):
+        stat_info = os.stat(self.data_file.name)
+        mtime_ns = get_mtime_ns(stat_info)
+        with FileRegionReader(FileChunk(self.data_file.name, 2, 5, 10, mtime_ns)) as region:
+            self.assertEqual(b'23456', region.read())
+        with self.assertRaises(ValueError) as raised_error:
+            FileRegionReader(FileChunk(self.data_file.name, 2, 5, 10, mtime_ns - 1000000000))
+        self.assertEqual("File {} changed while it was being uploaded.".format(self.data_file.name),
+                         str(raised_error.exception))
+        with self.assertRaises(ValueError):
+            FileRegionReader(FileChunk(self.data_file.name, 2, 5, 11, mtime_ns))
+
+    def test_read_raises_when_file_is_shorter_than_region(self):
+        with FileRegionReader(FileChunk(self.data_file.name, 8, 5)) as region:
+            self.assertEqual(b'89', region.read())
+            with self.assertRaises(ValueError):
+                region.read()
+
 
 class TestUploadAsync(TestCase):
     @patch('ddsc.core.fileuploader.ChunkSender')
     def test_upload_async_sends_exception_to_progress_queue(self, mock_chunk_sender):
         data_service_auth_data = MagicMock()
         config = MagicMock()
-        upload_id = 123
-        filename = 'somefile.txt'
-        index = 0
-        num_chunks_to_send = 10
+        work_queue = MagicMock()
         progress_queue = MagicMock()
         mock_chunk_sender().send.side_effect = ValueError("Something Failed!")
-        upload_async(data_service_auth_data, config, upload_id, filename, index, num_chunks_to_send, progress_queue)
+        upload_async(data_service_auth_data, config, work_queue, MagicMock(), progress_queue)
         progress_queue.error.assert_called()
         params = progress_queue.error.call_args
         positional_args = params[0]
@@ -68,6 +673,18 @@ class TestUploadAsync(TestCase):
 
 
 class TestFileUploadOperations(TestCase):
+    def test_can_resume_upload(self):
+        data_service = MagicMock()
+        fop = FileUploadOperations(data_service, MagicMock())
+        data_service.get_upload.return_value.json.return_value = {'status': {'initiated_on': '2017-01-01'}}
+        self.assertEqual(True, fop.can_resume_upload('123'))
+        data_service.get_upload.assert_called_with('123')
+        for status_key in ['completed_on', 'purged_on', 'error_on']:
+            data_service.get_upload.return_value.json.return_value = {'status': {status_key: '2017-01-01'}}
+            self.assertEqual(False, fop.can_resume_upload('123'))
+        data_service.get_upload.side_effect = DataServiceError(MagicMock(status_code=404), '', '')
+        self.assertEqual(False, fop.can_resume_upload('123'))
+
     def test_send_file_external_works_first_time(self):
         data_service = MagicMock()
         data_service.send_external.side_effect = [Mock(status_code=201)]
@@ -201,3 +818,66 @@ class TestFileUploadOperations(TestCase):
         fop = FileUploadOperations(data_service, MagicMock())
         with self.assertRaises(DataServiceError):
             fop.create_upload(project_id='12', path_data=path_data, hash_data=MagicMock())
+
+
+class TestCreateChunkProcessor(TestCase):
+    @patch('ddsc.core.fileuploader.get_upload_journal')
+    def test_transfer_engines(self, mock_get_upload_journal):
+        chunk_processor = create_chunk_processor(Mock(transfer_engine='process'), Mock(), Mock())
+        self.assertEqual(ParallelChunkProcessor, type(chunk_processor))
+        with self.assertRaises(ValueError):
+            create_chunk_processor(Mock(transfer_engine='other'), Mock(), Mock())
+
+    @patch('ddsc.core.fileuploader.get_upload_journal')
+    def test_thread_transfer_engine(self, mock_get_upload_journal):
+        chunk_processor = create_chunk_processor(Mock(transfer_engine='thread'), Mock(), Mock())
+        self.assertEqual(ThreadChunkProcessor, type(chunk_processor))
+
+
+class TestThreadChunkProcessor(TestCase):
+    @patch('ddsc.core.fileuploader.upload_async')
+    @patch('ddsc.core.fileuploader.make_data_service')
+    @patch('ddsc.core.fileuploader.ChunkReader')
+    def test_run_sends_chunks_from_threads(self, mock_chunk_reader, mock_make_data_service, mock_upload_async):
+        data_service = MagicMock()
+        data_service.create_file.return_value.json.return_value = {'id': 'file1'}
+        config = MagicMock(transfer_concurrency=3, upload_bytes_per_chunk=100, upload_bytes_in_flight=None,
+                           upload_stream_chunks_over=None)
+        processor = ThreadChunkProcessor(config, data_service, MagicMock())
+        processor.upload_journal = None
+        large_file = LargeFileUpload(MagicMock(size=250, remote_id=None), MagicMock())
+        sender_threads = []
+
+        def read_chunks():
+            large_file.upload_id = 'upload1'
+            large_file.chunks_left = 3
+            large_file.hash_data = MagicMock()
+            processor.uploads['upload1'] = large_file
+            work_queue = mock_chunk_reader.call_args[0][-4]
+            for chunk_num in range(3):
+                work_queue.put(('upload1', chunk_num))
+        mock_chunk_reader.return_value.run.side_effect = read_chunks
+
+        def upload_async(data_service_auth_data, config, work_queue, chunk_slots, progress_queue, chunk_buffers):
+            sender_threads.append(threading.current_thread())
+            while True:
+                work = work_queue.get()
+                if work is None:
+                    break
+                progress_queue.processed(work)
+        mock_upload_async.side_effect = upload_async
+
+        processor.run('project1', [large_file])
+
+        self.assertEqual(3, len(sender_threads))
+        self.assertTrue(all(isinstance(thread, ChunkSenderThread) for thread in sender_threads))
+        self.assertIsInstance(mock_upload_async.call_args[0][2], queue.Queue)
+        self.assertEqual(0, large_file.chunks_left)
+        large_file.local_file.set_remote_id_after_send.assert_called_with('file1')
+
+    def test_chunk_sender_thread_terminate_asks_thread_to_stop(self):
+        work_queue = queue.Queue()
+        thread = ChunkSenderThread(Mock(), Mock(), work_queue, Mock(), Mock())
+        thread.terminate()
+        self.assertIsNone(work_queue.get_nowait())
+        self.assertTrue(thread.daemon)
@@ -0,0 +1,171 @@
+from unittest import TestCase
+import os
+import shutil
+import sqlite3
+import tempfile
+import threading
+from ddsc.core.hashcache import HashCache, get_hash_cache, set_hash_cache, setup_hash_cache
+from ddsc.core.localstore import HashData
+from mock import Mock, patch
+
+
+class TestHashCache(TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.cache_filename = os.path.join(self.temp_dir, 'subdir', 'cache.sqlite')
+        self.data_filename = os.path.join(self.temp_dir, 'data.txt')
+        with open(self.data_filename, 'w') as outfile:
+            outfile.write('somedata')
+        self.hash_caches = []
+
+    def tearDown(self):
+        set_hash_cache(None)
+        for hash_cache in self.hash_caches:
+            hash_cache.close()
+        shutil.rmtree(self.temp_dir)
+
+    def make_hash_cache(self):
+        hash_cache = HashCache(self.cache_filename, 10)
+        self.hash_caches.append(hash_cache)
+        return hash_cache
+
+    def test_lookup_empty(self):
+        hash_cache = self.make_hash_cache()
+        self.assertEqual(None, hash_cache.lookup(self.data_filename, os.stat(self.data_filename)))
+        self.assertTrue(os.path.exists(self.cache_filename))
+
+    def test_save_then_lookup(self):
+        hash_cache = self.make_hash_cache()
+        stat_info = os.stat(self.data_filename)
+        hash_cache.save(self.data_filename, stat_info, 'md5', 'abc')
+        self.assertEqual(('md5', 'abc'), hash_cache.lookup(self.data_filename, stat_info))
+
+    def test_saved_hashes_persist_after_close(self):
+        hash_cache = self.make_hash_cache()
+        stat_info = os.stat(self.data_filename)
+        hash_cache.save(self.data_filename, stat_info, 'md5', 'abc')
+        hash_cache.close()
+        hash_cache = self.make_hash_cache()
+        self.assertEqual(('md5', 'abc'), hash_cache.lookup(self.data_filename, stat_info))
+
+    def test_lookup_changed_file(self):
+        hash_cache = self.make_hash_cache()
+        stat_info = os.stat(self.data_filename)
+        hash_cache.save(self.data_filename, stat_info, 'md5', 'abc')
+        changed_size = Mock(st_size=stat_info.st_size + 1, st_mtime_ns=stat_info.st_mtime_ns,
+                            st_ino=stat_info.st_ino, st_dev=stat_info.st_dev)
+        self.assertEqual(None, hash_cache.lookup(self.data_filename, changed_size))
+        # stale entry is removed
+        self.assertEqual(None, hash_cache.lookup(self.data_filename, stat_info))
+        self.assertEqual(0, hash_cache.num_items)
+
+    def test_evicts_least_recently_used(self):
+        hash_cache = self.make_hash_cache()
+        stat_info = os.stat(self.data_filename)
+        for i in range(10):
+            hash_cache.save('/tmp/file{}'.format(i), stat_info, 'md5', str(i))
+        hash_cache.lookup('/tmp/file0', stat_info)
+        hash_cache.save('/tmp/file10', stat_info, 'md5', '10')
+        self.assertEqual(9, hash_cache.num_items)
+        self.assertEqual(('md5', '0'), hash_cache.lookup('/tmp/file0', stat_info))
+        self.assertEqual(None, hash_cache.lookup('/tmp/file1', stat_info))
+        self.assertEqual(None, hash_cache.lookup('/tmp/file2', stat_info))
+        self.assertEqual(('md5', '10'), hash_cache.lookup('/tmp/file10', stat_info))
+
+    def test_lookup_hits_do_not_write_until_flushed(self):
+        hash_cache = self.make_hash_cache()
+        stat_info = os.stat(self.data_filename)
+        hash_cache.save('/tmp/file0', stat_info, 'md5', '0')
+        hash_cache.save('/tmp/file1', stat_info, 'md5', '1')
+        total_changes = hash_cache.conn.total_changes
+        with patch('ddsc.core.hashcache.time') as mock_time:
+            mock_time.time.return_value = 12345.0
+            self.assertEqual(('md5', '0'), hash_cache.lookup('/tmp/file0', stat_info))
+            self.assertEqual(('md5', '1'), hash_cache.lookup('/tmp/file1', stat_info))
+        self.assertEqual(total_changes, hash_cache.conn.total_changes)
+        hash_cache.close()
+        conn = sqlite3.connect(self.cache_filename)
+        try:
+            self.assertEqual([('/tmp/file0', 12345.0), ('/tmp/file1', 12345.0)],
+                             conn.execute("SELECT path, last_used FROM file_hashes ORDER BY path").fetchall())
+        finally:
+            conn.close()
+
+    @patch('ddsc.core.hashcache.TOUCH_FLUSH_COUNT', 2)
+    def test_lookup_hits_are_flushed_in_batches(self):
+        hash_cache = self.make_hash_cache()
+        stat_info = os.stat(self.data_filename)
+        hash_cache.save('/tmp/file0', stat_info, 'md5', '0')
+        hash_cache.save('/tmp/file1', stat_info, 'md5', '1')
+        hash_cache.lookup('/tmp/file0', stat_info)
+        self.assertEqual(1, len(hash_cache.touched_paths))
+        hash_cache.lookup('/tmp/file1', stat_info)
+        self.assertEqual({}, hash_cache.touched_paths)
+
+    def test_hash_data_create_from_path_uses_cache(self):
+        set_hash_cache(HashCache(self.cache_filename, 10))
+        hash_data = HashData.create_from_path(self.data_filename)
+        self.assertEqual('md5', hash_data.alg)
+        with patch('ddsc.core.localstore.HashUtil') as mock_hash_util:
+            cached_hash_data = HashData.create_from_path(self.data_filename)
+            mock_hash_util.assert_not_called()
+        self.assertEqual(hash_data.value, cached_hash_data.value)
+
+    def test_trust_mtime_ignores_inode_and_device(self):
+        stat_info = os.stat(self.data_filename)
+        moved_stat_info = Mock(st_size=stat_info.st_size, st_mtime_ns=stat_info.st_mtime_ns,
+                               st_ino=stat_info.st_ino + 1, st_dev=stat_info.st_dev)
+        hash_cache = self.make_hash_cache()
+        hash_cache.save('/tmp/file0', stat_info, 'md5', '0')
+        self.assertEqual(None, hash_cache.lookup('/tmp/file0', moved_stat_info))
+        hash_cache.close()
+        trusting_hash_cache = HashCache(self.cache_filename, 10, trust_mtime=True)
+        self.hash_caches.append(trusting_hash_cache)
+        trusting_hash_cache.save('/tmp/file0', stat_info, 'md5', '0')
+        self.assertEqual(('md5', '0'), trusting_hash_cache.lookup('/tmp/file0', moved_stat_info))
+        changed_stat_info = Mock(st_size=stat_info.st_size, st_mtime_ns=stat_info.st_mtime_ns + 1,
+                                 st_ino=stat_info.st_ino, st_dev=stat_info.st_dev)
+        self.assertEqual(None, trusting_hash_cache.lookup('/tmp/file0', changed_stat_info))
+
+    def test_used_from_other_threads(self):
+        hash_cache = self.make_hash_cache()
+        stat_info = os.stat(self.data_filename)
+        hash_cache.save('/tmp/file0', stat_info, 'md5', '0')
+        results = []
+        thread = threading.Thread(target=lambda: results.append(hash_cache.lookup('/tmp/file0', stat_info)))
+        thread.start()
+        thread.join()
+        self.assertEqual([('md5', '0')], results)
+
+    def test_changes_are_visible_to_other_processes_right_away(self):
+        hash_cache = self.make_hash_cache()
+        hash_cache.save('/tmp/file0', os.stat(self.data_filename), 'md5', '0')
+        conn = sqlite3.connect(self.cache_filename, timeout=0)
+        try:
+            conn.execute("INSERT OR REPLACE INTO file_hashes VALUES ('/tmp/file1', 1, 1, 1, 1, 'md5', '1', 1)")
+            conn.commit()
+            self.assertEqual([('/tmp/file0',), ('/tmp/file1',)],
+                             conn.execute("SELECT path FROM file_hashes ORDER BY path").fetchall())
+        finally:
+            conn.close()
+
+    @patch('ddsc.core.hashcache.sys')
+    def test_database_errors_are_treated_as_cache_misses(self, mock_sys):
+        hash_cache = self.make_hash_cache()
+        stat_info = os.stat(self.data_filename)
+        hash_cache.save(self.data_filename, stat_info, 'md5', 'abc')
+        hash_cache.conn = Mock()
+        hash_cache.conn.execute.side_effect = sqlite3.OperationalError('database is locked')
+
+        self.assertEqual(None, hash_cache.lookup(self.data_filename, stat_info))
+        hash_cache.save(self.data_filename, stat_info, 'md5', 'def')
+
+        hash_cache.conn.rollback.assert_called_with()
+        mock_sys.stderr.write.assert_called_once_with(
+            "Unable to use hash cache {}: database is locked\n".format(self.cache_filename))
+
+    def test_setup_hash_cache(self):
+        setup_hash_cache(Mock(hash_cache_filename=self.cache_filename, hash_cache_max_items=10))
+        self.assertEqual(self.cache_filename, get_hash_cache().filename)
+        setup_hash_cache(Mock(hash_cache_filename='', hash_cache_max_items=10))
+        self.assertEqual(None, get_hash_cache())
@@ -0,0 +1,96 @@
+from unittest import TestCase
+import importlib
+import socket
+import sys
+import ddsc.core
+from ddsc.core.httpsession import SessionRegistry, KeepAliveHTTPAdapter, get_requests_session, \
+    reset_requests_session, set_session_registry, setup_session_registry, TCP_KEEP_ALIVE_SOCKET_OPTIONS
+from requests.adapters import HTTPAdapter
+from requests.packages.urllib3.connection import HTTPConnection
+from mock import Mock, patch
+
+
+class TestSessionRegistry(TestCase):
+    def test_get_session_reuses_session_in_process(self):
+        registry = SessionRegistry()
+        session = registry.get_session()
+        self.assertIs(session, registry.get_session())
+
+    @patch('ddsc.core.httpsession.os')
+    def test_get_session_creates_session_per_process(self, mock_os):
+        registry = SessionRegistry()
+        mock_os.getpid.return_value = 100
+        parent_session = registry.get_session()
+        mock_os.getpid.return_value = 101
+        child_session = registry.get_session()
+        self.assertIsNot(parent_session, child_session)
+        self.assertIs(child_session, registry.get_session())
+
+    def test_reset_session(self):
+        registry = SessionRegistry()
+        session = registry.get_session()
+        new_session = registry.reset_session()
+        self.assertIsNot(session, new_session)
+        self.assertIs(new_session, registry.get_session())
+
+    def test_create_session_sizes_pools(self):
+        session = SessionRegistry(pool_connections=3, pool_maxsize=7).create_session()
+        adapter = session.get_adapter('https://api.dataservice.duke.edu/api/v1')
+        self.assertIsInstance(adapter, KeepAliveHTTPAdapter)
+        self.assertEqual(3, adapter._pool_connections)
+        self.assertEqual(7, adapter._pool_maxsize)
+        self.assertEqual(TCP_KEEP_ALIVE_SOCKET_OPTIONS, adapter.poolmanager.connection_pool_kw['socket_options'])
+
+    def test_create_session_without_tcp_keep_alive(self):
+        session = SessionRegistry(tcp_keep_alive=False).create_session()
+        adapter = session.get_adapter('https://api.dataservice.duke.edu/api/v1')
+        self.assertEqual(HTTPAdapter, type(adapter))
+
+
+class TestSessionRegistryFunctions(TestCase):
+    def tearDown(self):
+        set_session_registry(SessionRegistry())
+
+    def test_setup_session_registry(self):
+        setup_session_registry(Mock(http_pool_connections=2, http_pool_maxsize=5, http_tcp_keep_alive=True))
+        session = get_requests_session()
+        self.assertIs(session, get_requests_session())
+        self.assertEqual(5, session.get_adapter('https://somehost').poolmanager.connection_pool_kw['maxsize'])
+        self.assertIsNot(session, reset_requests_session())
+
+    def test_setup_session_registry_sizes_pools_for_thread_transfers(self):
+        setup_session_registry(Mock(http_pool_connections=2, http_pool_maxsize=5, http_tcp_keep_alive=True,
+                                    transfer_engine='thread', transfer_concurrency=20))
+        session = get_requests_session()
+        self.assertEqual(20, session.get_adapter('https://somehost').poolmanager.connection_pool_kw['maxsize'])
+
+    def test_setup_session_registry_sizes_pools_for_small_file_pipeline(self):
+        setup_session_registry(Mock(http_pool_connections=2, http_pool_maxsize=5, http_tcp_keep_alive=True,
+                                    small_file_engine='pipeline', small_file_pipeline_depth=32))
+        session = get_requests_session()
+        self.assertEqual(32, session.get_adapter('https://somehost').poolmanager.connection_pool_kw['maxsize'])
+
+    def test_setup_session_registry_sizes_pools_for_thread_upload_executor(self):
+        setup_session_registry(Mock(http_pool_connections=2, http_pool_maxsize=5, http_tcp_keep_alive=True,
+                                    upload_executor='thread', upload_workers=16))
+        session = get_requests_session()
+        self.assertEqual(16, session.get_adapter('https://somehost').poolmanager.connection_pool_kw['maxsize'])
+
+    def test_setup_session_registry_uses_largest_thread_count(self):
+        setup_session_registry(Mock(http_pool_connections=2, http_pool_maxsize=5, http_tcp_keep_alive=True,
+                                    transfer_engine='thread', transfer_concurrency=20,
+                                    small_file_engine='pipeline', small_file_pipeline_depth=32,
+                                    upload_executor='thread', upload_workers=16))
+        session = get_requests_session()
+        self.assertEqual(32, session.get_adapter('https://somehost').poolmanager.connection_pool_kw['maxsize'])
+
+
+class TestHttpSessionImports(TestCase):
+    def test_imports_when_urllib3_is_only_bundled_with_requests(self):
+        # requests==2.13.0 (the pinned version) bundles urllib3 instead of depending on the urllib3 package
+        with patch.dict(sys.modules, {'urllib3': None, 'urllib3.connection': None}), \
+                patch.object(ddsc.core, 'httpsession'):
+            sys.modules.pop('ddsc.core.httpsession')
+            httpsession = importlib.import_module('ddsc.core.httpsession')
+        self.assertIs(HTTPConnection, httpsession.HTTPConnection)
+        self.assertIn((socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1), httpsession.TCP_KEEP_ALIVE_SOCKET_OPTIONS)
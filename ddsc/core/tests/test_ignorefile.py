@@ -13,13 +13,16 @@ class TestFileFilter(TestCase):
             '.gitignore',
             '.ddsclient_other',
             '.DS_Storeage',
-            'DS_Store'
+            'DS_Store',
+            'ddsclient-bundle.json',
+            '.ddsclient-bundle.tar'
         ]
         bad_files = [
             '.ddsclient',
             '.DS_Store',
             '._anything',
-            '._abc'
+            '._abc',
+            '.ddsclient-bundle.json'
         ]
         # include good filenames
         for good_filename in good_files:
@@ -96,3 +99,16 @@ class IgnoreFilePatternsTests(TestCase):
         self.assertEqual(True, ignore_file_data.include('/tmp/data/script/run.sh', is_file=True))
         self.assertEqual(True, ignore_file_data.include('/tmp/data/results/file1.txt', is_file=True))
         self.assertEqual(True, ignore_file_data.include('/tmp/data/results/foies/result.bam', is_file=True))
+
+    def test_load_ignore_file(self):
+        mock_file_filter = MagicMock()
+        mock_file_filter.include.return_value = True
+        ignore_file_data = IgnoreFilePatterns(mock_file_filter)
+        fake_open = mock_open(read_data='*.log\n')
+        with patch('ddsc.core.ignorefile.open', fake_open, create=True):
+            ignore_file_data.load_ignore_file('/tmp/data', ['file1.txt'])
+            fake_open.assert_not_called()
+            ignore_file_data.load_ignore_file('/tmp/data', ['file1.txt', '.ddsignore'])
+        fake_open.assert_called_with('/tmp/data/.ddsignore', 'r')
+        self.assertEqual(False, ignore_file_data.include('/tmp/data/run.log', is_file=True))
+        self.assertEqual(True, ignore_file_data.include('/tmp/data/run.txt', is_file=True))
@@ -1,8 +1,15 @@
+import hashlib
+import os
 import shutil
 import tarfile
+import tempfile
 from unittest import TestCase
-from ddsc.core.localstore import LocalFile, LocalFolder, LocalProject
-from mock import patch
+import ddsc.core.localstore
+import ddsc.core.util
+from ddsc.core.localstore import LocalFile, LocalFolder, LocalProject, ParallelFolderScanner, _build_folder_tree, \
+    HashUtil
+from ddsc.core.ignorefile import FileFilter
+from mock import patch, Mock
 
 
 INCLUDE_ALL = ''
@@ -150,6 +157,29 @@ class TestProjectContent(TestCase):
 
 
 class TestLocalFile(TestCase):
+    @patch('ddsc.core.localstore.os.path.getsize')
+    def test_path_derived_from_parent(self, mock_getsize):
+        grand = LocalFolder('/tmp/grand')
+        parent = LocalFolder('/tmp/grand/parent')
+        f = LocalFile('/tmp/grand/parent/data.txt', size=5)
+        grand.add_child(parent)
+        parent.add_child(f)
+        self.assertEqual('/tmp/grand/parent/data.txt', f.path)
+        self.assertEqual('/tmp/grand/parent', parent.path)
+        self.assertEqual('/tmp/grand', grand.path)
+        self.assertEqual(5, f.size)
+        mock_getsize.assert_not_called()
+        self.assertFalse(hasattr(f, '__dict__'))
+        self.assertFalse(hasattr(parent, '__dict__'))
+
+    def test_path_data_created_when_needed(self):
+        f = LocalFile('/tmp/data.txt', size=5)
+        self.assertEqual(None, f._path_data)
+        self.assertEqual('text/plain', f.mimetype)
+        path_data = f.get_path_data()
+        self.assertEqual('/tmp/data.txt', path_data.path)
+        self.assertIs(path_data, f.get_path_data())
+
     @patch('ddsc.core.localstore.os')
     @patch('ddsc.core.localstore.PathData')
     def test_count_chunks_values(self, mock_path_data, mock_os):
@@ -164,3 +194,231 @@ class TestLocalFile(TestCase):
         for file_size, bytes_per_chunk, expected in values:
             f.size = file_size
             self.assertEqual(expected, f.count_chunks(bytes_per_chunk))
+
+
+class TestBuildFolderTree(TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.make_file('.ddsignore', '*.log\n')
+        self.make_file('top.txt', '12345')
+        self.make_file('top.log', '')
+        self.make_file('results/.ddsignore', '*.bam\nskip')
+        self.make_file('results/run.log', '')
+        self.make_file('results/data.bam', '')
+        self.make_file('results/data.txt', '123')
+        self.make_file('results/skip/data.txt', '')
+        self.make_file('scripts/data.bam', '')
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir)
+
+    def make_file(self, relpath, contents):
+        path = os.path.join(self.temp_dir, relpath)
+        if not os.path.exists(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path))
+        with open(path, 'w') as outfile:
+            outfile.write(contents)
+
+    def test_ignore_files_loaded_while_walking(self):
+        folder = _build_folder_tree(self.temp_dir, False, FileFilter(''))
+        paths = []
+        pending = [folder]
+        while pending:
+            item = pending.pop()
+            paths.append(os.path.relpath(item.path, self.temp_dir))
+            pending.extend(getattr(item, 'children', []))
+        self.assertEqual(sorted(['.', '.ddsignore', 'top.txt', 'results', 'results/.ddsignore', 'results/data.txt',
+                                 'scripts', 'scripts/data.bam']), sorted(paths))
+        sizes = dict((child.name, child.size) for child in folder.children if child.kind == 'dds-file')
+        self.assertEqual(5, sizes['top.txt'])
+
+    @patch('ddsc.core.localstore.os.path.getsize')
+    def test_each_directory_listed_once(self, mock_getsize):
+        listed_dirs = []
+
+        def counting_scandir(dir_path):
+            listed_dirs.append(dir_path)
+            return ddsc.core.util.scandir(dir_path)
+
+        with patch('ddsc.core.localstore.scandir', counting_scandir):
+            _build_folder_tree(self.temp_dir, False, FileFilter(''))
+        self.assertEqual(sorted([self.temp_dir, os.path.join(self.temp_dir, 'results'),
+                                 os.path.join(self.temp_dir, 'scripts')]), sorted(listed_dirs))
+        mock_getsize.assert_not_called()
+
+    def test_unreadable_top_folder(self):
+        self.assertEqual(None, _build_folder_tree(os.path.join(self.temp_dir, 'missing'), False, FileFilter('')))
+
+
+class TestParallelFolderScanner(TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        for folder_num in range(5):
+            for subfolder_num in range(3):
+                for file_num in range(4):
+                    path = os.path.join(self.temp_dir, 'folder{}'.format(folder_num),
+                                        'sub{}'.format(subfolder_num), 'file{}.txt'.format(file_num))
+                    if not os.path.exists(os.path.dirname(path)):
+                        os.makedirs(os.path.dirname(path))
+                    with open(path, 'w') as outfile:
+                        outfile.write('data')
+        with open(os.path.join(self.temp_dir, 'folder1', '.ddsignore'), 'w') as outfile:
+            outfile.write('sub2\n')
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir)
+
+    def test_same_tree_as_single_thread(self):
+        expected = str(_build_folder_tree(self.temp_dir, False, FileFilter('')))
+        for _ in range(3):
+            folder = ParallelFolderScanner(False, FileFilter(''), max_workers=4).run(self.temp_dir)
+            self.assertEqual(expected, str(folder))
+        folders = dict((child.name, child) for child in folder.children)
+        self.assertEqual(['sub0', 'sub1'], sorted(child.name for child in folders['folder1'].children
+                                                  if child.kind == 'dds-folder'))
+        sub_folder = folders['folder0'].children[0]
+        self.assertEqual(os.path.join(self.temp_dir, 'folder0', sub_folder.name, sub_folder.children[0].name),
+                         sub_folder.children[0].path)
+
+    def test_local_project_scan_workers(self):
+        content = LocalProject(False, file_exclude_regex=INCLUDE_ALL, scan_workers=3)
+        content.add_path(self.temp_dir)
+        single_thread_content = LocalProject(False, file_exclude_regex=INCLUDE_ALL)
+        single_thread_content.add_path(self.temp_dir)
+        self.assertEqual(str(single_thread_content), str(content))
+
+    def test_unreadable_top_folder(self):
+        scanner = ParallelFolderScanner(False, FileFilter(''), max_workers=2)
+        self.assertEqual(None, scanner.run(os.path.join(self.temp_dir, 'missing')))
+
+    def test_raises_errors(self):
+        scanner = ParallelFolderScanner(False, FileFilter(''), max_workers=2)
+        with patch('ddsc.core.localstore.LocalFile', side_effect=ValueError('bad file')):
+            with self.assertRaises(ValueError):
+                scanner.run(self.temp_dir)
+
+
+class TestHashUtil(TestCase):
+    def test_add_file_reads_blocks(self):
+        with tempfile.NamedTemporaryFile() as data_file:
+            data_file.write(b'0123456789' * 1000)
+            data_file.flush()
+            hash_util = HashUtil()
+            hash_util.add_file(data_file.name, block_size=4096)
+            other_hash_util = HashUtil()
+            other_hash_util.add_file(data_file.name)
+        self.assertEqual(hashlib.md5(b'0123456789' * 1000).hexdigest(), hash_util.hexdigest()[1])
+        self.assertEqual(hash_util.hexdigest(), other_hash_util.hexdigest())
+
+
+class TestUpdateRemoteIds(TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        os.makedirs(os.path.join(self.temp_dir, 'data', 'results'))
+        self.file_contents = {}
+        for relpath, contents in [('data/same.txt', b'same'), ('data/changed.txt', b'changed'),
+                                  ('data/results/same2.txt', b'same2'), ('data/new.txt', b'new'),
+                                  ('data/resized.txt', b'resized')]:
+            with open(os.path.join(self.temp_dir, relpath), 'wb') as outfile:
+                outfile.write(contents)
+            self.file_contents[relpath] = contents
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir)
+
+    def make_remote_file(self, name, contents):
+        remote_file = Mock(kind='dds-file', id=name + '_id', hash_alg='md5', size=len(contents),
+                           file_hash=hashlib.md5(contents).hexdigest())
+        remote_file.name = name
+        return remote_file
+
+    def make_remote_folder(self, name, children):
+        remote_folder = Mock(kind='dds-folder', id=name + '_id', children=children)
+        remote_folder.name = name
+        return remote_folder
+
+    def make_remote_project(self):
+        remote_results = self.make_remote_folder('results', [self.make_remote_file('same2.txt', b'same2')])
+        remote_data = self.make_remote_folder('data', [
+            self.make_remote_file('same.txt', b'same'),
+            self.make_remote_file('changed.txt', b'old'),
+            self.make_remote_file('resized.txt', b'resized, longer'),
+            remote_results,
+        ])
+        return Mock(id='project_id', children=[remote_data])
+
+    def check_need_to_send(self, hash_workers):
+        local_project = LocalProject(False, file_exclude_regex=INCLUDE_ALL)
+        local_project.add_path(os.path.join(self.temp_dir, 'data'))
+        local_project.update_remote_ids(self.make_remote_project(), hash_workers=hash_workers)
+        need_to_send = {}
+        self.local_files = {}
+        pending = list(local_project.children)
+        while pending:
+            item = pending.pop()
+            if item.is_file:
+                need_to_send[item.name] = (item.need_to_send, item.remote_id)
+                self.local_files[item.name] = item
+            else:
+                pending.extend(item.children)
+        self.assertEqual({
+            'same.txt': (False, 'same.txt_id'),
+            'changed.txt': (True, 'changed.txt_id'),
+            'same2.txt': (False, 'same2.txt_id'),
+            'new.txt': (True, ''),
+            'resized.txt': (True, 'resized.txt_id'),
+        }, need_to_send)
+        self.assertEqual(None, self.local_files['resized.txt']._path_data)
+
+    def test_single_thread(self):
+        self.check_need_to_send(hash_workers=1)
+
+    def test_hash_workers(self):
+        with patch('ddsc.core.localstore.ThreadPool', wraps=ddsc.core.localstore.ThreadPool) as mock_thread_pool:
+            self.check_need_to_send(hash_workers=3)
+        mock_thread_pool.assert_called_with(3)
+
+
+class TestFindDuplicateFiles(TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        os.makedirs(os.path.join(self.temp_dir, 'data', 'copies'))
+        for relpath, contents in [('data/genome.fa', b'ACGT'), ('data/copies/genome.fa', b'ACGT'),
+                                  ('data/copies/genome2.fa', b'ACGT'), ('data/other.fa', b'TTTT'),
+                                  ('data/unique.txt', b'unique'), ('data/empty1.txt', b''),
+                                  ('data/empty2.txt', b''), ('data/sent.fa', b'ACGT')]:
+            with open(os.path.join(self.temp_dir, relpath), 'wb') as outfile:
+                outfile.write(contents)
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir)
+
+    def find_duplicate_files(self, hash_workers):
+        local_project = LocalProject(False, file_exclude_regex=INCLUDE_ALL)
+        local_project.add_path(os.path.join(self.temp_dir, 'data'))
+        data_folder = local_project.children[0]
+        [sent_file] = [child for child in data_folder.children if child.name == 'sent.fa']
+        sent_file.need_to_send = False
+        duplicate_files = local_project.find_duplicate_files(hash_workers)
+        return [[os.path.relpath(local_file.path, self.temp_dir) for local_file in local_files]
+                for local_files in duplicate_files]
+
+    def test_groups_files_with_same_contents(self):
+        self.assertEqual([
+            ['data/copies/genome.fa', 'data/copies/genome2.fa', 'data/genome.fa'],
+        ], self.find_duplicate_files(hash_workers=1))
+
+    def test_hash_workers(self):
+        with patch('ddsc.core.localstore.ThreadPool', wraps=ddsc.core.localstore.ThreadPool) as mock_thread_pool:
+            duplicate_files = self.find_duplicate_files(hash_workers=2)
+        mock_thread_pool.assert_called_with(2)
+        self.assertEqual([
+            ['data/copies/genome.fa', 'data/copies/genome2.fa', 'data/genome.fa'],
+        ], duplicate_files)
+
+    def test_only_hashes_files_with_the_same_size(self):
+        with patch('ddsc.core.localstore.HashData.create_from_path',
+                   wraps=ddsc.core.localstore.HashData.create_from_path) as mock_create_from_path:
+            self.find_duplicate_files(hash_workers=1)
+        hashed_names = sorted(os.path.basename(args[0]) for args, kwargs in mock_create_from_path.call_args_list)
+        self.assertEqual(['genome.fa', 'genome.fa', 'genome2.fa', 'other.fa'], hashed_names)
@@ -1,6 +1,7 @@
 from unittest import TestCase
 import queue
-from ddsc.core.parallel import WaitingTaskList, Task, TaskRunner, TaskExecutor
+from ddsc.core.parallel import WaitingTaskList, Task, TaskRunner, TaskExecutor, ThreadTaskExecutor, \
+    create_task_executor
 from mock import patch, Mock
 
 
@@ -212,3 +213,44 @@ class TestTaskExecutor(TestCase):
         executor.wait_for_tasks()
         self.assertEqual(40, add_command.result)
         self.assertEqual(add_command.on_message_data, ['TEST', 'TEST2'])
+
+
+class TestThreadTaskExecutor(TestCase):
+    def test_adds_with_messages(self):
+        add_command = AddCommand(10, 30)
+        add_command.send_message = 'ok'
+        add_command2 = AddCommand(4, 1)
+        executor = ThreadTaskExecutor(2)
+        runner = TaskRunner(executor)
+        runner.add(None, add_command)
+        runner.add(1, add_command2)
+        runner.run()
+        self.assertEqual(add_command.result, 40)
+        self.assertEqual(add_command2.parent_task_result, 40)
+        self.assertEqual(add_command2.result, 5)
+        self.assertEqual(add_command.on_message_data, ['ok'])
+
+    def test_task_failure_raised(self):
+        executor = ThreadTaskExecutor(2)
+        add_command = AddCommand(10, None)
+        executor.add_task(Task(1, None, add_command), None)
+        with self.assertRaises(Exception) as raised_exception:
+            executor.wait_for_tasks()
+        self.assertIn('TypeError', str(raised_exception.exception))
+
+
+class TestCreateTaskExecutor(TestCase):
+    @patch('ddsc.core.parallel.multiprocessing')
+    def test_process_executor(self, mock_multiprocessing):
+        executor = create_task_executor('process', 3)
+        self.assertEqual(TaskExecutor, type(executor))
+        self.assertEqual(mock_multiprocessing.Pool.return_value, executor.pool)
+
+    def test_thread_executor(self):
+        executor = create_task_executor('thread', 3)
+        self.assertEqual(ThreadTaskExecutor, type(executor))
+        self.assertIsInstance(executor.message_queue, queue.Queue)
+
+    def test_invalid_executor(self):
+        with self.assertRaises(ValueError):
+            create_task_executor('fibers', 3)
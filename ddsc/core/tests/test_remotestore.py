@@ -1,3 +1,5 @@
+import os
+import sys
 import json
 from unittest import TestCase
 from mock import MagicMock, Mock
@@ -469,7 +471,7 @@ class TestRemoteStore(TestCase):
         remote_store = RemoteStore(config=MagicMock())
         project_name_or_id = ProjectNameOrId.create_from_project_id('123')
         remote_store.fetch_remote_project(project_name_or_id, must_exist=True, include_children=True)
-        mock_data_service_api.return_value.get_project_children.assert_called_with('123', '', exclude_response_fields)
+        mock_data_service_api.return_value.iterate_project_children.assert_called_with('123', '', exclude_response_fields)
 
 
 class TestRemoteProjectChildren(TestCase):
@@ -493,26 +495,13 @@ class TestRemoteProjectChildren(TestCase):
              'name': 'folder1',
              'id': folder_id}]
         remote_children = RemoteProjectChildren(project_id, sample_data)
-
-        children = remote_children._get_children_for_parent(project_id)
-        self.assert_field_values(children, field_name='id', expected_values=[folder_id])
-
-        children = remote_children._get_children_for_parent(folder_id)
-        self.assert_field_values(children, field_name='id', expected_values=[file_id])
-
-        children = remote_children._get_children_for_parent(file_id)
-        self.assert_field_values(children, field_name='id', expected_values=[])
-
         tree = remote_children.get_tree()
         self.assertEqual(1, len(tree))
         self.assertEqual(folder_id, tree[0].id)
         self.assertEqual(1, len(tree[0].children))
         self.assertEqual(file_id, tree[0].children[0].id)
         self.assertEqual('3664d6f3812dbb0d80302ef990b96b51', tree[0].children[0].file_hash)
-
-    def assert_field_values(self, items, field_name, expected_values):
-        values = [item[field_name] for item in items]
-        self.assertEqual(values, expected_values)
+        self.assertEqual(os.path.join('folder1', 'data.txt'), tree[0].children[0].remote_path)
 
     def test_top_level_files(self):
         project_id = 'c5da4e5e-0906-41a0-8b8f-20d99863bbaa'
@@ -569,6 +558,61 @@ class TestRemoteProjectChildren(TestCase):
         self.assertEqual(file3_id, tree[2].id)
         self.assertEqual(None, tree[2].file_hash)
 
+    @staticmethod
+    def make_folder_data(folder_id, parent_id, parent_kind='dds-folder'):
+        return {'kind': 'dds-folder', 'parent': {'kind': parent_kind, 'id': parent_id}, 'is_deleted': False,
+                'name': 'folder' + folder_id, 'id': folder_id}
+
+    @staticmethod
+    def make_file_data(file_id, parent_id):
+        return {'kind': 'dds-file', 'parent': {'kind': 'dds-folder', 'id': parent_id}, 'is_deleted': False,
+                'name': 'file' + file_id, 'id': file_id,
+                'current_version': {'id': 'v' + file_id, 'upload': {'size': 1, 'hash': None}}}
+
+    def test_deeply_nested_folders(self):
+        depth = sys.getrecursionlimit() + 100
+        sample_data = [self.make_folder_data('0', 'project1', parent_kind='dds-project')]
+        for folder_num in range(1, depth):
+            sample_data.append(self.make_folder_data(str(folder_num), str(folder_num - 1)))
+        sample_data.append(self.make_file_data('file1', str(depth - 1)))
+        sample_data.reverse()
+        tree = RemoteProjectChildren('project1', sample_data).get_tree()
+        item = tree[0]
+        for _ in range(depth):
+            self.assertEqual(1, len(item.children))
+            item = item.children[0]
+        self.assertEqual('file1', item.id)
+        self.assertEqual(depth + 1, len(item.remote_path.split(os.sep)))
+
+    def test_remote_path_derived_from_parents(self):
+        sample_data = [
+            self.make_folder_data('folder1', 'project1', parent_kind='dds-project'),
+            self.make_folder_data('folder2', 'folder1'),
+            self.make_file_data('file1', 'folder2'),
+        ]
+        tree = RemoteProjectChildren('project1', sample_data).get_tree()
+        remote_file = tree[0].children[0].children[0]
+        self.assertEqual(os.path.join('folderfolder1', 'folderfolder2', 'filefile1'), remote_file.remote_path)
+        self.assertEqual('filefile1', remote_file.path)
+        self.assertEqual('dds-file', remote_file.kind)
+        self.assertFalse(hasattr(remote_file, '__dict__'))
+        self.assertFalse(hasattr(tree[0], '__dict__'))
+
+    def test_children_keep_order(self):
+        sample_data = [
+            self.make_file_data('file1', 'folder1'),
+            self.make_folder_data('folder1', 'project1', parent_kind='dds-project'),
+            self.make_file_data('file2', 'folder1'),
+            self.make_folder_data('folder2', 'project1', parent_kind='dds-project'),
+            self.make_file_data('file3', 'folder2'),
+            self.make_file_data('file4', 'folder1'),
+        ]
+        tree = RemoteProjectChildren('project1', iter(sample_data)).get_tree()
+        self.assertEqual(['folder1', 'folder2'], [item.id for item in tree])
+        self.assertEqual(['file1', 'file2', 'file4'], [item.id for item in tree[0].children])
+        self.assertEqual(['file3'], [item.id for item in tree[1].children])
+        self.assertEqual(os.path.join('folderfolder2', 'filefile3'), tree[1].children[0].remote_path)
+
 
 class TestReadRemoteHash(TestCase):
     def test_old_way(self):
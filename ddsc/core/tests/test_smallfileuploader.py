@@ -0,0 +1,226 @@
+from unittest import TestCase
+import hashlib
+import threading
+from ddsc.core.smallfileuploader import SmallFilePipeline, SmallFileUpload, create_small_file_uploads, \
+    use_small_file_pipeline
+from ddsc.core.fileuploader import ParentData
+from ddsc.core.ddsapi import DSResourceNotConsistentError
+from mock import MagicMock, Mock, patch, call
+
+
+def make_small_file(contents, remote_id=None):
+    local_file = MagicMock(remote_id=remote_id, size=len(contents))
+    local_file.get_path_data.return_value.read_whole_file.return_value = contents
+    return SmallFileUpload(local_file, ParentData('dds-folder', 'folder1'))
+
+
+def make_config(depth, upload_bytes_in_flight=None):
+    return Mock(small_file_pipeline_depth=depth, upload_bytes_in_flight=upload_bytes_in_flight,
+                upload_bytes_per_chunk=100)
+
+
+def make_data_service():
+    data_service = MagicMock()
+    data_service.create_upload.side_effect = lambda project_id, name, mime_type, size, hash_value, hash_alg: \
+        Mock(json=Mock(return_value={'id': 'upload-' + hash_value}))
+    data_service.create_upload_url.side_effect = lambda upload_id, number, size, hash_value, hash_alg: \
+        Mock(json=Mock(return_value={'http_verb': 'PUT', 'host': 'somehost', 'url': '/' + upload_id,
+                                     'http_headers': {}}))
+    data_service.send_external.return_value = Mock(status_code=201)
+    data_service.create_file.side_effect = lambda parent_kind, parent_id, upload_id: \
+        Mock(json=Mock(return_value={'id': 'file-' + upload_id}))
+    data_service.update_file.side_effect = lambda file_id, upload_id: \
+        Mock(json=Mock(return_value={'id': file_id}))
+    return data_service
+
+
+class TestSmallFilePipeline(TestCase):
+    def make_pipeline(self, depth, data_service, watcher, post_processor=None):
+        patcher = patch('ddsc.core.smallfileuploader.make_data_service', return_value=data_service)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        return SmallFilePipeline(make_config(depth), data_service, watcher, post_processor)
+
+    def test_run_uploads_each_file(self):
+        data_service = make_data_service()
+        watcher = MagicMock()
+        post_processor = MagicMock()
+        new_file = make_small_file(b'data1')
+        existing_file = make_small_file(b'data2', remote_id='file2')
+        pipeline = self.make_pipeline(4, data_service, watcher, post_processor)
+
+        pipeline.run('project1', [new_file, existing_file])
+
+        hash1 = hashlib.md5(b'data1').hexdigest()
+        hash2 = hashlib.md5(b'data2').hexdigest()
+        data_service.create_upload_url.assert_has_calls([
+            call('upload-' + hash1, 1, 5, hash1, 'md5'),
+            call('upload-' + hash2, 1, 5, hash2, 'md5'),
+        ], any_order=True)
+        data_service.send_external.assert_has_calls([
+            call('PUT', 'somehost', '/upload-' + hash1, {}, b'data1'),
+            call('PUT', 'somehost', '/upload-' + hash2, {}, b'data2'),
+        ], any_order=True)
+        data_service.complete_upload.assert_has_calls([
+            call('upload-' + hash1, hash1, 'md5'),
+            call('upload-' + hash2, hash2, 'md5'),
+        ], any_order=True)
+        data_service.create_file.assert_called_once_with('dds-folder', 'folder1', 'upload-' + hash1)
+        data_service.update_file.assert_called_once_with('file2', 'upload-' + hash2)
+        new_file.local_file.set_remote_id_after_send.assert_called_once_with('file-upload-' + hash1)
+        existing_file.local_file.set_remote_id_after_send.assert_called_once_with('file2')
+        self.assertEqual(2, watcher.transferring_item.call_count)
+        post_processor.run.assert_has_calls([
+            call(data_service, {'id': 'file-upload-' + hash1}),
+            call(data_service, {'id': 'file2'}),
+        ], any_order=True)
+        self.assertEqual(None, new_file.chunk)
+
+    def test_run_limits_files_in_pipeline(self):
+        data_service = make_data_service()
+        create_file = data_service.create_file.side_effect
+        lock = threading.Lock()
+        files_in_pipeline = []
+        max_files_in_pipeline = []
+
+        def read_whole_file():
+            with lock:
+                files_in_pipeline.append(1)
+                max_files_in_pipeline.append(len(files_in_pipeline))
+            return b'data'
+
+        def create_file_and_leave_pipeline(parent_kind, parent_id, upload_id):
+            with lock:
+                files_in_pipeline.pop()
+            return create_file(parent_kind, parent_id, upload_id)
+        data_service.create_file.side_effect = create_file_and_leave_pipeline
+        small_files = [make_small_file(b'data') for _ in range(10)]
+        for small_file in small_files:
+            small_file.local_file.get_path_data.return_value.read_whole_file.side_effect = read_whole_file
+        pipeline = self.make_pipeline(3, data_service, MagicMock())
+
+        pipeline.run('project1', small_files)
+
+        self.assertLessEqual(max(max_files_in_pipeline), 3)
+        self.assertEqual(10, data_service.create_file.call_count)
+        self.assertEqual([], files_in_pipeline)
+
+    def test_run_limits_bytes_in_pipeline(self):
+        data_service = make_data_service()
+        send_external = data_service.send_external
+        lock = threading.Lock()
+        bytes_read = []
+        max_bytes_read = []
+
+        def read_whole_file(contents):
+            with lock:
+                bytes_read.append(len(contents))
+                max_bytes_read.append(sum(bytes_read))
+            return contents
+
+        def send_and_release(http_verb, host, url, http_headers, chunk):
+            with lock:
+                bytes_read.remove(len(chunk))
+            return send_external.return_value
+        data_service.send_external = Mock(side_effect=send_and_release)
+        small_files = [make_small_file(b'x' * size) for size in [40, 30, 50, 10, 60, 20, 40]]
+        for small_file in small_files:
+            contents = small_file.local_file.get_path_data.return_value.read_whole_file.return_value
+            small_file.local_file.get_path_data.return_value.read_whole_file.side_effect = \
+                lambda contents=contents: read_whole_file(contents)
+        patcher = patch('ddsc.core.smallfileuploader.make_data_service', return_value=data_service)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        pipeline = SmallFilePipeline(make_config(10, upload_bytes_in_flight=100), data_service, MagicMock())
+
+        pipeline.run('project1', small_files)
+
+        self.assertLessEqual(max(max_bytes_read), 100)
+        self.assertEqual(7, data_service.create_file.call_count)
+        self.assertEqual([], bytes_read)
+
+    def test_run_sends_file_larger_than_bytes_limit_on_its_own(self):
+        data_service = make_data_service()
+        small_files = [make_small_file(b'x' * 150), make_small_file(b'data')]
+        pipeline = self.make_pipeline(4, data_service, MagicMock())
+        pipeline.max_bytes_in_pipeline = 100
+
+        pipeline.run('project1', small_files)
+
+        self.assertEqual(2, data_service.create_file.call_count)
+
+    def test_determine_max_bytes_in_pipeline(self):
+        self.assertEqual(200, SmallFilePipeline.determine_max_bytes_in_pipeline(None, 100))
+        self.assertEqual(500, SmallFilePipeline.determine_max_bytes_in_pipeline(500, 100))
+
+    def test_run_raises_when_a_stage_fails(self):
+        data_service = make_data_service()
+        data_service.send_external.return_value = Mock(status_code=500)
+        small_file = make_small_file(b'data1')
+        pipeline = self.make_pipeline(4, data_service, MagicMock())
+
+        with self.assertRaises(ValueError) as raised_error:
+            pipeline.run('project1', [small_file])
+        self.assertIn('Failed to send file to external store', str(raised_error.exception))
+        data_service.complete_upload.assert_not_called()
+        small_file.local_file.set_remote_id_after_send.assert_not_called()
+
+    @patch('ddsc.core.ddsapi.time')
+    def test_run_notifies_watcher_when_waiting_for_project(self, mock_time):
+        data_service = make_data_service()
+        create_upload = data_service.create_upload.side_effect
+        data_service.create_upload.side_effect = [
+            DSResourceNotConsistentError(MagicMock(), MagicMock(), MagicMock()),
+            create_upload('project1', 'name', 'text/plain', 5, 'abc', 'md5'),
+        ]
+        watcher = MagicMock()
+        small_file = make_small_file(b'data1')
+        pipeline = self.make_pipeline(4, data_service, watcher)
+
+        pipeline.run('project1', [small_file])
+
+        watcher.start_waiting.assert_called_once_with()
+        watcher.done_waiting.assert_called_once_with()
+        small_file.local_file.set_remote_id_after_send.assert_called_once_with('file-upload-abc')
+
+    def test_run_gives_each_thread_its_own_data_service(self):
+        main_data_service = make_data_service()
+        lock = threading.Lock()
+        thread_data_services = {}
+
+        def make_thread_data_service(config, auth_data):
+            data_service = make_data_service()
+            with lock:
+                thread_data_services[threading.current_thread()] = data_service
+            return data_service
+        small_files = [make_small_file('data{}'.format(num).encode('utf-8')) for num in range(6)]
+        with patch('ddsc.core.smallfileuploader.make_data_service') as mock_make_data_service:
+            mock_make_data_service.side_effect = make_thread_data_service
+            pipeline = SmallFilePipeline(make_config(3), main_data_service, MagicMock())
+            pipeline.run('project1', small_files)
+
+        self.assertEqual(3, mock_make_data_service.call_count)
+        mock_make_data_service.assert_called_with(pipeline.config, main_data_service.auth.get_auth_data())
+        self.assertEqual(3, len(thread_data_services))
+        self.assertEqual(6, sum(data_service.create_file.call_count
+                                for data_service in thread_data_services.values()))
+        main_data_service.create_file.assert_not_called()
+
+
+class TestCreateSmallFileUploads(TestCase):
+    def test_skips_files_that_do_not_need_to_be_sent(self):
+        file1 = Mock(need_to_send=True)
+        file2 = Mock(need_to_send=False)
+        parent = Mock(kind='dds-project', remote_id='project1')
+        small_files = create_small_file_uploads([(file1, parent), (file2, parent)])
+        self.assertEqual(1, len(small_files))
+        self.assertEqual(file1, small_files[0].local_file)
+        self.assertEqual(('dds-project', 'project1'), (small_files[0].parent_data.kind, small_files[0].parent_data.id))
+
+
+class TestUseSmallFilePipeline(TestCase):
+    def test_engines(self):
+        self.assertEqual(False, use_small_file_pipeline(Mock(small_file_engine='task')))
+        self.assertEqual(True, use_small_file_pipeline(Mock(small_file_engine='pipeline')))
+        with self.assertRaises(ValueError):
+            use_small_file_pipeline(Mock(small_file_engine='other'))
@@ -1,9 +1,9 @@
 from __future__ import absolute_import
 from unittest import TestCase
-from ddsc.core.upload import ProjectUpload, LocalOnlyCounter
+from ddsc.core.upload import ProjectUpload, LocalOnlyCounter, format_bytes
 from ddsc.core.localstore import LocalFile
 from ddsc.core.remotestore import ProjectNameOrId
-from mock import MagicMock, patch
+from mock import MagicMock, Mock, patch
 
 
 class TestUploadCommand(TestCase):
@@ -30,6 +30,124 @@ class TestUploadCommand(TestCase):
         self.assertIn("data2.txt", dry_run_report)
 
 
+class TestProjectUpload(TestCase):
+    @patch("ddsc.core.upload.bundle_small_files")
+    @patch("ddsc.core.upload.ProjectUpload._load_local_project")
+    @patch("ddsc.core.upload.RemoteStore")
+    def test_bundles_small_files_when_configured(self, mock_remote_store, mock_load_local_project,
+                                                 mock_bundle_small_files):
+        config = MagicMock(upload_bundle_max_file_size=4096, upload_bundle_min_files=10, upload_duplicate_files='upload')
+        ProjectUpload(config, ProjectNameOrId.create_from_name("someProject"), ["data"])
+        mock_bundle_small_files.assert_called_with(mock_load_local_project.return_value, 4096, 10)
+
+    @patch("ddsc.core.upload.bundle_small_files")
+    @patch("ddsc.core.upload.ProjectUpload._load_local_project")
+    @patch("ddsc.core.upload.RemoteStore")
+    def test_does_not_bundle_by_default(self, mock_remote_store, mock_load_local_project, mock_bundle_small_files):
+        config = MagicMock(upload_bundle_max_file_size=None, upload_duplicate_files='upload')
+        ProjectUpload(config, ProjectNameOrId.create_from_name("someProject"), ["data"])
+        mock_bundle_small_files.assert_not_called()
+
+    @patch("ddsc.core.upload.write_bundles")
+    @patch("ddsc.core.upload.bundle_small_files")
+    @patch("ddsc.core.upload.ProjectUploadDryRun")
+    @patch("ddsc.core.upload.ProjectUpload._load_local_project")
+    @patch("ddsc.core.upload.RemoteStore")
+    def test_dry_run_report_lists_bundles_without_writing_them(self, mock_remote_store, mock_load_local_project,
+                                                               mock_project_upload_dry_run, mock_bundle_small_files,
+                                                               mock_write_bundles):
+        mock_project_upload_dry_run.return_value.upload_items = ['/data/.ddsclient-bundle.tar']
+        bundle = Mock(path='/data/.ddsclient-bundle.tar', bundled_files=[Mock(), Mock()], need_to_send=True)
+        unchanged_bundle = Mock(path='/data/sub/.ddsclient-bundle.tar', bundled_files=[Mock()], need_to_send=False)
+        mock_bundle_small_files.return_value = [bundle, unchanged_bundle]
+        config = MagicMock(upload_bundle_max_file_size=4096, upload_bundle_min_files=2, upload_duplicate_files='upload')
+        project_upload = ProjectUpload(config, ProjectNameOrId.create_from_name("someProject"), ["data"])
+
+        dry_run_report = project_upload.dry_run_report()
+
+        self.assertIn("Bundles of small files that need to be uploaded:\n/data/.ddsclient-bundle.tar (2 files)\n",
+                      dry_run_report)
+        self.assertNotIn('/data/sub/', dry_run_report)
+        mock_write_bundles.assert_not_called()
+
+    @patch("ddsc.core.upload.ProgressPrinter")
+    @patch("ddsc.core.upload.ProjectUploader")
+    @patch("ddsc.core.upload.write_bundles")
+    @patch("ddsc.core.upload.bundle_small_files")
+    @patch("ddsc.core.upload.ProjectUpload._load_local_project")
+    @patch("ddsc.core.upload.RemoteStore")
+    def test_run_writes_bundles_before_uploading(self, mock_remote_store, mock_load_local_project,
+                                                 mock_bundle_small_files, mock_write_bundles, mock_project_uploader,
+                                                 mock_progress_printer):
+        config = MagicMock(upload_bundle_max_file_size=4096, upload_bundle_min_files=2, upload_duplicate_files='upload')
+        project_upload = ProjectUpload(config, ProjectNameOrId.create_from_name("someProject"), ["data"])
+        mock_write_bundles.assert_not_called()
+
+        project_upload.run()
+
+        mock_write_bundles.assert_called_with(mock_bundle_small_files.return_value)
+        mock_project_uploader.return_value.run.assert_called_with(mock_load_local_project.return_value)
+
+
+class TestProjectUploadDuplicates(TestCase):
+    def make_project_upload(self, upload_duplicate_files, duplicate_files):
+        config = MagicMock(upload_bundle_max_file_size=None, upload_duplicate_files=upload_duplicate_files)
+        with patch("ddsc.core.upload.RemoteStore"), \
+                patch("ddsc.core.upload.ProjectUpload._load_local_project") as mock_load_local_project:
+            mock_load_local_project.return_value.find_duplicate_files.return_value = duplicate_files
+            project_upload = ProjectUpload(config, ProjectNameOrId.create_from_name("someProject"), ["data"])
+        mock_load_local_project.return_value.find_duplicate_files.assert_called_with(config.hash_workers)
+        return project_upload
+
+    def make_duplicate_files(self):
+        return [
+            [Mock(size=2048, need_to_send=True), Mock(size=2048, need_to_send=True)],
+            [Mock(size=10, need_to_send=True), Mock(size=10, need_to_send=True), Mock(size=10, need_to_send=True)],
+        ]
+
+    def test_upload_duplicates_warns(self):
+        duplicate_files = self.make_duplicate_files()
+        project_upload = self.make_project_upload('upload', duplicate_files)
+        self.assertEqual([True, True, True, True, True],
+                         [local_file.need_to_send for local_files in duplicate_files for local_file in local_files])
+        summary = project_upload.get_duplicates_summary()
+        self.assertIn('WARNING: Found 3 files with the same contents', summary)
+        self.assertIn('(2.0 KB)', summary)
+
+    def test_skip_duplicates(self):
+        duplicate_files = self.make_duplicate_files()
+        project_upload = self.make_project_upload('skip', duplicate_files)
+        self.assertEqual([True, False, True, False, False],
+                         [local_file.need_to_send for local_files in duplicate_files for local_file in local_files])
+        self.assertEqual('Skipping 3 files with the same contents as other files being uploaded, saving 2.0 KB.',
+                         project_upload.get_duplicates_summary())
+
+    def test_no_duplicates(self):
+        project_upload = self.make_project_upload('upload', [])
+        self.assertEqual(None, project_upload.get_duplicates_summary())
+
+    def test_invalid_setting(self):
+        with self.assertRaises(ValueError):
+            self.make_project_upload('other', [])
+
+    def test_off_does_not_look_for_duplicates(self):
+        config = MagicMock(upload_bundle_max_file_size=None, upload_duplicate_files='off')
+        with patch("ddsc.core.upload.RemoteStore"), \
+                patch("ddsc.core.upload.ProjectUpload._load_local_project") as mock_load_local_project:
+            project_upload = ProjectUpload(config, ProjectNameOrId.create_from_name("someProject"), ["data"])
+        mock_load_local_project.return_value.find_duplicate_files.assert_not_called()
+        self.assertEqual([], project_upload.duplicate_files)
+        self.assertEqual(None, project_upload.get_duplicates_summary())
+
+
+class TestFormatBytes(TestCase):
+    def test_format_bytes(self):
+        self.assertEqual('100 bytes', format_bytes(100))
+        self.assertEqual('1.5 KB', format_bytes(1536))
+        self.assertEqual('2.0 GB', format_bytes(2 * 1024 ** 3))
+        self.assertEqual('4.0 TB', format_bytes(4 * 1024 ** 4))
+
+
 class TestLocalOnlyCounter(TestCase):
     @patch('ddsc.core.localstore.os')
     @patch('ddsc.core.localstore.PathData')
@@ -0,0 +1,114 @@
+from unittest import TestCase
+import os
+import shutil
+import sqlite3
+import tempfile
+import ddsc.core.uploadjournal
+from ddsc.core.uploadjournal import UploadJournal, get_upload_journal, set_upload_journal, setup_upload_journal
+from mock import Mock, patch
+
+
+class TestUploadJournal(TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.journal_filename = os.path.join(self.temp_dir, 'subdir', 'journal.sqlite')
+        self.data_filename = os.path.join(self.temp_dir, 'data.txt')
+        with open(self.data_filename, 'w') as outfile:
+            outfile.write('somedata')
+        self.stat_info = os.stat(self.data_filename)
+        self.upload_journals = []
+
+    def tearDown(self):
+        set_upload_journal(None)
+        for upload_journal in self.upload_journals:
+            upload_journal.close()
+        shutil.rmtree(self.temp_dir)
+
+    def make_upload_journal(self):
+        upload_journal = UploadJournal(self.journal_filename)
+        self.upload_journals.append(upload_journal)
+        return upload_journal
+
+    def test_find_upload_empty(self):
+        upload_journal = self.make_upload_journal()
+        self.assertEqual(None, upload_journal.find_upload('project1', self.data_filename, self.stat_info, 100))
+        self.assertTrue(os.path.exists(self.journal_filename))
+
+    def test_start_upload_then_find_sent_chunks(self):
+        upload_journal = self.make_upload_journal()
+        upload_journal.start_upload('project1', self.data_filename, self.stat_info, 100, 'upload1')
+        upload_journal.chunk_sent('upload1', 0)
+        upload_journal.chunk_sent('upload1', 2)
+        upload_journal.chunk_sent('upload1', 2)
+        upload_journal.close()
+        upload_journal = self.make_upload_journal()
+        self.assertEqual(('upload1', set([0, 2])),
+                         upload_journal.find_upload('project1', self.data_filename, self.stat_info, 100))
+        # uploads are specific to a project
+        self.assertEqual(None, upload_journal.find_upload('project2', self.data_filename, self.stat_info, 100))
+
+    def test_find_upload_changed_file_or_chunk_size(self):
+        upload_journal = self.make_upload_journal()
+        upload_journal.start_upload('project1', self.data_filename, self.stat_info, 100, 'upload1')
+        changed_size = Mock(st_size=self.stat_info.st_size + 1, st_mtime_ns=self.stat_info.st_mtime_ns)
+        self.assertEqual(None, upload_journal.find_upload('project1', self.data_filename, changed_size, 100))
+        changed_mtime = Mock(st_size=self.stat_info.st_size, st_mtime_ns=self.stat_info.st_mtime_ns + 1)
+        self.assertEqual(None, upload_journal.find_upload('project1', self.data_filename, changed_mtime, 100))
+        self.assertEqual(None, upload_journal.find_upload('project1', self.data_filename, self.stat_info, 200))
+
+    def test_start_upload_replaces_previous_upload(self):
+        upload_journal = self.make_upload_journal()
+        upload_journal.start_upload('project1', self.data_filename, self.stat_info, 100, 'upload1')
+        upload_journal.chunk_sent('upload1', 0)
+        upload_journal.start_upload('project1', self.data_filename, self.stat_info, 100, 'upload2')
+        self.assertEqual(('upload2', set()),
+                         upload_journal.find_upload('project1', self.data_filename, self.stat_info, 100))
+
+    def test_remove_upload(self):
+        upload_journal = self.make_upload_journal()
+        upload_journal.start_upload('project1', self.data_filename, self.stat_info, 100, 'upload1')
+        upload_journal.chunk_sent('upload1', 0)
+        upload_journal.remove_upload('upload1')
+        self.assertEqual(None, upload_journal.find_upload('project1', self.data_filename, self.stat_info, 100))
+
+    def test_expired_uploads_removed_when_opened(self):
+        upload_journal = self.make_upload_journal()
+        with patch('ddsc.core.uploadjournal.time') as mock_time:
+            mock_time.time.return_value = 1000
+            upload_journal.start_upload('project1', self.data_filename, self.stat_info, 100, 'upload1')
+        upload_journal.close()
+        upload_journal = self.make_upload_journal()
+        with patch('ddsc.core.uploadjournal.time') as mock_time:
+            mock_time.time.return_value = 1001 + ddsc.core.uploadjournal.EXPIRE_UPLOADS_AFTER_SECONDS
+            self.assertEqual(None, upload_journal.find_upload('project1', self.data_filename, self.stat_info, 100))
+
+    @patch('ddsc.core.uploadjournal.sys')
+    @patch('ddsc.core.uploadjournal.SQLITE_LOCK_TIMEOUT_SECONDS', 0)
+    def test_locked_database_disables_journal(self, mock_sys):
+        upload_journal = self.make_upload_journal()
+        upload_journal.start_upload('project1', self.data_filename, self.stat_info, 100, 'upload1')
+        other_conn = sqlite3.connect(self.journal_filename)
+        try:
+            other_conn.execute('BEGIN EXCLUSIVE')
+            upload_journal.chunk_sent('upload1', 0)
+            upload_journal.chunk_sent('upload1', 1)
+            upload_journal.remove_upload('upload1')
+            upload_journal.start_upload('project1', self.data_filename, self.stat_info, 100, 'upload2')
+            self.assertEqual(None, upload_journal.find_upload('project1', self.data_filename, self.stat_info, 100))
+        finally:
+            other_conn.rollback()
+            other_conn.close()
+        self.assertEqual(True, upload_journal.disabled)
+        mock_sys.stderr.write.assert_called_once_with(
+            "Unable to use upload journal {}, continuing without it: database is locked\n".format(
+                self.journal_filename))
+        upload_journal.close()
+        upload_journal = self.make_upload_journal()
+        self.assertEqual(('upload1', set()),
+                         upload_journal.find_upload('project1', self.data_filename, self.stat_info, 100))
+
+    def test_setup_upload_journal(self):
+        setup_upload_journal(Mock(upload_journal_filename=self.journal_filename))
+        self.assertEqual(self.journal_filename, get_upload_journal().filename)
+        setup_upload_journal(Mock(upload_journal_filename=''))
+        self.assertEqual(None, get_upload_journal())
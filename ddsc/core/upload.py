@@ -3,6 +3,8 @@ from ddsc.core.localstore import LocalProject
 from ddsc.core.remotestore import RemoteStore
 from ddsc.core.util import ProgressPrinter, ProjectWalker
 from ddsc.core.projectuploader import UploadSettings, ProjectUploader, ProjectUploadDryRun
+from ddsc.core.bundle import bundle_small_files, write_bundles
+from ddsc.config import OFF_DUPLICATE_FILES, UPLOAD_DUPLICATE_FILES, SKIP_DUPLICATE_FILES
 
 
 class ProjectUpload(object):
@@ -22,17 +24,51 @@ class ProjectUpload(object):
         self.remote_store = RemoteStore(config)
         self.project_name_or_id = project_name_or_id
         self.remote_project = self.remote_store.fetch_remote_project(project_name_or_id)
-        self.local_project = ProjectUpload._load_local_project(folders, follow_symlinks, config.file_exclude_regex)
-        self.local_project.update_remote_ids(self.remote_project)
+        self.local_project = ProjectUpload._load_local_project(folders, follow_symlinks, config.file_exclude_regex,
+                                                               config.scan_workers)
+        self.bundles = []
+        if config.upload_bundle_max_file_size:
+            self.bundles = bundle_small_files(self.local_project, config.upload_bundle_max_file_size,
+                                              config.upload_bundle_min_files)
+        self.local_project.update_remote_ids(self.remote_project, config.hash_workers)
+        self.skip_duplicate_files = ProjectUpload._should_skip_duplicate_files(config.upload_duplicate_files)
+        self.duplicate_files = []
+        if config.upload_duplicate_files != OFF_DUPLICATE_FILES:
+            self.duplicate_files = self.local_project.find_duplicate_files(config.hash_workers)
+        if self.skip_duplicate_files:
+            ProjectUpload._skip_copies(self.duplicate_files)
         self.different_items = self._count_differences()
         self.file_upload_post_processor = file_upload_post_processor
 
     @staticmethod
-    def _load_local_project(folders, follow_symlinks, file_exclude_regex):
-        local_project = LocalProject(followsymlinks=follow_symlinks, file_exclude_regex=file_exclude_regex)
+    def _load_local_project(folders, follow_symlinks, file_exclude_regex, scan_workers):
+        local_project = LocalProject(followsymlinks=follow_symlinks, file_exclude_regex=file_exclude_regex,
+                                     scan_workers=scan_workers)
         local_project.add_paths(folders)
         return local_project
 
+    @staticmethod
+    def _should_skip_duplicate_files(upload_duplicate_files):
+        """
+        Determine if copies of files being uploaded should be skipped based on config.upload_duplicate_files.
+        :param upload_duplicate_files: str: 'off', 'upload' or 'skip'
+        :return: bool: True to only upload the first file with the same contents
+        """
+        if upload_duplicate_files not in (OFF_DUPLICATE_FILES, UPLOAD_DUPLICATE_FILES, SKIP_DUPLICATE_FILES):
+            raise ValueError("Invalid upload_duplicate_files {}, should be {}, {} or {}.".format(
+                upload_duplicate_files, OFF_DUPLICATE_FILES, UPLOAD_DUPLICATE_FILES, SKIP_DUPLICATE_FILES))
+        return upload_duplicate_files == SKIP_DUPLICATE_FILES
+
+    @staticmethod
+    def _skip_copies(duplicate_files):
+        """
+        Mark all but the first file in each group of files with the same contents as not needing to be sent.
+        :param duplicate_files: [[LocalFile]]: groups of files with the same contents
+        """
+        for local_files in duplicate_files:
+            for local_file in local_files[1:]:
+                local_file.need_to_send = False
+
     def _count_differences(self):
         """
         Count how many things we will be sending.
@@ -54,6 +90,7 @@ class ProjectUpload(object):
         """
         Upload different items within local_project to remote store showing a progress bar.
         """
+        write_bundles(self.bundles)
         progress_printer = ProgressPrinter(self.different_items.total_items(), msg_verb='sending')
         upload_settings = UploadSettings(self.config, self.remote_store.data_service, progress_printer,
                                          self.project_name_or_id, self.file_upload_post_processor)
@@ -77,8 +114,32 @@ class ProjectUpload(object):
             for item in items:
                 result += "{}\n".format(item)
             result += "\n"
+            bundles = [bundle for bundle in self.bundles if bundle.need_to_send]
+            if bundles:
+                result += "Bundles of small files that need to be uploaded:\n"
+                for bundle in bundles:
+                    files_str = LocalOnlyCounter.plural_fmt('file', len(bundle.bundled_files))
+                    result += "{} ({})\n".format(bundle.path, files_str)
+                result += "\n"
             return result
 
+    def get_duplicates_summary(self):
+        """
+        Describe the files we found that have the same contents as another file being uploaded.
+        :return: str: summary text or None if there are no such files
+        """
+        copies = [local_file for local_files in self.duplicate_files for local_file in local_files[1:]]
+        if not copies:
+            return None
+        files_str = LocalOnlyCounter.plural_fmt('file', len(copies))
+        bytes_str = format_bytes(sum(local_file.size for local_file in copies))
+        if self.skip_duplicate_files:
+            return 'Skipping {} with the same contents as other files being uploaded, saving {}.'.format(
+                files_str, bytes_str)
+        return 'WARNING: Found {} with the same contents as other files being uploaded ({}). ' \
+               'Set upload_duplicate_files to skip in your config file to upload a single copy.'.format(
+                   files_str, bytes_str)
+
     def get_differences_summary(self):
         """
         Print a summary of what is to be done.
@@ -107,6 +168,23 @@ class ProjectUpload(object):
         return url
 
 
+def format_bytes(num_bytes):
+    """
+    Format a number of bytes using the largest unit that keeps the value at or above 1.
+    :param num_bytes: int: number of bytes
+    :return: str: size with units
+    """
+    for unit in ['bytes', 'KB', 'MB', 'GB']:
+        if num_bytes < 1024:
+            break
+        num_bytes /= 1024.0
+    else:
+        unit = 'TB'
+    if unit == 'bytes':
+        return '{} {}'.format(num_bytes, unit)
+    return '{:.1f} {}'.format(num_bytes, unit)
+
+
 class LocalOnlyCounter(object):
     """
     Visitor that counts items that need to be sent in LocalContent.
@@ -0,0 +1,229 @@
+"""
+Persistent journal of large file uploads so an interrupted upload can be resumed by only sending missing chunks.
+Uploads are keyed on project, path, size, modification time and chunk size so a changed file starts a new upload.
+"""
+from __future__ import print_function
+import os
+import sys
+import time
+import sqlite3
+import threading
+from ddsc.core.hashcache import get_mtime_ns
+
+CREATE_UPLOADS_TABLE_SQL = """
+CREATE TABLE IF NOT EXISTS uploads (
+    project_id TEXT NOT NULL,
+    path TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    mtime_ns INTEGER NOT NULL,
+    chunk_size INTEGER NOT NULL,
+    upload_id TEXT NOT NULL,
+    created REAL NOT NULL,
+    PRIMARY KEY (project_id, path)
+)
+"""
+CREATE_CHUNKS_TABLE_SQL = """
+CREATE TABLE IF NOT EXISTS sent_chunks (
+    upload_id TEXT NOT NULL,
+    chunk_num INTEGER NOT NULL,
+    PRIMARY KEY (upload_id, chunk_num)
+)
+"""
+FIND_UPLOAD_SQL = "SELECT size, mtime_ns, chunk_size, upload_id FROM uploads WHERE project_id = ? AND path = ?"
+FIND_SENT_CHUNKS_SQL = "SELECT chunk_num FROM sent_chunks WHERE upload_id = ?"
+SAVE_UPLOAD_SQL = "INSERT OR REPLACE INTO uploads VALUES (?, ?, ?, ?, ?, ?, ?)"
+SAVE_CHUNK_SQL = "INSERT OR IGNORE INTO sent_chunks VALUES (?, ?)"
+DELETE_UPLOAD_SQL = "DELETE FROM uploads WHERE upload_id = ?"
+DELETE_CHUNKS_SQL = "DELETE FROM sent_chunks WHERE upload_id = ?"
+FIND_EXPIRED_UPLOADS_SQL = "SELECT upload_id FROM uploads WHERE created < ?"
+
+SQLITE_LOCK_TIMEOUT_SECONDS = 30
+# Write ahead logging lets other processes read while we write and makes our per chunk commits cheap
+JOURNAL_MODE_SQL = "PRAGMA journal_mode=WAL"
+SYNCHRONOUS_SQL = "PRAGMA synchronous=NORMAL"
+# DukeDS cleans up uploads that are never completed so don't keep journal entries forever
+EXPIRE_UPLOADS_AFTER_SECONDS = 30 * 24 * 60 * 60
+
+
+class UploadJournal(object):
+    """
+    SQLite backed record of the upload id and sent chunks for each large file being uploaded.
+    Can be used from multiple threads of the process that created it.
+    Database errors are reported once after which the journal is disabled so the upload continues without it.
+    """
+    def __init__(self, filename):
+        """
+        Setup journal stored in filename. The database is opened when first used.
+        :param filename: str: path to the sqlite database to store uploads in
+        """
+        self.filename = os.path.expanduser(filename)
+        self.conn = None
+        self.conn_pid = None
+        self.disabled = False
+        self.lock = threading.Lock()
+
+    def _get_connection(self):
+        """
+        Open the database if necessary. Connections are not shared with child processes.
+        :return: sqlite3.Connection
+        """
+        if self.conn is None or self.conn_pid != os.getpid():
+            parent_dir = os.path.dirname(self.filename)
+            if parent_dir and not os.path.exists(parent_dir):
+                os.makedirs(parent_dir)
+            self.conn = sqlite3.connect(self.filename, timeout=SQLITE_LOCK_TIMEOUT_SECONDS,
+                                        check_same_thread=False)
+            self.conn_pid = os.getpid()
+            self.conn.execute(JOURNAL_MODE_SQL)
+            self.conn.execute(SYNCHRONOUS_SQL)
+            self.conn.execute(CREATE_UPLOADS_TABLE_SQL)
+            self.conn.execute(CREATE_CHUNKS_TABLE_SQL)
+            self._remove_expired_uploads()
+            self.conn.commit()
+        return self.conn
+
+    def _remove_expired_uploads(self):
+        expire_before = time.time() - EXPIRE_UPLOADS_AFTER_SECONDS
+        for (upload_id,) in self.conn.execute(FIND_EXPIRED_UPLOADS_SQL, (expire_before,)).fetchall():
+            self.conn.execute(DELETE_CHUNKS_SQL, (upload_id,))
+            self.conn.execute(DELETE_UPLOAD_SQL, (upload_id,))
+
+    def find_upload(self, project_id, path, stat_info, chunk_size):
+        """
+        Find an unfinished upload for path if the file is unchanged since the upload was started.
+        :param project_id: str: uuid of the project we are uploading into
+        :param path: str: absolute path to the file
+        :param stat_info: os.stat_result: current stat info about the file
+        :param chunk_size: int: size of the chunks we are uploading
+        :return: (str, set): (upload id, set of chunk numbers already sent) or None if not found
+        """
+        with self.lock:
+            if not self.disabled:
+                try:
+                    return self._find_upload(project_id, path, stat_info, chunk_size)
+                except sqlite3.Error as err:
+                    self._database_error(err)
+            return None
+
+    def _find_upload(self, project_id, path, stat_info, chunk_size):
+        conn = self._get_connection()
+        row = conn.execute(FIND_UPLOAD_SQL, (project_id, path)).fetchone()
+        if row:
+            size, mtime_ns, upload_chunk_size, upload_id = row
+            if (size, mtime_ns, upload_chunk_size) == (stat_info.st_size, get_mtime_ns(stat_info), chunk_size):
+                chunk_rows = conn.execute(FIND_SENT_CHUNKS_SQL, (upload_id,)).fetchall()
+                return upload_id, set(chunk_num for (chunk_num,) in chunk_rows)
+        return None
+
+    def start_upload(self, project_id, path, stat_info, chunk_size, upload_id):
+        """
+        Record a new upload for path replacing any previous upload.
+        :param project_id: str: uuid of the project we are uploading into
+        :param path: str: absolute path to the file
+        :param stat_info: os.stat_result: stat info about the file from before it was read
+        :param chunk_size: int: size of the chunks we are uploading
+        :param upload_id: str: uuid of the upload created for this file
+        """
+        with self.lock:
+            if not self.disabled:
+                try:
+                    self._start_upload(project_id, path, stat_info, chunk_size, upload_id)
+                except sqlite3.Error as err:
+                    self._database_error(err)
+
+    def _start_upload(self, project_id, path, stat_info, chunk_size, upload_id):
+        conn = self._get_connection()
+        row = conn.execute(FIND_UPLOAD_SQL, (project_id, path)).fetchone()
+        if row:
+            conn.execute(DELETE_CHUNKS_SQL, (row[3],))
+        conn.execute(SAVE_UPLOAD_SQL, (project_id, path, stat_info.st_size, get_mtime_ns(stat_info), chunk_size,
+                                       upload_id, time.time()))
+        conn.commit()
+
+    def chunk_sent(self, upload_id, chunk_num):
+        """
+        Record that a chunk has been sent so it will be skipped if the upload is resumed.
+        :param upload_id: str: uuid of the upload the chunk is part of
+        :param chunk_num: int: number of the chunk that was sent
+        """
+        with self.lock:
+            if not self.disabled:
+                try:
+                    conn = self._get_connection()
+                    conn.execute(SAVE_CHUNK_SQL, (upload_id, chunk_num))
+                    conn.commit()
+                except sqlite3.Error as err:
+                    self._database_error(err)
+
+    def remove_upload(self, upload_id):
+        """
+        Remove an upload once it has been completed or can no longer be resumed.
+        :param upload_id: str: uuid of the upload
+        """
+        with self.lock:
+            if not self.disabled:
+                try:
+                    conn = self._get_connection()
+                    conn.execute(DELETE_CHUNKS_SQL, (upload_id,))
+                    conn.execute(DELETE_UPLOAD_SQL, (upload_id,))
+                    conn.commit()
+                except sqlite3.Error as err:
+                    self._database_error(err)
+
+    def _database_error(self, err):
+        """
+        Undo the failed change, warn the user and stop using the journal for the rest of this process.
+        :param err: sqlite3.Error: error raised by the database
+        """
+        if self.conn is not None and self.conn_pid == os.getpid():
+            try:
+                self.conn.rollback()
+            except sqlite3.Error:
+                pass
+        sys.stderr.write("Unable to use upload journal {}, continuing without it: {}\n".format(self.filename, err))
+        self.disabled = True
+
+    def close(self):
+        """
+        Close the database.
+        """
+        if self.conn is not None and self.conn_pid == os.getpid():
+            self.conn.close()
+        self.conn = None
+
+
+_upload_journal = None
+
+
+def get_upload_journal():
+    """
+    Return the UploadJournal used when uploading large files or None if resuming uploads is disabled.
+    """
+    return _upload_journal
+
+
+def set_upload_journal(upload_journal):
+    """
+    Set the UploadJournal used when uploading large files, closing any previous journal.
+    :param upload_journal: UploadJournal: journal to use or None to disable resuming uploads
+    """
+    global _upload_journal
+    if _upload_journal:
+        _upload_journal.close()
+    _upload_journal = upload_journal
+
+
+def setup_upload_journal(config):
+    """
+    Enable the upload journal based on config settings. Disables it if the journal file cannot be used.
+    :param config: ddsc.config.Config: contains upload_journal_filename
+    """
+    upload_journal = None
+    if config.upload_journal_filename:
+        upload_journal = UploadJournal(config.upload_journal_filename)
+        try:
+            upload_journal._get_connection()
+        except (sqlite3.Error, OSError) as err:
+            sys.stderr.write("Unable to use upload journal {}: {}\n".format(upload_journal.filename, err))
+            upload_journal = None
+    set_upload_journal(upload_journal)
@@ -2,6 +2,7 @@ import sys
 import os
 import platform
 import stat
+from six.moves import intern
 
 TERMINAL_ENCODING_NOT_UTF_ERROR = """
 ERROR: DukeDSClient requires UTF terminal encoding.
@@ -20,6 +21,52 @@ chmod 600 ~/.ddsclient
 """
 
 
+def intern_str(value):
+    """
+    Intern a string value so the many tree items with the same name or hash algorithm share one string.
+    Values that can't be interned (such as unicode on python 2 or None) are returned as is.
+    :param value: str: value to intern
+    :return: str: interned value
+    """
+    try:
+        return intern(value)
+    except TypeError:
+        return value
+
+
+class ListDirEntry(object):
+    """
+    Minimal stand in for os.DirEntry used by scandir on python versions that don't provide os.scandir.
+    """
+    def __init__(self, dir_path, name):
+        self.name = name
+        self.path = os.path.join(dir_path, name)
+
+    def is_dir(self, follow_symlinks=True):
+        if follow_symlinks:
+            return os.path.isdir(self.path)
+        return not self.is_symlink() and os.path.isdir(self.path)
+
+    def is_symlink(self):
+        return os.path.islink(self.path)
+
+    def stat(self, follow_symlinks=True):
+        if follow_symlinks:
+            return os.stat(self.path)
+        return os.lstat(self.path)
+
+
+def scandir(dir_path):
+    """
+    List the entries of a directory with a single readdir, using os.scandir when available.
+    :param dir_path: str: path of the directory to list
+    :return: [os.DirEntry or ListDirEntry]: entries for each child of dir_path
+    """
+    if hasattr(os, 'scandir'):
+        return list(os.scandir(dir_path))
+    return [ListDirEntry(dir_path, name) for name in os.listdir(dir_path)]
+
+
 class KindType(object):
     """
     The types of items that are part of a project. Strings are from the duke-data-service.
@@ -319,6 +366,21 @@ def wait_for_processes(processes, size, progress_queue, watcher, item):
     :param watcher: ProgressPrinter: we notify of our progress:
     :param item: object: RemoteFile/LocalFile we are transferring.
     """
+    wait_for_progress(processes, size, progress_queue, watcher, item)
+    for process in processes:
+        process.join()
+
+
+def wait_for_progress(processes, size, progress_queue, watcher, item):
+    """
+    Watch progress queue for errors or progress until size values have been processed.
+    Terminates processes and raises ValueError on error.
+    :param processes: [Process]: processes we will terminate on error
+    :param size: int: how many values we expect to be processed by processes
+    :param progress_queue: ProgressQueue: queue which will receive tuples of progress or error
+    :param watcher: ProgressPrinter: we notify of our progress:
+    :param item: object: RemoteFile/LocalFile we are transferring.
+    """
     while size > 0:
         progress_type, value = progress_queue.get()
         if progress_type == ProgressQueue.PROCESSED:
@@ -334,8 +396,6 @@ def wait_for_processes(processes, size, progress_queue, watcher, item):
             for process in processes:
                 process.terminate()
             raise ValueError(error_message)
-    for process in processes:
-        process.join()
 
 
 def verify_terminal_encoding(encoding):
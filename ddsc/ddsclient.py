@@ -10,6 +10,9 @@ from ddsc.core.upload import ProjectUpload
 from ddsc.cmdparser import CommandParser, format_destination_path, replace_invalid_path_chars
 from ddsc.core.download import ProjectDownload
 from ddsc.core.util import ProjectDetailsList, verify_terminal_encoding
+from ddsc.core.hashcache import setup_hash_cache, set_hash_cache
+from ddsc.core.uploadjournal import setup_upload_journal, set_upload_journal
+from ddsc.core.httpsession import setup_session_registry
 from ddsc.core.pathfilter import PathFilter
 from ddsc.versioncheck import check_version, VersionException, get_internal_version_str
 from ddsc.config import create_config
@@ -80,8 +83,15 @@ class DDSClient(object):
         self._check_pypi_version()
         config = create_config(allow_insecure_config_file=args.allow_insecure_config_file)
         self.show_error_stack_trace = config.debug_mode
-        command = command_constructor(config)
-        command.run(args)
+        setup_hash_cache(config)
+        setup_upload_journal(config)
+        setup_session_registry(config)
+        try:
+            command = command_constructor(config)
+            command.run(args)
+        finally:
+            set_hash_cache(None)
+            set_upload_journal(None)
 
 
 class BaseCommand(object):
@@ -163,6 +173,9 @@ class UploadCommand(BaseCommand):
         dry_run = args.dry_run                  # do not upload anything, instead print out what you would upload
 
         project_upload = ProjectUpload(self.config, project_name_or_id, folders, follow_symlinks=follow_symlinks)
+        duplicates_summary = project_upload.get_duplicates_summary()
+        if duplicates_summary:
+            print(duplicates_summary)
         if dry_run:
             print(project_upload.dry_run_report())
         else:
@@ -145,3 +145,104 @@ class TestConfig(TestCase):
         }
         config.update_properties(some_config)
         self.assertEqual(config.page_size, 200)
+
+    def test_hash_cache_settings(self):
+        config = ddsc.config.Config()
+        self.assertEqual(config.hash_cache_filename, ddsc.config.HASH_CACHE_FILENAME_DEFAULT)
+        self.assertEqual(config.hash_cache_max_items, ddsc.config.HASH_CACHE_MAX_ITEMS_DEFAULT)
+        config.update_properties({
+            'hash_cache_filename': '',
+            'hash_cache_max_items': '1000',
+        })
+        self.assertEqual(config.hash_cache_filename, '')
+        self.assertEqual(config.hash_cache_max_items, 1000)
+
+    def test_upload_bytes_in_flight(self):
+        config = ddsc.config.Config()
+        self.assertEqual(config.upload_bytes_in_flight, None)
+        config.update_properties({'upload_bytes_in_flight': '500MB'})
+        self.assertEqual(config.upload_bytes_in_flight, 500 * 1024 * 1024)
+
+    def test_upload_stream_chunks_over(self):
+        config = ddsc.config.Config()
+        self.assertEqual(config.upload_stream_chunks_over, None)
+        config.update_properties({'upload_stream_chunks_over': '50MB'})
+        self.assertEqual(config.upload_stream_chunks_over, 50 * 1024 * 1024)
+
+    def test_download_bytes_in_flight(self):
+        config = ddsc.config.Config()
+        self.assertEqual(config.download_bytes_in_flight, None)
+        config.update_properties({'download_bytes_in_flight': '200MB'})
+        self.assertEqual(config.download_bytes_in_flight, 200 * 1024 * 1024)
+
+    def test_upload_journal_filename(self):
+        config = ddsc.config.Config()
+        self.assertEqual(config.upload_journal_filename, ddsc.config.UPLOAD_JOURNAL_FILENAME_DEFAULT)
+        config.update_properties({'upload_journal_filename': ''})
+        self.assertEqual(config.upload_journal_filename, '')
+
+    def test_scan_workers(self):
+        config = ddsc.config.Config()
+        self.assertEqual(config.scan_workers, ddsc.config.SCAN_WORKERS_DEFAULT)
+        config.update_properties({'scan_workers': '8'})
+        self.assertEqual(config.scan_workers, 8)
+        config.update_properties({'scan_workers': 0})
+        self.assertEqual(config.scan_workers, 1)
+
+    def test_hash_workers(self):
+        config = ddsc.config.Config()
+        self.assertEqual(config.hash_workers, ddsc.config.default_num_workers())
+        config.update_properties({'hash_workers': '16'})
+        self.assertEqual(config.hash_workers, 16)
+
+    def test_hash_cache_trust_mtime(self):
+        config = ddsc.config.Config()
+        self.assertEqual(config.hash_cache_trust_mtime, False)
+        config.update_properties({'hash_cache_trust_mtime': True})
+        self.assertEqual(config.hash_cache_trust_mtime, True)
+
+    def test_http_pool_settings(self):
+        config = ddsc.config.Config()
+        self.assertEqual(config.http_pool_connections, ddsc.config.HTTP_POOL_CONNECTIONS_DEFAULT)
+        self.assertEqual(config.http_pool_maxsize, ddsc.config.HTTP_POOL_MAXSIZE_DEFAULT)
+        self.assertEqual(config.http_tcp_keep_alive, True)
+        config.update_properties({'http_pool_connections': 4, 'http_pool_maxsize': '32', 'http_tcp_keep_alive': False})
+        self.assertEqual(config.http_pool_connections, 4)
+        self.assertEqual(config.http_pool_maxsize, 32)
+        self.assertEqual(config.http_tcp_keep_alive, False)
+
+    def test_upload_executor(self):
+        config = ddsc.config.Config()
+        self.assertEqual(config.upload_executor, 'process')
+        config.update_properties({'upload_executor': 'thread'})
+        self.assertEqual(config.upload_executor, 'thread')
+
+    def test_transfer_engine(self):
+        config = ddsc.config.Config()
+        self.assertEqual(config.transfer_engine, 'process')
+        self.assertEqual(config.transfer_concurrency, ddsc.config.TRANSFER_CONCURRENCY_DEFAULT)
+        config.update_properties({'transfer_engine': 'thread', 'transfer_concurrency': '500'})
+        self.assertEqual(config.transfer_engine, 'thread')
+        self.assertEqual(config.transfer_concurrency, 500)
+
+    def test_small_file_engine(self):
+        config = ddsc.config.Config()
+        self.assertEqual(config.small_file_engine, 'task')
+        self.assertEqual(config.small_file_pipeline_depth, ddsc.config.SMALL_FILE_PIPELINE_DEPTH_DEFAULT)
+        config.update_properties({'small_file_engine': 'pipeline', 'small_file_pipeline_depth': '128'})
+        self.assertEqual(config.small_file_engine, 'pipeline')
+        self.assertEqual(config.small_file_pipeline_depth, 128)
+
+    def test_upload_bundle_settings(self):
+        config = ddsc.config.Config()
+        self.assertEqual(config.upload_bundle_max_file_size, None)
+        self.assertEqual(config.upload_bundle_min_files, ddsc.config.UPLOAD_BUNDLE_MIN_FILES_DEFAULT)
+        config.update_properties({'upload_bundle_max_file_size': '4096', 'upload_bundle_min_files': '10'})
+        self.assertEqual(config.upload_bundle_max_file_size, 4096)
+        self.assertEqual(config.upload_bundle_min_files, 10)
+
+    def test_upload_duplicate_files(self):
+        config = ddsc.config.Config()
+        self.assertEqual(config.upload_duplicate_files, 'off')
+        config.update_properties({'upload_duplicate_files': 'skip'})
+        self.assertEqual(config.upload_duplicate_files, 'skip')